@@ -0,0 +1,177 @@
+# Микробенчмарки кода, который выполняется на каждое нажатие: клавиатуры, корзина, ключи позиций,
+# разбор callback_data и заказов. Работает без сети и БД, входные данные фиксированы.
+#
+#   python benchmarks/bench_hot_paths.py                     # замер, сравнение с baseline.json
+#   python benchmarks/bench_hot_paths.py --update-baseline   # сохранить текущие результаты как эталон
+#
+# Эталон зависит от машины: обновляйте его на той же машине (CI), на которой идёт сравнение.
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMIN_USER_ID", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import main
+import menu
+from database import Order, read_menu_json
+from keyboards import build_pizza_custom_keyboard, product_buttons, order_status_buttons, INGREDIENT_BITS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS = os.path.join(HERE, "results.json")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+ALL_INGREDIENTS = (1 << len(INGREDIENT_BITS)) - 1
+
+
+def load_menu() -> menu.MenuSnapshot:
+    # Настоящее меню из menu_data.json, размноженное до размера крупной пиццерии
+    data = read_menu_json(os.path.join(ROOT, "menu_data.json"))
+    rows = []
+    for copy in range(4):
+        for category, items in data.items():
+            for item in items:
+                rows.append({
+                    "id": len(rows) + 1,
+                    "category": category,
+                    "name": item["name"] if copy == 0 else f"{item['name']} {copy}",
+                    "description": item.get("description", ""),
+                    "price_small": item.get("price_small"),
+                    "price_large": item.get("price_large"),
+                    "image_url": item.get("image_url", ""),
+                })
+    return menu.MenuSnapshot(1, rows)
+
+
+def build_cart(snapshot: menu.MenuSnapshot) -> dict:
+    # Большая корзина: все товары меню по разу плюс несколько "Собери сам" со всеми ингредиентами
+    user_id = 10 ** 9
+    main.user_carts.pop(user_id, None)
+    for item in snapshot:
+        size = "large" if item["category"] == "Пиццы" else "nosize"
+        line = main.menu_line_item(item, size)
+        if line:
+            main.add_to_cart_safe(user_id, main.get_item_key(item["id"], size), *line,
+                                  product_id=item["id"], size=size)
+    for mask in (ALL_INGREDIENTS, ALL_INGREDIENTS >> 1, 0b1010101):
+        main.add_to_cart_safe(user_id, main.get_item_key(0, "large", custom=True, mask=mask),
+                              "🍕 Собери сам (Большая)", 990, 1, details={"size": "large", "mask": mask})
+    return main.user_carts[user_id]
+
+
+def build_order_rows(cart: dict, count: int = 1000) -> list:
+    items = json.dumps([
+        {"name": item["name"], "product": item["name"], "price": item["price_per_unit"],
+         "quantity": item["quantity"], "product_id": item["product_id"], "size": item["size"]}
+        for item in list(cart.values())[:8]
+    ], ensure_ascii=False)
+    return [
+        {"id": i, "user_id": 1000 + i % 50, "items": items, "total": 2500, "address": "ул. Ленина, 1",
+         "phone": 79990000000, "payment_method": 2, "status": "new", "created_at": None}
+        for i in range(count)
+    ]
+
+
+def build_cases() -> dict:
+    snapshot = load_menu()
+    menu._snapshot = snapshot
+    cart = build_cart(snapshot)
+    rows = build_order_rows(cart)
+    callbacks = [f"add_{item['id']}_large" for item in snapshot] + ["add_7_nosize", "add_12_small", "add_bad_small"]
+    pizza = next(item for item in snapshot if item["category"] == "Пиццы")
+
+    def add_many():
+        user_id = 10 ** 9 + 1
+        main.user_carts.pop(user_id, None)
+        for i in range(50):
+            main.add_to_cart_safe(user_id, main.get_item_key(i % 10, "large"), "Пицца", 650, 1)
+
+    def parse_orders():
+        return sum(len(Order(row).items) for row in rows)
+
+    # (функция, число вызовов на замер)
+    return {
+        "build_pizza_custom_keyboard[all]": (lambda: build_pizza_custom_keyboard(ALL_INGREDIENTS, 500, "large"), 2000),
+        "build_pizza_custom_keyboard[empty]": (lambda: build_pizza_custom_keyboard(0, 500, "small"), 2000),
+        "product_buttons": (lambda: product_buttons(str(pizza["id"]), pizza["price_small"], pizza["price_large"]), 20000),
+        "order_status_buttons": (lambda: order_status_buttons(42, "cooking"), 20000),
+        "render_cart_text[large]": (lambda: main.render_cart_text(cart), 2000),
+        "get_item_key": (lambda: main.get_item_key(1234, "large"), 200000),
+        "get_item_key[custom]": (lambda: main.get_item_key(0, "large", custom=True, mask=ALL_INGREDIENTS), 200000),
+        "add_to_cart_safe[x50]": (add_many, 2000),
+        "parse_add_callback": (lambda: [main.parse_add_callback(data) for data in callbacks], 2000),
+        "Order.items[x1000]": (parse_orders, 20),
+    }
+
+
+def run(cases: dict, repeat: int = 5) -> dict:
+    results = {}
+    for name, (func, number) in cases.items():
+        func()  # прогрев
+        seconds = min(timeit.repeat(func, number=number, repeat=repeat))
+        results[name] = round(seconds / number * 1e6, 3)
+        print(f"  {name:<38} {results[name]:>10.2f} мкс/вызов")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = value / base - 1
+        mark = "❌" if change > threshold else "  "
+        print(f"{mark} {name:<38} {base:>10.2f} → {value:>10.2f} ({change:+.0%})")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей бота")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="куда сохранить результаты")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="эталон для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление, доля (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="записать результаты в эталон")
+    args = parser.parse_args()
+
+    print("Замер:")
+    results = run(build_cases())
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "unit": "us_per_call",
+        "results": results,
+    }
+    with open(args.results, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Эталон обновлён: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"Эталона нет ({args.baseline}) — создайте его с --update-baseline")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    print(f"\nСравнение с эталоном (порог {args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nЗамедлились: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
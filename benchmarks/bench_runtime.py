@@ -0,0 +1,111 @@
+# Сравнение стандартного рантайма с FAST_RUNTIME (orjson + uvloop).
+# Запуск из корня репозитория: python benchmarks/bench_runtime.py
+import os
+import sys
+import json
+import time
+import timeit
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+ORDER_ITEMS = [
+    {"name": f"Пицца №{i} (Большая)", "product": f"Пицца №{i} (Большая)", "price": 650 + i, "quantity": 1 + i % 3}
+    for i in range(8)
+] + [{
+    "name": "🍕 Собери сам (large) + " + ", ".join(f"Ингредиент {i} 50г" for i in range(20)),
+    "product": "🍕 Собери сам (Большая)",
+    "price": 990,
+    "quantity": 1,
+}]
+
+UPDATE = {
+    "update_id": 123456789,
+    "callback_query": {
+        "id": "4382bfdwdsb323b2d9",
+        "from": {"id": 111222333, "is_bot": False, "first_name": "Иван", "language_code": "ru"},
+        "message": {
+            "message_id": 4242,
+            "date": 1760000000,
+            "chat": {"id": 111222333, "type": "private", "first_name": "Иван"},
+            "text": "🛒 Ваш заказ:\n\n" + "\n".join(f"• Пицца №{i} — 650₽ × 1 = 650₽" for i in range(10)),
+            "reply_markup": {"inline_keyboard": [
+                [{"text": f"Кнопка {i}", "callback_data": f"cart_inc_i{i}s"}] for i in range(10)
+            ]},
+        },
+        "chat_instance": "-1234567890",
+        "data": "add_12_large",
+    },
+}
+
+
+def _bench(label: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"  {label:<28} {seconds / number * 1e6:8.2f} мкс/оп")
+    return seconds
+
+
+def bench_json():
+    items_text = json.dumps(ORDER_ITEMS, ensure_ascii=False)
+    update_text = json.dumps(UPDATE, ensure_ascii=False)
+    cases = [
+        ("dumps заказа", lambda: json.dumps(ORDER_ITEMS, ensure_ascii=False),
+         lambda: orjson.dumps(ORDER_ITEMS).decode()),
+        ("loads заказа", lambda: json.loads(items_text), lambda: orjson.loads(items_text)),
+        ("loads апдейта", lambda: json.loads(update_text), lambda: orjson.loads(update_text)),
+        ("dumps апдейта", lambda: json.dumps(UPDATE, ensure_ascii=False), lambda: orjson.dumps(UPDATE).decode()),
+    ]
+    print("JSON:")
+    for label, std, fast in cases:
+        base = _bench(f"{label} (json)", std, 20000)
+        if orjson is not None:
+            faster = _bench(f"{label} (orjson)", fast, 20000)
+            print(f"  {'':<28} ускорение ×{base / faster:.1f}")
+    if orjson is None:
+        print("  orjson не установлен — сравнение пропущено")
+
+
+async def _ping_pong(rounds: int):
+    # Много мелких задач и переключений — типичная нагрузка бота на пике
+    async def worker():
+        for _ in range(rounds):
+            await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker() for _ in range(100)))
+
+
+def _run_loop(new_loop, rounds: int) -> float:
+    loop = new_loop()
+    try:
+        started = time.perf_counter()
+        loop.run_until_complete(_ping_pong(rounds))
+        return time.perf_counter() - started
+    finally:
+        loop.close()
+
+
+def bench_loop(rounds: int = 2000):
+    print("Цикл событий (100 задач × %d переключений):" % rounds)
+    base = min(_run_loop(asyncio.new_event_loop, rounds) for _ in range(3))
+    print(f"  {'asyncio':<28} {base * 1000:8.1f} мс")
+    if uvloop is None:
+        print("  uvloop не установлен — сравнение пропущено")
+        return
+    faster = min(_run_loop(uvloop.new_event_loop, rounds) for _ in range(3))
+    print(f"  {'uvloop':<28} {faster * 1000:8.1f} мс")
+    print(f"  {'':<28} ускорение ×{base / faster:.1f}")
+
+
+if __name__ == "__main__":
+    bench_json()
+    bench_loop()
@@ -0,0 +1,173 @@
+import time
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from config import BROADCAST_RATE
+from database import (
+    claim_broadcast, save_broadcast_progress, fetch_broadcast_recipients, mark_user_blocked, get_running_broadcasts
+)
+from lifecycle import spawn
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+LEASE_SECONDS = 120
+CHECKPOINT_EVERY = 50  # получателей
+CHECKPOINT_INTERVAL = 10.0  # секунд
+REPORT_INTERVAL = 5.0  # секунд между правками сообщения с прогрессом
+
+_tasks = {}
+
+
+def _progress_text(broadcast_id: int, sent: int, failed: int, blocked: int, status: str) -> str:
+    title = {
+        "running": "📣 Рассылка идёт",
+        "done": "✅ Рассылка завершена",
+        "cancelled": "⛔ Рассылка остановлена",
+    }.get(status, f"📣 Рассылка: {status}")
+    return (
+        f"{title} (#{broadcast_id})\n\n"
+        f"Отправлено: <b>{sent}</b>\n"
+        f"Заблокировали бота: {blocked}\n"
+        f"Ошибок: {failed}"
+    )
+
+
+class _Reporter:
+    # Одно сообщение админу, которое редактируется не чаще раза в REPORT_INTERVAL секунд
+    def __init__(self, bot: Bot, chat_id: int, broadcast_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.broadcast_id = broadcast_id
+        self.message_id = None
+        self.last_report = 0.0
+
+    async def report(self, sent: int, failed: int, blocked: int, status: str = "running", force: bool = False):
+        if not self.chat_id:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return
+        self.last_report = now
+        text = _progress_text(self.broadcast_id, sent, failed, blocked, status)
+        try:
+            if self.message_id is None:
+                message = await self.bot.send_message(self.chat_id, text, parse_mode="HTML")
+                self.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, parse_mode="HTML")
+        except TelegramBadRequest:
+            pass  # "message is not modified"
+        except Exception as e:
+            logger.warning("Не удалось обновить прогресс рассылки #%s: %s", self.broadcast_id, e)
+
+
+async def _send_one(bot: Bot, user_id: int, text: str) -> str:
+    while True:
+        try:
+            await bot.send_message(user_id, text)
+            return "sent"
+        except TelegramRetryAfter as e:
+            logger.warning("📣 Flood control: пауза %s с", e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked"
+        except Exception as e:
+            logger.warning("Не удалось отправить рассылку пользователю %s: %s", user_id, e)
+            return "failed"
+
+
+async def run_broadcast(bot: Bot, broadcast):
+    broadcast_id = broadcast["id"]
+    if not await claim_broadcast(broadcast_id, LEASE_SECONDS):
+        logger.info("📣 Рассылка #%s уже выполняется другим экземпляром.", broadcast_id)
+        return
+
+    text = broadcast["text"]
+    last_user_id = broadcast["last_user_id"]
+    sent, failed, blocked = broadcast["sent"], broadcast["failed"], broadcast["blocked"]
+    reporter = _Reporter(bot, broadcast["report_chat_id"], broadcast_id)
+    interval = 1.0 / BROADCAST_RATE
+    since_checkpoint = 0
+    last_checkpoint = time.monotonic()
+    status = "running"
+    logger.info("📣 Рассылка #%s запущена с user_id > %s", broadcast_id, last_user_id)
+
+    try:
+        while status == "running":
+            page = await fetch_broadcast_recipients(last_user_id, PAGE_SIZE)
+            if not page:
+                status = "done"
+                break
+            for row in page:
+                started = time.monotonic()
+                user_id = row["user_id"]
+                result = await _send_one(bot, user_id, text)
+                if result == "sent":
+                    sent += 1
+                elif result == "blocked":
+                    blocked += 1
+                    await mark_user_blocked(user_id)
+                else:
+                    failed += 1
+                last_user_id = user_id
+                since_checkpoint += 1
+
+                now = time.monotonic()
+                if since_checkpoint >= CHECKPOINT_EVERY or now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    status = await save_broadcast_progress(
+                        broadcast_id, last_user_id, sent, failed, blocked, LEASE_SECONDS
+                    )
+                    since_checkpoint = 0
+                    last_checkpoint = now
+                    if status != "running":
+                        break
+                await reporter.report(sent, failed, blocked)
+
+                # Равномерный темп: BROADCAST_RATE сообщений в секунду с учётом времени самой отправки
+                delay = interval - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+    except asyncio.CancelledError:
+        # Остановка бота: прогресс сохранён ниже, после перезапуска рассылка продолжится с last_user_id
+        await save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked, 0)
+        raise
+    except Exception as e:
+        logger.error("❌ Рассылка #%s прервана: %s", broadcast_id, e)
+        await save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked, 0)
+        return
+
+    status = await save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked, 0, status=status)
+    await reporter.report(sent, failed, blocked, status=status, force=True)
+    logger.info("📣 Рассылка #%s: %s, отправлено %s, заблокировали %s, ошибок %s", broadcast_id, status, sent, blocked, failed)
+
+
+def start_broadcast(bot: Bot, broadcast):
+    broadcast_id = broadcast["id"]
+    if broadcast_id in _tasks and not _tasks[broadcast_id].done():
+        return
+    task = spawn(run_broadcast(bot, broadcast), name=f"broadcast_{broadcast_id}")
+    _tasks[broadcast_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(broadcast_id, None))
+
+
+async def resume_broadcasts(bot: Bot):
+    for broadcast in await get_running_broadcasts():
+        start_broadcast(bot, broadcast)
+
+
+def has_active_broadcast() -> bool:
+    return any(not task.done() for task in _tasks.values())
+
+
+async def stop_broadcasts(timeout: float = 5.0):
+    # При остановке бота: рассылки сохраняют прогресс и снимают аренду, после перезапуска продолжатся
+    tasks = [task for task in _tasks.values() if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+        logger.info("📣 Рассылки приостановлены до перезапуска: %s", len(tasks))
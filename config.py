@@ -22,9 +22,81 @@ if KITCHEN_CHAT_ID:
     except ValueError:
         raise ValueError("❌ KITCHEN_CHAT_ID должен быть целым числом!")
 
+# Живая доска: вместо сообщения на каждый заказ — одно закреплённое сообщение с активными заказами в KITCHEN_CHAT_ID
+KITCHEN_BOARD = os.getenv("KITCHEN_BOARD", "").lower() in ("1", "true", "yes")
+
 PAYMENT_CARD_NUMBER = os.getenv("PAYMENT_CARD_NUMBER")
 PAYMENT_BANK_NAME = os.getenv("PAYMENT_BANK_NAME")
 
 # Проверка платежных данных (если используется онлайн-оплата)
 if not PAYMENT_CARD_NUMBER or not PAYMENT_BANK_NAME:
-    print("⚠️ Внимание: PAYMENT_CARD_NUMBER или PAYMENT_BANK_NAME не заданы. Онлайн-оплата может не работать.")
\ No newline at end of file
+    print("⚠️ Внимание: PAYMENT_CARD_NUMBER или PAYMENT_BANK_NAME не заданы. Онлайн-оплата может не работать.")
+
+# Ограничения на хранение пользовательских сессий (корзины, сборка пиццы) в памяти
+try:
+    SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", 6 * 3600))
+    SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 20000))
+except ValueError:
+    raise ValueError("❌ SESSION_TTL_SECONDS и SESSION_MAX_ENTRIES должны быть целыми числами!")
+
+# Темп рассылки (сообщений в секунду); общий лимит Telegram — около 30 сообщений в секунду на бота
+try:
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 20))
+except ValueError:
+    raise ValueError("❌ BROADCAST_RATE должен быть числом!")
+if BROADCAST_RATE <= 0:
+    raise ValueError("❌ BROADCAST_RATE должен быть больше нуля!")
+
+# Сколько секунд при остановке ждать завершения уже принятых апдейтов (Render даёт процессу ~30 с после SIGTERM)
+try:
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", 20))
+except ValueError:
+    raise ValueError("❌ SHUTDOWN_DRAIN_TIMEOUT должен быть числом!")
+
+# Как получать апдейты: "webhook" — Telegram присылает их на RENDER_EXTERNAL_URL, "polling" — бот сам
+# забирает их через getUpdates (подходит для хостов без публичного адреса и для staging).
+# По умолчанию — webhook, если RENDER_EXTERNAL_URL задан, иначе polling
+BOT_MODE = (os.getenv("BOT_MODE") or ("webhook" if os.getenv("RENDER_EXTERNAL_URL") else "polling")).lower()
+if BOT_MODE not in ("webhook", "polling"):
+    raise ValueError("❌ BOT_MODE должен быть webhook или polling!")
+
+# Запись входящих апдейтов для воспроизведения (traffic.py, replay.py). Включается только явно: RECORD_UPDATES=путь к файлу
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
+try:
+    RECORD_MAX_BYTES = int(os.getenv("RECORD_MAX_BYTES", 50 * 1024 * 1024))
+except ValueError:
+    raise ValueError("❌ RECORD_MAX_BYTES должен быть целым числом!")
+try:
+    RECORD_BACKUPS = int(os.getenv("RECORD_BACKUPS", 5))
+except ValueError:
+    raise ValueError("❌ RECORD_BACKUPS должен быть целым числом!")
+# Соль псевдонимов. Без неё — случайная на процесс: один и тот же пользователь в пределах записи
+# получает один и тот же id, но сопоставить его с настоящим нельзя
+RECORD_SALT = (os.getenv("RECORD_SALT") or os.urandom(16).hex()).encode()
+
+# Апдейты обрабатываются внутри HTTP-запроса вебхука (ответ бота уходит в теле ответа),
+# поэтому одновременных соединений от Telegram нужно больше, чем по умолчанию (40)
+try:
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 100))
+except ValueError:
+    raise ValueError("❌ WEBHOOK_MAX_CONNECTIONS должен быть целым числом!")
+if not 1 <= WEBHOOK_MAX_CONNECTIONS <= 100:
+    raise ValueError("❌ WEBHOOK_MAX_CONNECTIONS должен быть от 1 до 100!")
+
+# Журнал заказов на случай недоступной БД: пока база не отвечает, заказы пишутся сюда (fsync на каждую запись)
+# и дописываются в orders после восстановления. Файл должен лежать на постоянном диске, а не во временном каталоге
+ORDER_JOURNAL_PATH = os.getenv("ORDER_JOURNAL_PATH", "order_journal.jsonl")
+# Сколько секунд ждать БД при оформлении заказа, прежде чем записать его в журнал
+try:
+    ORDER_DB_TIMEOUT = float(os.getenv("ORDER_DB_TIMEOUT", 3))
+except ValueError:
+    raise ValueError("❌ ORDER_DB_TIMEOUT должен быть числом!")
+
+# Сколько дней хранить завершённые заказы: по ним работают "Мои заказы" и кнопка "Повторить заказ".
+# Отменённые удаляются через час, как и раньше
+try:
+    ORDER_RETENTION_DAYS = int(os.getenv("ORDER_RETENTION_DAYS", 90))
+except ValueError:
+    raise ValueError("❌ ORDER_RETENTION_DAYS должен быть целым числом!")
+if ORDER_RETENTION_DAYS < 1:
+    raise ValueError("❌ ORDER_RETENTION_DAYS должен быть не меньше 1!")
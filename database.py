@@ -1,15 +1,31 @@
 import os
 import json
 import logging
+import time
+import uuid
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 import asyncpg
 
+from fast_runtime import json_dumps, json_loads, init_connection_codecs
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Необязательная реплика для чтений, которым не страшно отставание: истории заказов, списки и поиск в админке, выгрузка
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# Часовой пояс, по которому заказы раскладываются по дням в статистике
+STATS_TIMEZONE = os.getenv("STATS_TIMEZONE", "Europe/Kaliningrad")
 pool = None
+replica_pool = None
+
+REPLICA_STICKY_SECONDS = 30.0  # столько после записи чтения пользователя/заказа идут с основной базы
+REPLICA_RETRY_SECONDS = 30.0  # пауза перед новым обращением к реплике после ошибки
+_recent_writes = {}
+_replica_down_until = 0.0
+
 
 async def init_db():
     global pool
@@ -17,12 +33,14 @@ async def init_db():
         logger.error("❌ Переменная DATABASE_URL не установлена!")
         raise ValueError("❌ Переменная DATABASE_URL не установлена!")
     try:
-        pool = await asyncpg.create_pool(DATABASE_URL)
+        pool = await asyncpg.create_pool(DATABASE_URL, init=init_connection_codecs)
         logger.info("✅ Подключение к PostgreSQL установлено.")
     except Exception as e:
-        logger.error(f"❌ Ошибка подключения к базе данных: {e}")
+        logger.error("❌ Ошибка подключения к базе данных: %s", e)
         raise
 
+    await _init_replica()
+
     async with pool.acquire() as conn:
         try:
             # Проверяем, существует ли столбец 'phone', если нет - добавляем
@@ -34,6 +52,12 @@ async def init_db():
                 await conn.execute("ALTER TABLE orders ADD COLUMN phone TEXT DEFAULT ''")
                 logger.info("✅ Столбец 'phone' добавлен в таблицу 'orders'.")
 
+            await conn.execute("""
+                DO $$ BEGIN
+                    CREATE TYPE order_status AS ENUM ('new', 'cooking', 'delivery', 'done', 'cancelled');
+                EXCEPTION WHEN duplicate_object THEN NULL;
+                END $$
+            """)
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS orders (
                     id SERIAL PRIMARY KEY,
@@ -41,12 +65,17 @@ async def init_db():
                     items TEXT NOT NULL,
                     total INTEGER NOT NULL,
                     address TEXT,
-                    phone TEXT,
-                    payment_method TEXT,
-                    status TEXT DEFAULT 'new',
+                    phone BIGINT,
+                    payment_method SMALLINT,
+                    status order_status NOT NULL DEFAULT 'new',
                     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
                 )
             """)
+            await _migrate_compact_orders(conn)
+            await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS phone_raw TEXT")
+            # Ключ идемпотентности заказа: по нему журнал (order_journal.py) дописывает заказы без дублей
+            await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS journal_id UUID")
+            await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS orders_journal_id_key ON orders (journal_id)")
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS products (
                     id SERIAL PRIMARY KEY,
@@ -58,182 +87,931 @@ async def init_db():
                     image_url TEXT
                 )
             """)
+            # Порядок показа задаётся отдельно от id: id остаётся стабильным, даже если меню переставили
+            await conn.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS position INTEGER NOT NULL DEFAULT 0")
+            await _init_menu_notify(conn)
+            await _init_sales_stats(conn)
+            await _init_broadcasts(conn)
+            await _init_jobs(conn)
+            await _init_kitchen_board(conn)
+            await _init_order_search(conn)
         except Exception as e:
-            logger.error(f"❌ Ошибка при создании/модификации таблиц: {e}")
+            logger.error("❌ Ошибка при создании/модификации таблиц: %s", e)
             raise
 
-        try:
-            count = await conn.fetchval("SELECT COUNT(*) FROM products")
-            if count > 0:
-                logger.info("ℹ️ Товары уже загружены.")
-                return
-        except Exception as e:
-            logger.error(f"❌ Ошибка при подсчёте товаров в БД: {e}")
-            return
-
+    data = read_menu_json()
+    if data is None:
+        return
     try:
-        with open("menu_data.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
+        await sync_products(data)
     except Exception as e:
-        logger.error(f"❌ Ошибка чтения menu_data.json: {e}")
+        logger.error("❌ Ошибка синхронизации товаров: %s", e)
+
+
+async def _init_replica():
+    # Реплика не обязательна: если она недоступна при старте, все чтения идут с основной базы
+    global replica_pool
+    if not DATABASE_REPLICA_URL:
         return
+    try:
+        replica_pool = await asyncpg.create_pool(
+            DATABASE_REPLICA_URL, init=init_connection_codecs, min_size=1, max_size=5, timeout=5
+        )
+        logger.info("✅ Подключение к реплике PostgreSQL установлено.")
+    except Exception as e:
+        logger.warning("⚠️ Реплика недоступна, чтения пойдут с основной базы: %s", e)
+
+
+def _mark_written(*keys):
+    # Read-your-writes: ключи вида ("user", id) и ("order", id) на время читаются только с основной базы
+    now = time.monotonic()
+    if len(_recent_writes) > 10000:
+        for key, until in list(_recent_writes.items()):
+            if until <= now:
+                del _recent_writes[key]
+    for key in keys:
+        _recent_writes[key] = now + REPLICA_STICKY_SECONDS
+
+
+def _read_pool(sticky=()):
+    if replica_pool is None or time.monotonic() < _replica_down_until:
+        return pool
+    now = time.monotonic()
+    if any(_recent_writes.get(key, 0) > now for key in sticky):
+        return pool
+    return replica_pool
+
+
+# Ошибки связи с базой (а не с содержимым запроса): после них чтение повторяется на основной базе,
+# а заказ уходит в журнал до восстановления связи
+CONNECTION_ERRORS = (
+    OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError, asyncpg.TooManyConnectionsError,
+)
 
+
+def _replica_failed(e: Exception):
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+    logger.warning("⚠️ Ошибка реплики, чтение с основной базы: %s", e)
+
+
+async def _read(method: str, sql: str, *args, sticky=()):
+    # Чтение, которому допустимо отставание реплики; при её ошибке — повтор на основной базе
+    target = _read_pool(sticky)
+    if target is not pool:
+        try:
+            async with target.acquire(timeout=5) as conn:
+                return await getattr(conn, method)(sql, *args)
+        except CONNECTION_ERRORS as e:
+            _replica_failed(e)
     async with pool.acquire() as conn:
-        for category, items in data.items():
-            for item in items:
-                name = item.get("name")
-                if not name:
-                    continue
-                try:
-                    await conn.execute(
-                        """
-                        INSERT INTO products (category, name, description, price_small, price_large, image_url)
-                        VALUES ($1, $2, $3, $4, $5, $6)
-                        """,
-                        category,
-                        name,
-                        item.get("description", ""),
-                        item.get("price_small"),
-                        item.get("price_large"),
-                        item.get("image_url", "").strip()
-                    )
-                except Exception as e:
-                    logger.error(f"❌ Ошибка вставки товара '{name}': {e}")
-
-    logger.info("✅ Товары загружены в базу.")
-
-
-async def save_order(user_id: int, items: list, total: int, address: str, payment_method: str, phone: str = ""):
-    if pool is None:
-        logger.error("❌ Попытка сохранить заказ до инициализации пула соединений.")
-        return None
+        return await getattr(conn, method)(sql, *args)
+
+
+async def _migrate_compact_orders(conn):
+    # Таблицы, созданные до перехода на компактную схему: статус TEXT -> enum, оплата "💳 Онлайн" -> код,
+    # телефон в свободной форме -> цифры в BIGINT. Выполняется один раз, таблица перезаписывается целиком.
+    # Телефоны, которые не приводятся к цифрам, сохраняются как были в phone_raw — это контакты клиентов
+    status_type = await conn.fetchval("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'orders' AND column_name = 'status'
+    """)
+    if status_type != "text":
+        return
+
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE FUNCTION pg_temp.normalize_phone(raw TEXT) RETURNS BIGINT AS $$
+                SELECT CASE
+                    WHEN length(d) = 11 AND left(d, 1) = '8' THEN ('7' || substr(d, 2))::bigint
+                    WHEN length(d) = 10 THEN ('7' || d)::bigint
+                    WHEN length(d) BETWEEN 5 AND 15 THEN d::bigint
+                END
+                FROM (SELECT regexp_replace(coalesce(raw, ''), '\\D', '', 'g') AS d) digits
+            $$ LANGUAGE sql IMMUTABLE
+        """)
+        await conn.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS phone_raw TEXT")
+        kept = await conn.fetchval("""
+            WITH kept AS (
+                UPDATE orders SET phone_raw = phone
+                WHERE pg_temp.normalize_phone(phone) IS NULL AND btrim(coalesce(phone, '')) <> ''
+                RETURNING id
+            )
+            SELECT count(*) FROM kept
+        """)
+        # Частичный индекс и DEFAULT зависят от старого типа столбца — пересоздаются ниже
+        await conn.execute("DROP INDEX IF EXISTS orders_active_idx")
+        await conn.execute("ALTER TABLE orders ALTER COLUMN status DROP DEFAULT, ALTER COLUMN phone DROP DEFAULT")
+        await conn.execute("""
+            ALTER TABLE orders
+                ALTER COLUMN status TYPE order_status USING (
+                    CASE WHEN status IN ('new', 'cooking', 'delivery', 'done', 'cancelled')
+                         THEN status::order_status ELSE 'new' END
+                ),
+                ALTER COLUMN status SET DEFAULT 'new',
+                ALTER COLUMN status SET NOT NULL,
+                ALTER COLUMN payment_method TYPE SMALLINT USING (
+                    CASE WHEN payment_method LIKE '%Онлайн%' THEN 1
+                         WHEN payment_method LIKE '%Налич%' THEN 2
+                         ELSE 0 END
+                ),
+                ALTER COLUMN phone TYPE BIGINT USING pg_temp.normalize_phone(phone)
+        """)
+    logger.info("✅ Таблица orders переведена на компактную схему (enum статуса, код оплаты, телефон BIGINT).")
+    if kept:
+        logger.warning("⚠️ Телефонов не в формате номера: %s — исходный текст сохранён в orders.phone_raw", kept)
+
+
+async def _init_menu_notify(conn):
+    # Любое изменение products (в том числе ручное) рассылает NOTIFY — все реплики перечитывают меню
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_menu_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('menu_changed', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        await conn.execute("DROP TRIGGER IF EXISTS products_menu_changed ON products")
+        await conn.execute("""
+            CREATE TRIGGER products_menu_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_menu_changed()
+        """)
+
+
+def read_menu_json(path: str = "menu_data.json"):
     try:
-        items_json = json.dumps(items, ensure_ascii=False)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
     except Exception as e:
-        logger.error(f"❌ Ошибка сериализации заказа: {e}")
+        logger.error("❌ Ошибка чтения %s: %s", path, e)
+        return None
+
+
+PRODUCT_COLUMNS = ("category", "name", "description", "price_small", "price_large", "image_url", "position")
+
+
+async def sync_products(data: dict) -> dict:
+    # Приводит products к содержимому menu_data.json: товар определяется парой (категория, название),
+    # поэтому у существующих товаров id не меняется. Новые строки вставляются одним COPY.
+    desired = []
+    for category, items in data.items():
+        for item in items:
+            name = item.get("name")
+            if not name:
+                continue
+            desired.append((
+                category,
+                name,
+                item.get("description", ""),
+                item.get("price_small"),
+                item.get("price_large"),
+                item.get("image_url", "").strip(),
+                len(desired)
+            ))
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            # Несколько реплик могут стартовать одновременно — синхронизирует только одна за раз
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('products_sync'))")
+            rows = await conn.fetch(f"SELECT id, {', '.join(PRODUCT_COLUMNS)} FROM products ORDER BY id")
+            existing = {}
+            deletes = []
+            for row in rows:
+                key = (row["category"], row["name"])
+                if key in existing:
+                    deletes.append(row["id"])  # дубликаты от старого посева
+                else:
+                    existing[key] = row
+
+            inserts = []
+            updates = []
+            for record in desired:
+                row = existing.pop((record[0], record[1]), None)
+                if row is None:
+                    inserts.append(record)
+                elif tuple(row[column] for column in PRODUCT_COLUMNS) != record:
+                    updates.append((row["id"], *record[2:]))
+            deletes.extend(row["id"] for row in existing.values())
+
+            if inserts:
+                await conn.copy_records_to_table("products", records=inserts, columns=PRODUCT_COLUMNS)
+            if updates:
+                await conn.executemany(
+                    """
+                    UPDATE products
+                    SET description = $2, price_small = $3, price_large = $4, image_url = $5, position = $6
+                    WHERE id = $1
+                    """,
+                    updates
+                )
+            if deletes:
+                await conn.execute("DELETE FROM products WHERE id = ANY($1::int[])", deletes)
+
+    result = {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes)}
+    if any(result.values()):
+        logger.info("✅ Товары синхронизированы с menu_data.json: %s", result)
+    else:
+        logger.info("ℹ️ Товары в базе совпадают с menu_data.json.")
+    return result
+
+
+async def fetch_products():
+    if pool is None:
+        logger.error("❌ Попытка загрузить меню до инициализации пула соединений.")
         return None
 
     async with pool.acquire() as conn:
         try:
+            return await conn.fetch(
+                "SELECT id, category, name, description, price_small, price_large, image_url "
+                "FROM products ORDER BY position, id"
+            )
+        except Exception as e:
+            logger.error("❌ Ошибка загрузки меню из базы: %s", e)
+            return None
+
+
+async def listen_menu_changes(callback):
+    # Отдельное соединение вне пула: LISTEN должен жить всё время работы бота
+    conn = await asyncpg.connect(DATABASE_URL)
+    await conn.add_listener("menu_changed", callback)
+    return conn
+
+
+async def _init_sales_stats(conn):
+    # Агрегаты продаж ведутся инкрементально в save_order/update_order_status,
+    # поэтому статистика не зависит от числа строк в orders (и переживает delete_old_completed_orders)
+    is_new = await conn.fetchval("SELECT to_regclass('sales_daily') IS NULL")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day DATE PRIMARY KEY,
+            orders_count INTEGER NOT NULL DEFAULT 0,
+            cancelled_count INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS sales_products (
+            day DATE NOT NULL,
+            product TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product)
+        )
+    """)
+    if not is_new:
+        return
+
+    # Первый запуск: однократно заполняем агрегаты по уже существующим заказам
+    await conn.execute("""
+        INSERT INTO sales_daily (day, orders_count, cancelled_count, revenue)
+        SELECT (created_at AT TIME ZONE $1)::date,
+               COUNT(*) FILTER (WHERE status <> 'cancelled'),
+               COUNT(*) FILTER (WHERE status = 'cancelled'),
+               COALESCE(SUM(total) FILTER (WHERE status <> 'cancelled'), 0)
+        FROM orders
+        GROUP BY 1
+    """, STATS_TIMEZONE)
+    await conn.execute("""
+        INSERT INTO sales_products (day, product, quantity, revenue)
+        SELECT (o.created_at AT TIME ZONE $1)::date,
+               COALESCE(i->>'product', i->>'name'),
+               SUM((i->>'quantity')::int),
+               SUM((i->>'price')::int * (i->>'quantity')::int)
+        FROM orders o, jsonb_array_elements(o.items::jsonb) i
+        WHERE o.status <> 'cancelled'
+        GROUP BY 1, 2
+    """, STATS_TIMEZONE)
+    logger.info("✅ Таблицы статистики продаж созданы и заполнены.")
+
+
+async def _apply_sales_delta(conn, day, total: int, items: list, sign: int, cancelled: int = 0):
+    await conn.execute(
+        """
+        INSERT INTO sales_daily (day, orders_count, cancelled_count, revenue)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (day) DO UPDATE SET
+            orders_count = sales_daily.orders_count + EXCLUDED.orders_count,
+            cancelled_count = sales_daily.cancelled_count + EXCLUDED.cancelled_count,
+            revenue = sales_daily.revenue + EXCLUDED.revenue
+        """,
+        day, sign, cancelled, sign * total
+    )
+    products = {}
+    for item in items:
+        product = item.get("product") or item.get("name", "—")
+        quantity = item.get("quantity", 1)
+        count, revenue = products.get(product, (0, 0))
+        products[product] = (count + quantity, revenue + item.get("price", 0) * quantity)
+    if products:
+        await conn.executemany(
+            """
+            INSERT INTO sales_products (day, product, quantity, revenue)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (day, product) DO UPDATE SET
+                quantity = sales_products.quantity + EXCLUDED.quantity,
+                revenue = sales_products.revenue + EXCLUDED.revenue
+            """,
+            [(day, product, sign * count, sign * revenue) for product, (count, revenue) in products.items()]
+        )
+
+
+async def save_order(user_id: int, items: list, total: int, address: str, payment_method: int, phone: str = "",
+                     journal_id: str = None, created_at: datetime = None) -> int:
+    # Ошибки пробрасываются: решение, что делать при недоступной БД, принимает order_journal.place_order.
+    # journal_id делает вставку идемпотентной — повтор из журнала вернёт id уже записанного заказа
+    if pool is None:
+        raise ConnectionError("пул соединений с БД не инициализирован")
+    items_json = json_dumps(items)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
             row = await conn.fetchrow(
                 """
-                INSERT INTO orders (user_id, items, total, address, phone, payment_method)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                RETURNING id
+                INSERT INTO orders (user_id, items, total, address, phone, payment_method, journal_id, created_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $8, COALESCE($9, NOW()))
+                ON CONFLICT (journal_id) DO NOTHING
+                RETURNING id, (created_at AT TIME ZONE $7)::date AS day
                 """,
-                user_id, items_json, total, address, phone, payment_method
+                user_id, items_json, total, address, normalize_phone(phone), payment_method, STATS_TIMEZONE,
+                uuid.UUID(journal_id) if journal_id else None, created_at
             )
-            return row["id"] if row else None
-        except Exception as e:
-            logger.error(f"❌ Ошибка сохранения заказа: {e}")
-            return None
+            if row is None:
+                order_id = await conn.fetchval("SELECT id FROM orders WHERE journal_id = $1", uuid.UUID(journal_id))
+            else:
+                order_id = row["id"]
+                await _apply_sales_delta(conn, row["day"], total, items, 1)
+                # Клиент снова заказывает — значит, разблокировал бота: возвращаем его в рассылки
+                await conn.execute("DELETE FROM blocked_users WHERE user_id = $1", user_id)
+    _mark_written(("user", user_id), ("order", order_id))
+    return order_id
+
+
+# Способ оплаты хранится кодом (SMALLINT), подписи — только при выводе
+PAYMENT_ONLINE = 1
+PAYMENT_CASH = 2
+PAYMENT_LABELS = {PAYMENT_ONLINE: "💳 Онлайн", PAYMENT_CASH: "💵 Наличными"}
+
+
+def payment_label(code) -> str:
+    return PAYMENT_LABELS.get(code, "Неизвестно")
+
+
+def normalize_phone(raw: str):
+    # Те же правила, что у миграции: только цифры, российские 8XXXXXXXXXX и XXXXXXXXXX приводятся к 7XXXXXXXXXX
+    digits = "".join(ch for ch in raw or "" if ch.isdigit())
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = "7" + digits
+    elif not 5 <= len(digits) <= 15:
+        return None
+    return int(digits)
+
+
+def format_phone(phone) -> str:
+    if phone is None:
+        return ""
+    digits = str(phone)
+    if len(digits) == 11 and digits[0] == "7":
+        return f"+7 ({digits[1:4]}) {digits[4:7]}-{digits[7:9]}-{digits[9:]}"
+    return f"+{digits}"
+
+
+ORDER_COLUMNS = ("id", "user_id", "items", "total", "address", "phone", "phone_raw", "payment_method", "status",
+                 "created_at")
+# Для списков заказов достаточно номера, суммы и статуса — items и контакты не тянем из БД
+ORDER_SUMMARY_COLUMNS = ("id", "total", "status")
 
+_ITEMS_NOT_LOADED = object()
 
-async def get_user_orders(user_id: int):
+
+class Order:
+    # Лёгкая запись заказа: items хранятся сырой JSON-строкой и разбираются только при первом обращении
+    __slots__ = ("id", "user_id", "total", "address", "phone", "phone_raw", "payment_method", "status", "created_at",
+                 "_items_raw", "_items")
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.user_id = row.get("user_id")
+        self.total = row.get("total")
+        self.address = row.get("address")
+        self.phone = row.get("phone")
+        self.phone_raw = row.get("phone_raw")  # только у старых заказов, чей телефон не удалось привести к цифрам
+        self.payment_method = row.get("payment_method")
+        self.status = row.get("status")
+        self.created_at = row.get("created_at")
+        self._items_raw = row.get("items")
+        self._items = _ITEMS_NOT_LOADED
+
+    @property
+    def items(self) -> list:
+        if self._items is _ITEMS_NOT_LOADED:
+            try:
+                self._items = json_loads(self._items_raw) if self._items_raw else []
+            except Exception as e:
+                logger.error("❌ Ошибка парсинга items заказа %s: %s", self.id, e)
+                self._items = []
+            self._items_raw = None
+        return self._items
+
+
+def _select_columns(columns) -> str:
+    unknown = set(columns) - set(ORDER_COLUMNS)
+    if unknown or "id" not in columns:
+        raise ValueError(f"Недопустимый набор столбцов заказа: {columns}")
+    return ", ".join(columns)
+
+
+async def get_user_orders(user_id: int, columns=ORDER_COLUMNS, limit: int = None):
     if pool is None:
         logger.error("❌ Попытка получить заказы до инициализации пула соединений.")
         return []
 
+    try:
+        rows = await _read(
+            "fetch",
+            f"SELECT {_select_columns(columns)} FROM orders WHERE user_id = $1 ORDER BY id DESC LIMIT $2",
+            user_id, limit, sticky=(("user", user_id),)
+        )
+        return [Order(row) for row in rows]
+    except Exception as e:
+        logger.error("❌ Ошибка получения заказов пользователя %s: %s", user_id, e)
+        return []
+
+
+async def get_all_orders(limit: int = 10, columns=ORDER_COLUMNS, reader_id: int = None):
+    # reader_id — кто смотрит список: сразу после своей смены статуса админ читает с основной базы
+    if pool is None:
+        logger.error("❌ Попытка получить все заказы до инициализации пула соединений.")
+        return []
+
+    try:
+        rows = await _read(
+            "fetch", f"SELECT {_select_columns(columns)} FROM orders ORDER BY id DESC LIMIT $1",
+            limit, sticky=(("user", reader_id),)
+        )
+        return [Order(row) for row in rows]
+    except Exception as e:
+        logger.error("❌ Ошибка получения всех заказов: %s", e)
+        return []
+
+
+async def get_order(order_id: int, columns=ORDER_COLUMNS):
+    if pool is None:
+        logger.error("❌ Попытка получить заказ до инициализации пула соединений.")
+        return None
+
+    try:
+        row = await _read(
+            "fetchrow", f"SELECT {_select_columns(columns)} FROM orders WHERE id = $1",
+            order_id, sticky=(("order", order_id),)
+        )
+        return Order(row) if row else None
+    except Exception as e:
+        logger.error("❌ Ошибка получения заказа %s: %s", order_id, e)
+        return None
+
+
+async def update_order_status(order_id: int, new_status: str, changed_by: int = None):
+    if pool is None:
+        logger.error("❌ Попытка обновить статус заказа до инициализации пула соединений.")
+        return None
+
     async with pool.acquire() as conn:
         try:
-            rows = await conn.fetch(
-                "SELECT id, items, total, address, phone, payment_method, status, created_at FROM orders WHERE user_id = $1 ORDER BY id DESC",
-                user_id
-            )
-            return _parse_orders(rows, include_user_id=False)
+            async with conn.transaction():
+                old = await conn.fetchrow(
+                    "SELECT status, total, items, (created_at AT TIME ZONE $2)::date AS day FROM orders WHERE id = $1 FOR UPDATE",
+                    order_id, STATS_TIMEZONE
+                )
+                if not old:
+                    return None
+                row = await conn.fetchrow(
+                    "UPDATE orders SET status = $1 WHERE id = $2 RETURNING user_id",
+                    new_status, order_id
+                )
+                # В выручку идут все заказы, кроме отменённых: пересчёт нужен только при входе/выходе из 'cancelled'
+                was_counted = old["status"] != "cancelled"
+                is_counted = new_status != "cancelled"
+                if was_counted != is_counted:
+                    sign = 1 if is_counted else -1
+                    await _apply_sales_delta(conn, old["day"], old["total"], json_loads(old["items"]), sign, cancelled=-sign)
+            if row:
+                _mark_written(("order", order_id), ("user", row["user_id"]), ("user", changed_by))
+            return row["user_id"] if row else None
         except Exception as e:
-            logger.error(f"❌ Ошибка получения заказов пользователя {user_id}: {e}")
-            return []
+            logger.error("❌ Ошибка обновления статуса заказа %s: %s", order_id, e)
+            return None
 
 
-async def get_all_orders(limit: int = 10):
+async def get_active_orders(columns=ORDER_COLUMNS):
+    # Заказы, которые кухня ещё не закрыла — для живой доски
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            f"SELECT {_select_columns(columns)} FROM orders WHERE status NOT IN ('done', 'cancelled') ORDER BY id"
+        )
+        return [Order(row) for row in rows]
+
+
+async def _init_kitchen_board(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS kitchen_board (
+            chat_id BIGINT NOT NULL,
+            page INTEGER NOT NULL,
+            message_id BIGINT NOT NULL,
+            PRIMARY KEY (chat_id, page)
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS orders_active_idx ON orders (id) WHERE status NOT IN ('done', 'cancelled')"
+    )
+
+
+async def _init_order_search(conn):
+    # Поиск заказов для админки: точный номер телефона, хвост номера (по развёрнутой строке цифр) и фрагмент адреса
+    await conn.execute("CREATE INDEX IF NOT EXISTS orders_phone_idx ON orders (phone)")
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS orders_phone_suffix_idx ON orders ((reverse(phone::text) COLLATE "C"))'
+    )
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS orders_address_trgm_idx ON orders USING gin (address gin_trgm_ops)"
+        )
+    except asyncpg.PostgresError as e:
+        # Без прав на расширение поиск по адресу работает, но полным просмотром таблицы
+        logger.warning("⚠️ Индекс pg_trgm для поиска по адресу не создан: %s", e)
+
+
+SEARCH_MIN_PHONE_DIGITS = 4
+SEARCH_MIN_ADDRESS_CHARS = 3
+_PHONE_QUERY_CHARS = set("0123456789+-() #")
+
+
+def _order_search_conditions(query: str):
+    # "#123" или "123" — номер заказа (и хвост телефона, если цифр хватает), полный номер — точное совпадение,
+    # всё остальное — фрагмент адреса. Возвращает (условия через OR, аргументы) или None, если искать нечего
+    query = query.strip()
+    if query and set(query) <= _PHONE_QUERY_CHARS:
+        digits = "".join(ch for ch in query if ch.isdigit())
+        if not digits:
+            return None
+        conditions, args = [], []
+        if len(digits) <= 9:
+            args.append(int(digits))
+            conditions.append(f"id = ${len(args)}")
+        if query.startswith("#"):
+            return (conditions, args) if conditions else None
+        phone = normalize_phone(query) if len(digits) >= 10 else None
+        if phone is not None:
+            args.append(phone)
+            conditions.append(f"phone = ${len(args)}")
+        elif len(digits) >= SEARCH_MIN_PHONE_DIGITS:
+            # Хвост номера: префиксный диапазон по развёрнутым цифрам — обычный btree, без LIKE
+            low = digits[::-1]
+            args.extend((low, low[:-1] + chr(ord(low[-1]) + 1)))
+            conditions.append(
+                f'(reverse(phone::text) COLLATE "C" >= ${len(args) - 1} AND reverse(phone::text) COLLATE "C" < ${len(args)})'
+            )
+        return (conditions, args) if conditions else None
+
+    if len(query) < SEARCH_MIN_ADDRESS_CHARS:
+        return None
+    pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return ["address ILIKE $1"], [f"%{pattern}%"]
+
+
+async def search_orders(query: str, before_id: int = None, limit: int = 10, columns=ORDER_COLUMNS,
+                        reader_id: int = None):
+    # Постранично от новых к старым: следующая страница — заказы с id меньше последнего показанного.
+    # None — запрос слишком короткий или не распознан
+    parsed = _order_search_conditions(query)
+    if parsed is None:
+        return None
+    conditions, args = parsed
+    sql = f"SELECT {_select_columns(columns)} FROM orders WHERE ({' OR '.join(conditions)})"
+    if before_id is not None:
+        args.append(before_id)
+        sql += f" AND id < ${len(args)}"
+    args.append(limit)
+    sql += f" ORDER BY id DESC LIMIT ${len(args)}"
+    rows = await _read("fetch", sql, *args, sticky=(("user", reader_id),))
+    return [Order(row) for row in rows]
+
+
+async def get_board_messages(chat_id: int) -> list:
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT message_id FROM kitchen_board WHERE chat_id = $1 ORDER BY page", chat_id)
+        return [row["message_id"] for row in rows]
+
+
+async def save_board_messages(chat_id: int, message_ids: list):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM kitchen_board WHERE chat_id = $1", chat_id)
+            await conn.executemany(
+                "INSERT INTO kitchen_board (chat_id, page, message_id) VALUES ($1, $2, $3)",
+                [(chat_id, page, message_id) for page, message_id in enumerate(message_ids)]
+            )
+
+
+async def get_sales_stats(days: int = 7, top: int = 5):
     if pool is None:
-        logger.error("❌ Попытка получить все заказы до инициализации пула соединений.")
-        return []
+        logger.error("❌ Попытка получить статистику до инициализации пула соединений.")
+        return None
 
     async with pool.acquire() as conn:
         try:
-            rows = await conn.fetch(
-                "SELECT id, user_id, items, total, address, phone, payment_method, status, created_at FROM orders ORDER BY id DESC LIMIT $1",
-                limit
+            today = await conn.fetchval("SELECT (NOW() AT TIME ZONE $1)::date", STATS_TIMEZONE)
+            since = today - timedelta(days=days - 1)
+            daily = await conn.fetch(
+                "SELECT day, orders_count, cancelled_count, revenue FROM sales_daily WHERE day >= $1 ORDER BY day DESC",
+                since
             )
-            return _parse_orders(rows, include_user_id=True)
+            top_products = await conn.fetch(
+                """
+                SELECT product, SUM(quantity) AS quantity, SUM(revenue) AS revenue
+                FROM sales_products
+                WHERE day >= $1
+                GROUP BY product
+                HAVING SUM(quantity) > 0
+                ORDER BY quantity DESC, revenue DESC
+                LIMIT $2
+                """,
+                since, top
+            )
+            return {"today": today, "days": days, "daily": daily, "top_products": top_products}
         except Exception as e:
-            logger.error(f"❌ Ошибка получения всех заказов: {e}")
-            return []
+            logger.error("❌ Ошибка получения статистики продаж: %s", e)
+            return None
 
 
-def _parse_orders(rows, include_user_id=False):
-    orders = []
-    for row in rows:
+async def iter_orders_for_export(date_from, date_to, chunk_size: int = 500):
+    # Серверный курсор: в памяти одновременно не больше chunk_size строк, сколько бы заказов ни было
+    if pool is None:
+        logger.error("❌ Попытка выгрузить заказы до инициализации пула соединений.")
+        return
+
+    # Выгрузка — долгое чтение, не занимает соединения основной базы, если есть реплика.
+    # Если реплика отказала до первой пачки — выгрузка целиком повторяется на основной базе
+    target = _read_pool()
+    if target is not pool:
+        yielded = False
         try:
-            items = json.loads(row["items"])
-        except Exception as e:
-            logger.error(f"❌ Ошибка парсинга items заказа {row['id']}: {e}")
-            items = []
-        order = {
-            "id": row["id"],
-            "items": items,
-            "total": row["total"],
-            "address": row["address"],
-            "phone": row["phone"],
-            "payment_method": row["payment_method"],
-            "status": row["status"],
-            "created_at": row["created_at"]
-        }
-        if include_user_id:
-            order["user_id"] = row["user_id"]
-        orders.append(order)
-    return orders
-
-
-async def update_order_status(order_id: int, new_status: str):
+            async for rows in _export_chunks(target, date_from, date_to, chunk_size):
+                yielded = True
+                yield rows
+            return
+        except CONNECTION_ERRORS as e:
+            if yielded:
+                raise
+            _replica_failed(e)
+    async for rows in _export_chunks(pool, date_from, date_to, chunk_size):
+        yield rows
+
+
+async def _export_chunks(source, date_from, date_to, chunk_size: int):
+    async with source.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(
+                """
+                SELECT id, created_at, user_id, status, total, payment_method, phone, phone_raw, address, items
+                FROM orders
+                WHERE created_at >= $1::date::timestamp AT TIME ZONE $3
+                  AND created_at < ($2::date + 1)::timestamp AT TIME ZONE $3
+                ORDER BY id
+                """,
+                date_from, date_to, STATS_TIMEZONE
+            )
+            while True:
+                rows = await cursor.fetch(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+
+async def _init_broadcasts(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            report_chat_id BIGINT,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            lease_until TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id BIGINT PRIMARY KEY,
+            blocked_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS orders_user_id_idx ON orders (user_id)")
+
+
+async def create_broadcast(text: str, report_chat_id: int):
     if pool is None:
-        logger.error("❌ Попытка обновить статус заказа до инициализации пула соединений.")
+        logger.error("❌ Попытка создать рассылку до инициализации пула соединений.")
         return None
 
     async with pool.acquire() as conn:
         try:
-            row = await conn.fetchrow(
-                "UPDATE orders SET status = $1 WHERE id = $2 RETURNING user_id",
-                new_status, order_id
+            return await conn.fetchrow(
+                "INSERT INTO broadcasts (text, report_chat_id) VALUES ($1, $2) RETURNING *",
+                text, report_chat_id
             )
-            return row["user_id"] if row else None
         except Exception as e:
-            logger.error(f"❌ Ошибка обновления статуса заказа {order_id}: {e}")
+            logger.error("❌ Ошибка создания рассылки: %s", e)
             return None
 
 
-async def delete_old_completed_orders():
-    global pool
+async def get_running_broadcasts():
     if pool is None:
-        logger.error("❌ Попытка удалить старые заказы до инициализации пула соединений.")
-        return
+        return []
 
-    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
     async with pool.acquire() as conn:
         try:
-            # asyncpg не всегда возвращает корректное количество удалённых строк через .execute()
-            # Используем RETURNING для получения количества
-            deleted_rows = await conn.fetch(
-                "DELETE FROM orders WHERE status = ANY($1) AND created_at < $2 RETURNING id",
-                ["done", "cancelled"], one_hour_ago
-            )
-            deleted_count = len(deleted_rows)
-            if deleted_count > 0:
-                logger.info(f"🧹 Удалено завершённых/отменённых заказов: {deleted_count}")
-            else:
-                logger.debug("🧹 Нет старых завершённых/отменённых заказов для удаления.")
+            return await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
         except Exception as e:
-            logger.error(f"❌ Ошибка удаления старых заказов: {e}")
+            logger.error("❌ Ошибка получения активных рассылок: %s", e)
+            return []
 
 
-async def close_pool():
-    global pool
+async def claim_broadcast(broadcast_id: int, lease_seconds: int) -> bool:
+    # Аренда вместо постоянной блокировки: упавший экземпляр отпускает рассылку сам, когда аренда истекает
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(
+            """
+            UPDATE broadcasts SET lease_until = NOW() + make_interval(secs => $2)
+            WHERE id = $1 AND status = 'running' AND (lease_until IS NULL OR lease_until < NOW())
+            RETURNING id
+            """,
+            broadcast_id, lease_seconds
+        )
+        return row is not None
+
+
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked: int,
+                                  lease_seconds: int, status: str = "running"):
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            """
+            UPDATE broadcasts
+            SET last_user_id = $2, sent = $3, failed = $4, blocked = $5,
+                lease_until = CASE WHEN $6 = 'running' THEN NOW() + make_interval(secs => $7) END,
+                status = CASE WHEN status = 'running' THEN $6 ELSE status END,
+                finished_at = CASE WHEN $6 = 'running' THEN NULL ELSE NOW() END
+            WHERE id = $1
+            RETURNING status
+            """,
+            broadcast_id, last_user_id, sent, failed, blocked, status, lease_seconds
+        )
+
+
+async def cancel_broadcasts() -> int:
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            "UPDATE broadcasts SET status = 'cancelled', finished_at = NOW() WHERE status = 'running' RETURNING id"
+        )
+        return len(rows)
+
+
+async def fetch_broadcast_recipients(after_user_id: int, limit: int):
+    # Постраничный обход по user_id: точка продолжения — последний обработанный получатель
+    async with pool.acquire() as conn:
+        return await conn.fetch(
+            """
+            SELECT DISTINCT o.user_id
+            FROM orders o
+            WHERE o.user_id > $1
+              AND NOT EXISTS (SELECT 1 FROM blocked_users b WHERE b.user_id = o.user_id)
+            ORDER BY o.user_id
+            LIMIT $2
+            """,
+            after_user_id, limit
+        )
+
+
+async def mark_user_blocked(user_id: int):
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO blocked_users (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING",
+            user_id
+        )
+
+
+async def _init_jobs(conn):
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            last_started_at TIMESTAMP WITH TIME ZONE,
+            last_finished_at TIMESTAMP WITH TIME ZONE,
+            last_duration_ms INTEGER,
+            last_status TEXT,
+            last_error TEXT,
+            runs INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+
+@asynccontextmanager
+async def job_lock(name: str):
+    # Сессионная advisory-блокировка на отдельном соединении: задачу выполняет только одна реплика.
+    # Если процесс упадёт, Postgres снимет блокировку вместе с соединением.
+    async with pool.acquire() as conn:
+        acquired = await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('job:' || $1))", name)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('job:' || $1))", name)
+
+
+async def get_job_elapsed(name: str):
+    # Секунды с последнего запуска по часам БД — одинаково для всех реплик; None, если задача не запускалась
+    async with pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT EXTRACT(EPOCH FROM NOW() - last_started_at)::float FROM scheduled_jobs WHERE name = $1",
+            name
+        )
+
+
+async def record_job_start(name: str):
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            INSERT INTO scheduled_jobs (name, last_started_at) VALUES ($1, NOW())
+            ON CONFLICT (name) DO UPDATE SET last_started_at = NOW()
+            """,
+            name
+        )
+
+
+async def record_job_result(name: str, duration_ms: int, status: str, error: str = None):
+    async with pool.acquire() as conn:
+        await conn.execute(
+            """
+            UPDATE scheduled_jobs
+            SET last_finished_at = NOW(), last_duration_ms = $2, last_status = $3, last_error = $4,
+                runs = runs + 1, failures = failures + CASE WHEN $3 = 'ok' THEN 0 ELSE 1 END
+            WHERE name = $1
+            """,
+            name, duration_ms, status, error
+        )
+
+
+async def delete_old_completed_orders(retention_days: int) -> int:
+    # Ошибки не перехватываются: их записывает планировщик задач.
+    # Завершённые заказы живут retention_days — по ним клиент повторяет заказ; отменённые не нужны уже через час
+    now = datetime.now(timezone.utc)
+    async with pool.acquire() as conn:
+        # asyncpg не всегда возвращает корректное количество удалённых строк через .execute()
+        # Используем RETURNING для получения количества
+        deleted_rows = await conn.fetch(
+            """
+            DELETE FROM orders
+            WHERE (status = 'cancelled' AND created_at < $1)
+               OR (status = 'done' AND created_at < $2)
+            RETURNING id
+            """,
+            now - timedelta(hours=1), now - timedelta(days=retention_days)
+        )
+    deleted_count = len(deleted_rows)
+    if deleted_count > 0:
+        logger.info("🧹 Удалено завершённых/отменённых заказов: %s", deleted_count)
+    else:
+        logger.debug("🧹 Нет старых завершённых/отменённых заказов для удаления.")
+    return deleted_count
+
+
+async def close_pool(timeout: float = None):
+    global pool, replica_pool
+    if replica_pool:
+        try:
+            await asyncio.wait_for(replica_pool.close(), timeout)
+        except asyncio.TimeoutError:
+            replica_pool.terminate()
+        replica_pool = None
     if pool:
-        await pool.close()
+        try:
+            # close() ждёт, пока все соединения вернутся в пул
+            await asyncio.wait_for(pool.close(), timeout)
+            logger.info("✅ Пул соединений закрыт.")
+        except asyncio.TimeoutError:
+            pool.terminate()
+            logger.warning("⚠️ Пул соединений закрыт принудительно: соединения не освободились за %s с", timeout)
         pool = None  # Убедимся, что pool = None после закрытия
-        logger.info("✅ Пул соединений закрыт.")
 
 
 # Пример запуска и закрытия (использовать в основном модуле бота)
@@ -0,0 +1,77 @@
+import io
+import csv
+import gzip
+import asyncio
+import logging
+import tempfile
+
+from aiogram.types.input_file import InputFile, DEFAULT_CHUNK_SIZE
+
+from database import iter_orders_for_export, payment_label, format_phone
+from fast_runtime import json_loads
+
+logger = logging.getLogger(__name__)
+
+EXPORT_HEADER = ("id", "created_at", "user_id", "status", "total", "payment_method", "phone", "address", "items")
+# До этого размера архив держится в памяти, дальше SpooledTemporaryFile сам уходит на диск
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+
+class SpooledInputFile(InputFile):
+    # Отдаёт в aiogram уже сжатый временный файл по кускам, не читая его в память целиком
+    def __init__(self, file, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        self.file.seek(0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+def _format_items(raw) -> str:
+    try:
+        items = json_loads(raw) if raw else []
+    except Exception:
+        return raw or ""
+    return "; ".join(f"{item.get('name', '—')} ×{item.get('quantity', 1)}" for item in items)
+
+
+def _encode_rows(writer, rows):
+    writer.writerows(
+        (
+            row["id"],
+            row["created_at"].isoformat() if row["created_at"] else "",
+            row["user_id"],
+            row["status"],
+            row["total"],
+            payment_label(row["payment_method"]),
+            format_phone(row["phone"]) or row["phone_raw"] or "",
+            row["address"],
+            _format_items(row["items"]),
+        )
+        for row in rows
+    )
+
+
+async def export_orders_csv(date_from, date_to, chunk_size: int = 500):
+    # Возвращает (файл, число заказов); файл нужно закрыть после отправки
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    total_rows = 0
+    try:
+        with gzip.GzipFile(fileobj=spool, mode="wb") as gz:
+            # utf-8-sig — чтобы Excel корректно открыл кириллицу
+            text = io.TextIOWrapper(gz, encoding="utf-8-sig", newline="")
+            writer = csv.writer(text)
+            writer.writerow(EXPORT_HEADER)
+            async for rows in iter_orders_for_export(date_from, date_to, chunk_size):
+                # Кодирование и сжатие — в отдельном потоке, чтобы не задерживать обработку апдейтов
+                await asyncio.to_thread(_encode_rows, writer, rows)
+                total_rows += len(rows)
+            text.flush()
+            text.detach()
+    except Exception:
+        spool.close()
+        raise
+    logger.info("📤 Выгрузка заказов %s—%s: %s строк", date_from, date_to, total_rows)
+    return spool, total_rows
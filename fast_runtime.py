@@ -0,0 +1,52 @@
+import os
+import json
+import asyncio
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+# Включается явно: FAST_RUNTIME=1. Без установленных uvloop/orjson всё работает на стандартных asyncio и json.
+FAST_RUNTIME = os.getenv("FAST_RUNTIME", "").lower() in ("1", "true", "yes")
+USE_ORJSON = FAST_RUNTIME and orjson is not None
+USE_UVLOOP = FAST_RUNTIME and uvloop is not None
+
+
+if USE_ORJSON:
+    def json_dumps(obj) -> str:
+        # orjson возвращает bytes и не экранирует не-ASCII — как json.dumps(..., ensure_ascii=False)
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    json_loads = json.loads
+
+
+def install_event_loop():
+    # Вызывать до web.run_app: он создаёт цикл событий через текущую политику
+    if USE_UVLOOP:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    if FAST_RUNTIME:
+        logger.info(
+            "⚡ Быстрый режим: uvloop %s, orjson %s",
+            "включён" if USE_UVLOOP else "не установлен",
+            "включён" if USE_ORJSON else "не установлен"
+        )
+
+
+async def init_connection_codecs(conn):
+    # Передаётся в asyncpg.create_pool(init=...): json/jsonb декодируются сразу в объекты Python
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json_dumps, decoder=json_loads, schema="pg_catalog")
@@ -0,0 +1,154 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+from aiogram.types import BufferedInputFile
+
+# Pillow импортируется при первой сборке (в фоновом потоке), а не при запуске бота
+Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+IMAGES_BUILD_DIR = os.getenv("IMAGES_BUILD_DIR", os.path.join("build", "images"))
+MANIFEST_PATH = os.path.join(IMAGES_BUILD_DIR, "manifest.json")
+PHOTO_MAX_SIDE = 1280  # Telegram всё равно ужимает фото до 1280 по большей стороне
+JPEG_QUALITY = 82
+
+# Манифест: sources — исходный путь -> хэш содержимого (+ размер/mtime, чтобы не хэшировать заново),
+# variants — хэш -> готовые варианты. Файл с тем же содержимым не перекодируется повторно.
+_manifest = {"sources": {}, "variants": {}}
+# Сборки при старте, /reload_menu и NOTIFY пишут одни и те же .tmp-файлы — выполняются по одной
+_build_lock = asyncio.Lock()
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("sources", {})
+        manifest.setdefault("variants", {})
+        return manifest
+    except FileNotFoundError:
+        return {"sources": {}, "variants": {}}
+    except Exception as e:
+        logger.warning("⚠️ Манифест изображений повреждён, пересобираем: %s", e)
+        return {"sources": {}, "variants": {}}
+
+
+def _save_manifest(manifest: dict):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _import_pillow() -> bool:
+    global Image, ImageOps
+    if Image is None:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:  # без Pillow отправляем исходные файлы как есть
+            return False
+    return True
+
+
+def _encode_jpeg(src: str, dst: str, max_side: int):
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+        tmp_path = dst + ".tmp"
+        im.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, dst)
+
+
+def _source_hash(path: str, manifest: dict) -> str:
+    stat = os.stat(path)
+    known = manifest["sources"].get(path)
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return known["hash"]
+    digest = _file_hash(path)
+    manifest["sources"][path] = {"hash": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+    return digest
+
+
+def build_images(paths) -> dict:
+    # Синхронная сборка: запускается из CLI или в отдельном потоке при старте бота
+    manifest = _load_manifest()
+    if not _import_pillow():
+        logger.warning("⚠️ Pillow не установлен — изображения отправляются без оптимизации.")
+        return manifest
+    os.makedirs(IMAGES_BUILD_DIR, exist_ok=True)
+
+    built = skipped = 0
+    for path in paths:
+        if not path or path.startswith(("http://", "https://")):
+            continue
+        if not os.path.exists(path):
+            logger.warning("⚠️ Изображение не найдено: %s", path)
+            continue
+        try:
+            digest = _source_hash(path, manifest)
+            variant = manifest["variants"].get(digest)
+            if variant and os.path.exists(variant["photo"]):
+                skipped += 1
+                continue
+            photo = os.path.join(IMAGES_BUILD_DIR, f"{digest[:16]}.jpg")
+            _encode_jpeg(path, photo, PHOTO_MAX_SIDE)
+            manifest["variants"][digest] = {
+                "photo": photo,
+                "source_bytes": os.path.getsize(path),
+                "photo_bytes": os.path.getsize(photo),
+            }
+            built += 1
+        except Exception as e:
+            logger.error("❌ Ошибка оптимизации изображения %s: %s", path, e)
+
+    _save_manifest(manifest)
+    logger.info("🖼 Изображения: пересобрано %s, без изменений %s", built, skipped)
+    return manifest
+
+
+def menu_image_paths(menu_data: dict) -> list:
+    return [item.get("image_url", "").strip() for items in menu_data.values() for item in items]
+
+
+async def prepare_images(paths):
+    global _manifest
+    async with _build_lock:
+        _manifest = await asyncio.to_thread(build_images, list(paths))
+
+
+def optimized_path(path: str):
+    source = _manifest["sources"].get(path)
+    if not source:
+        return None
+    entry = _manifest["variants"].get(source["hash"])
+    return entry.get("photo") if entry else None
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def load_photo(path: str) -> BufferedInputFile:
+    # Чтение файла — в пуле потоков, чтобы загрузка фото не блокировала апдейты других пользователей
+    resolved = optimized_path(path) or path
+    data = await asyncio.to_thread(_read_bytes, resolved)
+    return BufferedInputFile(data, filename=os.path.basename(resolved))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open("menu_data.json", "r", encoding="utf-8") as f:
+        build_images(menu_image_paths(json.load(f)))
@@ -73,13 +73,53 @@ def payment_keyboard():
     ])
 
 
+def user_orders_keyboard(orders):
+    # Под списком "Мои заказы": повтор любого из последних заказов в одно нажатие
+    keyboard = [
+        [InlineKeyboardButton(text=f"🔁 Повторить заказ #{order.id}", callback_data=f"repeat_{order.id}")]
+        for order in orders if order.status != "cancelled"
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+
+
+def repeat_order_keyboard():
+    # Адрес и телефон уже подставлены из прошлого заказа — остаётся выбрать оплату
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💳 Онлайн", callback_data="pay_online")],
+        [InlineKeyboardButton(text="💵 Наличными", callback_data="pay_cash")],
+        [InlineKeyboardButton(text="✏️ Другой адрес или телефон", callback_data="checkout")],
+        [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main")]
+    ])
+
+
 def admin_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📦 Все заказы", callback_data="admin_orders")],
+        [InlineKeyboardButton(text="🔎 Найти заказ", callback_data="admin_search")],
+        [InlineKeyboardButton(text="📊 Статистика", callback_data="admin_stats")],
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_main")]
     ])
 
 
+def order_search_keyboard(orders, has_more: bool):
+    # Результаты поиска в админке: заказ открывается карточкой, "Дальше" — следующая страница (id меньше последнего)
+    status_emoji = {"new": "🆕", "cooking": "🍳", "delivery": "🚚", "done": "✅", "cancelled": "❌"}
+    keyboard = []
+    for order in orders:
+        address = order.address or ""
+        if len(address) > 28:
+            address = address[:27] + "…"
+        text = f"{status_emoji.get(order.status, '❓')} #{order.id} · {order.total}₽ · {address}"
+        keyboard.append([InlineKeyboardButton(text=text, callback_data=f"admin_order_{order.id}")])
+    if has_more:
+        keyboard.append([InlineKeyboardButton(text="➡️ Дальше", callback_data=f"admin_search_more_{orders[-1].id}")])
+    keyboard.append([
+        InlineKeyboardButton(text="🔎 Новый поиск", callback_data="admin_search"),
+        InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_admin")
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
 def order_status_buttons(order_id: int, current_status: str = "new"):
     status_map = {
         "new": ["cooking", "cancelled"],
@@ -132,25 +172,66 @@ INGREDIENTS = {
 }
 
 
-def build_pizza_custom_keyboard(selected: dict, base_price: int, size: str):
+# Ингредиенты "Собери сам" хранятся битовой маской: бит i соответствует i-му ключу INGREDIENTS.
+# Порядок фиксирован — новые ингредиенты добавлять только в конец, иначе старые ключи корзин сменят смысл.
+INGREDIENT_PORTION = 50  # граммов на одно нажатие
+INGREDIENT_KEYS = tuple(INGREDIENTS)
+INGREDIENT_BITS = {key: 1 << i for i, key in enumerate(INGREDIENT_KEYS)}
+INGREDIENT_PRICES = tuple(price for _, price in INGREDIENTS.values())
+
+# Таблицы доплат по байтам маски: цена любой комбинации — сумма из трёх-четырёх обращений к таблицам
+_PRICE_TABLES = tuple(
+    tuple(
+        sum(INGREDIENT_PRICES[base + bit] for bit in range(8) if chunk >> bit & 1 and base + bit < len(INGREDIENT_PRICES))
+        for chunk in range(256)
+    )
+    for base in range(0, len(INGREDIENT_PRICES), 8)
+)
+
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def mask_extra_price(mask: int) -> int:
+    total = 0
+    for table in _PRICE_TABLES:
+        total += table[mask & 0xFF]
+        mask >>= 8
+    return total
+
+
+def mask_ingredients(mask: int):
+    return [key for key in INGREDIENT_KEYS if mask & INGREDIENT_BITS[key]]
+
+
+def mask_ingredients_text(mask: int) -> str:
+    return ", ".join([f"{INGREDIENTS[key][0]} {INGREDIENT_PORTION}г" for key in mask_ingredients(mask)])
+
+
+def to_base36(value: int) -> str:
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_BASE36[rem])
+    return "".join(reversed(digits))
+
+
+def build_pizza_custom_keyboard(mask: int, base_price: int, size: str):
     lines = []
-    total_extra = 0
-    ingredient_items = list(INGREDIENTS.items())
-    for i in range(0, len(ingredient_items), 2):
+    for i in range(0, len(INGREDIENT_KEYS), 2):
         row = []
-        for key, (name, price_per_50g) in ingredient_items[i:i+2]:
-            grams = selected.get(key, 0)
-            item_price = (grams // 50) * price_per_50g
-            total_extra += item_price
-            if grams > 0:
-                row.append(InlineKeyboardButton(text=f"✅ {name} ({grams}г)", callback_data=f"custom_add_{key}"))
+        for key in INGREDIENT_KEYS[i:i+2]:
+            name = INGREDIENTS[key][0]
+            if mask & INGREDIENT_BITS[key]:
+                row.append(InlineKeyboardButton(text=f"✅ {name} ({INGREDIENT_PORTION}г)", callback_data=f"custom_add_{key}"))
             else:
                 row.append(InlineKeyboardButton(text=name, callback_data=f"custom_add_{key}"))
         lines.append(row)
 
-    total = base_price + total_extra
+    total = base_price + mask_extra_price(mask)
     lines.append([
         InlineKeyboardButton(text="⬅️ Назад", callback_data="custom_cancel"),
         InlineKeyboardButton(text=f"✅ Готово ({total}₽)", callback_data="custom_done")
     ])
-    return InlineKeyboardMarkup(inline_keyboard=lines)
\ No newline at end of file
+    return InlineKeyboardMarkup(inline_keyboard=lines)
@@ -0,0 +1,162 @@
+import html
+import asyncio
+import logging
+from zoneinfo import ZoneInfo
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from database import (
+    get_active_orders, get_board_messages, save_board_messages, payment_label, format_phone, STATS_TIMEZONE
+)
+from lifecycle import spawn
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+HEADER_RESERVE = 64  # заголовок страницы с номером
+FIELD_LIMIT = 200  # символов адреса или названия позиции на доске
+EDIT_INTERVAL = 3.0  # не чаще одной правки доски за столько секунд — заказы за это время собираются в одну правку
+BOARD_COLUMNS = ("id", "items", "total", "address", "phone", "payment_method", "status", "created_at")
+STATUS_LABELS = {"new": "🆕 Новый", "cooking": "🍳 Готовится", "delivery": "🚚 В пути"}
+_LOCAL_TZ = ZoneInfo(STATS_TIMEZONE)
+
+
+def _clip(text: str, limit: int = FIELD_LIMIT) -> str:
+    # Обрезается исходный текст до html.escape: обрезка готовой разметки разорвала бы сущность или тег
+    text = text or ""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def render_order(order, limit: int = MESSAGE_LIMIT - HEADER_RESERVE) -> str:
+    # Данные клиента попадают в HTML-разметку — экранируем, чтобы один адрес с "<" не сломал всю доску.
+    # Заказ длиннее limit укорачивается целыми строками позиций, разметка остаётся целой
+    lines = []
+    if any("Собери сам" in item.get("name", "") for item in order.items):
+        lines.append("❗ <b>СПЕЦ ЗАКАЗ — СОБЕРИ САМ</b>")
+    created = order.created_at.astimezone(_LOCAL_TZ).strftime("%H:%M") if order.created_at else ""
+    lines.append(f"<b>#{order.id}</b> {created} · {STATUS_LABELS.get(order.status, html.escape(order.status))}")
+    lines.append(f"📍 {html.escape(_clip(order.address))} · 📞 {format_phone(order.phone)}")
+    footer = f"💳 {payment_label(order.payment_method)} · <b>{order.total}₽</b>"
+    budget = limit - sum(len(line) + 1 for line in lines) - len(footer) - 32  # 32 — на строку «… ещё N поз.»
+    for shown, item in enumerate(order.items):
+        line = f"• {html.escape(_clip(item['name']))} ×{item['quantity']}"
+        budget -= len(line) + 1
+        if budget < 0:
+            lines.append(f"• … ещё {len(order.items) - shown} поз.")
+            break
+        lines.append(line)
+    lines.append(footer)
+    return "\n".join(lines)
+
+
+def render_pages(orders) -> list:
+    # Заказы не разрываются между сообщениями; заголовок с номером страницы добавляется после раскладки
+    blocks = [render_order(order) for order in orders] or ["Активных заказов нет ✅"]
+    pages, current = [], ""
+    for block in blocks:
+        candidate = f"{current}\n\n{block}" if current else block
+        if current and len(candidate) + HEADER_RESERVE > MESSAGE_LIMIT:
+            pages.append(current)
+            current = block
+        else:
+            current = candidate
+    pages.append(current)
+
+    # Время обновления в текст не пишем: Telegram сам помечает правку, а неизменившиеся страницы не редактируются
+    total = len(pages)
+    return [
+        f"🍕 <b>Кухня: активных заказов {len(orders)}</b>"
+        + (f" · стр. {i}/{total}" if total > 1 else "")
+        + f"\n\n{page}"
+        for i, page in enumerate(pages, 1)
+    ]
+
+
+class KitchenBoard:
+    # Одно закреплённое сообщение (или несколько страниц) в чате кухни, перерисовываемое из активных заказов.
+    # refresh() только помечает доску устаревшей: правки идут из одной задачи и не чаще EDIT_INTERVAL
+    def __init__(self, bot: Bot, chat_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self._dirty = asyncio.Event()
+        self._message_ids = None
+        self._texts = []
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = spawn(self._run(), name="kitchen_board")
+        self.refresh()
+
+    def refresh(self):
+        self._dirty.set()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await self._redraw()
+            except TelegramRetryAfter as e:
+                self._dirty.set()
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error("❌ Ошибка обновления доски кухни: %s", e)
+            await asyncio.sleep(EDIT_INTERVAL)
+
+    async def _redraw(self):
+        if self._message_ids is None:
+            self._message_ids = await get_board_messages(self.chat_id)
+            self._texts = [None] * len(self._message_ids)
+        pages = render_pages(await get_active_orders(BOARD_COLUMNS))
+
+        message_ids = list(self._message_ids)
+        texts = list(self._texts)
+        try:
+            for page, text in enumerate(pages):
+                if page < len(message_ids):
+                    if texts[page] == text:
+                        continue
+                    if await self._edit(message_ids[page], text):
+                        texts[page] = text
+                        continue
+                    # Сообщение удалили из чата — страница отправляется заново
+                message = await self.bot.send_message(self.chat_id, text, parse_mode="HTML")
+                if page < len(message_ids):
+                    message_ids[page], texts[page] = message.message_id, text
+                else:
+                    message_ids.append(message.message_id)
+                    texts.append(text)
+                if page == 0:
+                    await self._pin(message.message_id)
+
+            # Лишние страницы после того, как заказов стало меньше
+            while len(message_ids) > len(pages):
+                message_id = message_ids.pop()
+                texts.pop()
+                try:
+                    await self.bot.delete_message(self.chat_id, message_id)
+                except TelegramBadRequest:
+                    pass
+        finally:
+            # Даже при ошибке посередине запоминаем уже отправленные страницы, чтобы не плодить новые
+            if message_ids != self._message_ids:
+                await save_board_messages(self.chat_id, message_ids)
+            self._message_ids, self._texts = message_ids, texts
+
+    async def _edit(self, message_id: int, text: str) -> bool:
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=message_id, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            logger.warning("⚠️ Сообщение доски кухни %s недоступно: %s", message_id, e)
+            return False
+        return True
+
+    async def _pin(self, message_id: int):
+        try:
+            await self.bot.pin_chat_message(self.chat_id, message_id, disable_notification=True)
+        except TelegramBadRequest as e:
+            logger.warning("⚠️ Не удалось закрепить доску кухни (нужны права администратора): %s", e)
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+_background_tasks = set()
+_in_flight = 0
+_idle = asyncio.Event()
+_idle.set()
+_draining = False
+
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    # Фоновые задачи бота: держим ссылки, чтобы задачу не собрал GC, и отменяем их при остановке
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_task_done)
+    return task
+
+
+def _on_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("❌ Фоновая задача %s завершилась с ошибкой: %s", task.get_name(), task.exception(),
+                     exc_info=task.exception())
+
+
+class BootTimer:
+    # Фазы холодного старта (импорты, БД, вебхук) и время до первого обработанного апдейта.
+    # Фазы могут идти параллельно — у каждой своя длительность, общий итог считается от старта процесса
+    def __init__(self):
+        self.started = self._last_mark = time.perf_counter()
+        self.phases = []
+        self._first_update_seen = False
+
+    def begin(self, started: float):
+        self.started = self._last_mark = started
+
+    def mark(self, name: str):
+        # Последовательная фаза: от предыдущей отметки до этого момента
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last_mark))
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    async def timed(self, name: str, coro):
+        with self.phase(name):
+            return await coro
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        details = " · ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in self.phases)
+        logger.info("⏱ Запуск: %.0f мс до приёма апдейтов (%s, мс)", total * 1000, details)
+
+    def first_update(self):
+        if self._first_update_seen:
+            return
+        self._first_update_seen = True
+        logger.info("⏱ Первый апдейт обработан через %.0f мс после запуска",
+                    (time.perf_counter() - self.started) * 1000)
+
+
+boot_timer = BootTimer()
+
+
+def is_draining() -> bool:
+    return _draining
+
+
+class InFlightMiddleware(BaseMiddleware):
+    # Считает апдейты, которые ещё обрабатываются (вебхук, polling)
+    async def __call__(self, handler, event, data):
+        global _in_flight
+        _in_flight += 1
+        _idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            _in_flight -= 1
+            if not _in_flight:
+                _idle.set()
+            boot_timer.first_update()
+
+
+@web.middleware
+async def reject_while_draining(request: web.Request, handler):
+    # Ответ не 2xx — Telegram повторит доставку апдейта, и его примет уже новый экземпляр
+    if _draining:
+        return web.Response(status=503, headers={"Retry-After": "1"})
+    return await handler(request)
+
+
+async def drain_updates(timeout: float) -> bool:
+    # Перестаём принимать апдейты и ждём, пока обработчики (оформление заказа, уведомления кухни) закончат
+    global _draining
+    _draining = True
+    # Задачи апдейтов, принятых перед остановкой сервера, могли ещё не дойти до middleware
+    await asyncio.sleep(0)
+    if _in_flight:
+        logger.info("⏳ Ожидание завершения обработки апдейтов: %s", _in_flight)
+    try:
+        await asyncio.wait_for(_idle.wait(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("⚠️ За %s с не завершились апдейты: %s — они будут прерваны", timeout, _in_flight)
+        return False
+    return True
+
+
+async def cancel_background_tasks(timeout: float = 5.0):
+    tasks = [task for task in _background_tasks if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+        logger.info("🧹 Остановлено фоновых задач: %s", len(tasks))
+
+
+def setup_drain(dp):
+    dp.update.outer_middleware(InFlightMiddleware())
@@ -0,0 +1,111 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from aiogram import BaseMiddleware
+
+# "json" — JSON-строки для сбора логов, "text" — привычный формат для локальной отладки
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+update_id_var = contextvars.ContextVar("update_id", default=None)
+user_id_var = contextvars.ContextVar("user_id", default=None)
+handler_var = contextvars.ContextVar("handler", default=None)
+
+_CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+
+class ContextFilter(logging.Filter):
+    # Срабатывает в вызывающей задаче, пока contextvars апдейта ещё доступны
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        record.handler = handler_var.get()
+        return True
+
+
+class ContextQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В очередь уходит уже подставленное сообщение (аргументы могут измениться до записи),
+        # но без форматирования под конкретный вывод — это делает фоновый поток
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in _CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> QueueListener:
+    # Обработчики событий только кладут запись в очередь; запись в stderr — в отдельном потоке
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class UpdateLogContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(event.update_id)
+        user_token = user_id_var.set(user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            update_id_var.reset(update_token)
+            user_id_var.reset(user_token)
+
+
+class HandlerLogContextMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        token = handler_var.set(getattr(handler_object.callback, "__name__", None) if handler_object else None)
+        try:
+            return await handler(event, data)
+        finally:
+            handler_var.reset(token)
+
+
+def setup_log_context(dp):
+    dp.update.outer_middleware(UpdateLogContextMiddleware())
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerLogContextMiddleware())
@@ -1,39 +1,87 @@
+import time
+BOOT_STARTED = time.perf_counter()  # до импорта aiogram — он занимает большую часть холодного старта
+
 import os
+import html
+import signal
 import asyncio
 import logging
-import json
+from datetime import datetime, timedelta
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
 
 # Импортируем web из aiohttp — КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ
 from aiohttp import web
 
-from config import BOT_TOKEN, ADMIN_USER_ID, KITCHEN_CHAT_ID, PAYMENT_CARD_NUMBER, PAYMENT_BANK_NAME
-from database import init_db, save_order, get_user_orders, get_all_orders, update_order_status, delete_old_completed_orders
+from config import (
+    BOT_TOKEN, ADMIN_USER_ID, KITCHEN_CHAT_ID, KITCHEN_BOARD, PAYMENT_CARD_NUMBER, PAYMENT_BANK_NAME,
+    SESSION_TTL_SECONDS, SESSION_MAX_ENTRIES, SHUTDOWN_DRAIN_TIMEOUT, BOT_MODE,
+    WEBHOOK_MAX_CONNECTIONS, ORDER_RETENTION_DAYS
+)
+from database import (
+    init_db, read_menu_json, sync_products, get_user_orders, get_all_orders, get_order, update_order_status, delete_old_completed_orders,
+    close_pool, get_sales_stats, create_broadcast, cancel_broadcasts, search_orders, ORDER_SUMMARY_COLUMNS,
+    PAYMENT_ONLINE, PAYMENT_CASH, payment_label, normalize_phone, format_phone
+)
 from keyboards import (
-    main_menu, product_buttons, cart_keyboard, payment_keyboard, admin_keyboard, order_status_buttons,
-    phone_keyboard, build_pizza_custom_keyboard, INGREDIENTS, cart_item_buttons
+    main_menu, product_buttons, cart_keyboard, payment_keyboard, user_orders_keyboard, repeat_order_keyboard, admin_keyboard, order_search_keyboard,
+    order_status_buttons,
+    phone_keyboard, build_pizza_custom_keyboard, INGREDIENTS, INGREDIENT_BITS, INGREDIENT_PORTION, cart_item_buttons,
+    mask_extra_price, mask_ingredients_text, to_base36
 )
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from session_store import TimerWheel, TTLStore
+from logging_setup import setup_logging, setup_log_context
+from scheduler import register_job, start_scheduler
+from traffic import traffic_recorder
+from kitchen_board import KitchenBoard
+from order_journal import place_order, on_order_replayed, start_journal_replayer, provisional_id
+from throttling import setup_throttling
+from lifecycle import spawn, setup_drain, drain_updates, cancel_background_tasks, reject_while_draining, boot_timer
+from fast_runtime import json_dumps, json_loads, install_event_loop
+from export import export_orders_csv, SpooledInputFile
+from menu import current_menu, reload_menu, on_menu_reload, start_menu_listener, stop_menu_listener
+from menu_search import MenuSearchIndex
+from broadcast import start_broadcast, resume_broadcasts, has_active_broadcast, stop_broadcasts
+from images import prepare_images, menu_image_paths, load_photo
+
+setup_logging()
 logger = logging.getLogger(__name__)
+boot_timer.begin(BOOT_STARTED)
 
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(json_loads=json_loads, json_dumps=json_dumps))
 dp = Dispatcher(storage=MemoryStorage())
+setup_log_context(dp)
+setup_drain(dp)
 
-user_carts = {}
-user_active_messages = {}
-user_custom_pizzas = {}
+# Сессии живут в памяти с TTL и лимитом размера — брошенные корзины не копятся бесконечно
+session_wheel = TimerWheel(tick=30)
+user_carts = TTLStore(session_wheel, "carts", ttl=SESSION_TTL_SECONDS, max_entries=SESSION_MAX_ENTRIES)
+user_active_messages = TTLStore(session_wheel, "active_messages", ttl=2 * 3600, max_entries=SESSION_MAX_ENTRIES)
+user_custom_pizzas = TTLStore(session_wheel, "custom_pizzas", ttl=3600, max_entries=SESSION_MAX_ENTRIES)
+# Уже принятые нажатия оплаты: Telegram повторяет апдейт, если вебхук не ответил 200, — повтор не должен создать второй заказ.
+# Telegram хранит неподтверждённые апдейты сутки
+checkout_callbacks = TTLStore(session_wheel, "checkout_callbacks", ttl=24 * 3600, max_entries=SESSION_MAX_ENTRIES)
+# Лимиты частоты нажатий на пользователя; класс обработчика — флаг throttle в декораторе
+throttling = setup_throttling(dp, session_wheel)
+
+kitchen_board = KitchenBoard(bot, KITCHEN_CHAT_ID) if KITCHEN_CHAT_ID and KITCHEN_BOARD else None
 
 
 # === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ===
 
+async def end_checkout(user_id: int, state: FSMContext):
+    # Оформление завершено или брошено: корзина больше не закреплена и снова подчиняется LRU-лимиту
+    user_carts.unpin(user_id)
+    await state.clear()
+
+
 async def clear_active_messages(user_id: int, bot_instance: Bot):
     data = user_active_messages.get(user_id)
     if data:
@@ -45,16 +93,17 @@ async def clear_active_messages(user_id: int, bot_instance: Bot):
         user_active_messages.pop(user_id, None)
 
 
-def get_item_key(category: str, item_index: int, size: str = None, custom: bool = False, ingredients: dict = None):
+# Ключ позиции корзины попадает в callback_data (cart_inc_/cart_dec_/cart_del_), поэтому он короткий:
+# "i3s" — товар с id 3 маленький, "cl1f4" — "Собери сам" большая с маской ингредиентов 0x1f4 в base36
+def get_item_key(product_id: int, size: str = None, custom: bool = False, mask: int = 0):
+    size_suffix = size[0] if size else ""
     if custom:
-        ing_str = "_".join([f"{k}{v}" for k, v in sorted(ingredients.items())]) if ingredients else ""
-        return f"custom_{size}_{ing_str}"
-    else:
-        size_suffix = f"_{size}" if size else ""
-        return f"{category}_{item_index}{size_suffix}"
+        return f"c{size_suffix}{to_base36(mask)}"
+    return f"i{to_base36(product_id)}{size_suffix}"
 
 
-def add_to_cart_safe(user_id: int, item_key: str, name: str, price_per_unit: int, quantity: int = 1, details: dict = None):
+def add_to_cart_safe(user_id: int, item_key: str, name: str, price_per_unit: int, quantity: int = 1, details: dict = None,
+                     product_id: int = None, size: str = None):
     if user_id not in user_carts:
         user_carts[user_id] = {}
     if item_key in user_carts[user_id]:
@@ -64,30 +113,144 @@ def add_to_cart_safe(user_id: int, item_key: str, name: str, price_per_unit: int
             "name": name,
             "price_per_unit": price_per_unit,
             "quantity": quantity,
-            "details": details
+            "details": details,
+            # product_id и size сохраняются в заказе — по ним заказ можно повторить с актуальными ценами
+            "product_id": product_id,
+            "size": size
         }
 
 
+def menu_line_item(found_item: dict, size: str):
+    # Название позиции корзины и цена по текущему меню; None, если цена для размера не указана
+    if found_item["category"] == "Пиццы":
+        if size == "small":
+            price, size_name = found_item.get("price_small"), "Маленькая"
+        elif size == "large":
+            price, size_name = found_item.get("price_large"), "Большая"
+        else:
+            price, size_name = found_item.get("price_small"), "Маленькая"
+        name = f"{found_item['name']} ({size_name})"
+    else:
+        price, name = found_item.get("price_small"), found_item["name"]
+    return None if price is None else (name, price)
+
+
+def _legacy_line_items() -> dict:
+    # Заказы до появления product_id в позициях: сопоставляем по названию позиции корзины
+    lines = {}
+    for product_id, item in current_menu().by_id.items():
+        for size in (("small", "large") if item["category"] == "Пиццы" else ("nosize",)):
+            line = menu_line_item(item, size)
+            if line:
+                lines.setdefault(line[0], (product_id, size))
+    return lines
+
+
+def rebuild_cart(order_items: list):
+    # Корзина из позиций сохранённого заказа по текущему меню и ценам. Возвращает (корзина, не найденные позиции)
+    menu = current_menu()
+    legacy = None
+    cart, missing = {}, []
+    for line in order_items:
+        product_id, size = line.get("product_id"), line.get("size")
+        if product_id is None:
+            if legacy is None:
+                legacy = _legacy_line_items()
+            product_id, size = legacy.get(line.get("product") or line.get("name"), (None, None))
+        found_item = menu.get(product_id) if product_id is not None else None
+        if found_item is None:
+            missing.append(line.get("product") or line.get("name", "—"))
+            continue
+
+        if found_item["name"] == "🍕 Собери сам":
+            mask = line.get("mask")
+            base_price = found_item.get("price_small") if size == "small" else found_item.get("price_large")
+            if mask is None or base_price is None:
+                missing.append(line.get("product") or line.get("name", "—"))
+                continue
+            size_name = "Маленькая" if size == "small" else "Большая"
+            item_key = get_item_key(0, size, custom=True, mask=mask)
+            name, price = f"🍕 Собери сам ({size_name})", base_price + mask_extra_price(mask)
+            details = {"size": size, "mask": mask}
+        else:
+            menu_line = menu_line_item(found_item, size)
+            if menu_line is None:
+                missing.append(line.get("product") or line.get("name", "—"))
+                continue
+            item_key = get_item_key(product_id, size)
+            (name, price), details = menu_line, None
+
+        if item_key in cart:
+            cart[item_key]["quantity"] += line.get("quantity", 1)
+        else:
+            cart[item_key] = {
+                "name": name, "price_per_unit": price, "quantity": line.get("quantity", 1),
+                "details": details, "product_id": product_id, "size": size
+            }
+    return cart, missing
+
+
+def render_cart_text(cart: dict) -> str:
+    subtotal = sum(item["price_per_unit"] * item["quantity"] for item in cart.values())
+    delivery_cost = 0 if subtotal >= 800 else 150
+    total_with_delivery = subtotal + delivery_cost
+
+    text = "🛒 <b>Ваш заказ:</b>\n\n"
+    for item_key, item in cart.items():
+        name = item["name"]
+        if "Собери сам" in name and item.get("details"):
+            name = f"{name} + {mask_ingredients_text(item['details']['mask'])}"
+        text += f"• {name} — <b>{item['price_per_unit']}₽</b> × {item['quantity']} = <b>{item['price_per_unit'] * item['quantity']}₽</b>\n"
+    text += f"\n📦 Сумма товаров: <b>{subtotal}₽</b>\n"
+    text += f"🚚 Доставка: {'Бесплатно' if delivery_cost == 0 else f'{delivery_cost}₽'}\n"
+    text += f"\n<b>Итого к оплате: {total_with_delivery}₽</b>"
+    return text
+
+
+@register_job("cleanup_old_orders", interval=3600)  # раз в час, на одной из реплик
 async def cleanup_old_orders():
-    while True:
-        await asyncio.sleep(3600)  # раз в час
-        await delete_old_completed_orders()
+    return await delete_old_completed_orders(ORDER_RETENTION_DAYS)
 
 
-# === ЗАГРУЗКА МЕНЮ ===
+def product_caption(item: dict, has_sizes: bool) -> str:
+    if has_sizes:
+        return f"<b>{item['name']}</b>\n{item['description']}\n\nМаленькая: <b>{item['price_small']}₽</b> | Большая: <b>{item['price_large']}₽</b>"
+    return f"<b>{item['name']}</b>\n{item['description']}\n\nЦена: <b>{item['price_small']}₽</b>"
 
-try:
-    if not os.path.exists("menu_data.json"):
-        logger.error("Файл menu_data.json не найден!")
-        MENU_DATA = {}
+
+def build_inline_result(product_id: str, item: dict):
+    has_sizes = item["category"] == "Пиццы"
+    if has_sizes:
+        price_text = f"{item['price_small']}₽ / {item['price_large']}₽"
+    else:
+        price_text = f"{item['price_small']}₽"
+    # "Собери сам" требует редактирования подписи к фото — из inline-сообщения его не собрать
+    if item["name"] == "🍕 Собери сам":
+        kb = None
     else:
-        with open("menu_data.json", mode="r", encoding="utf-8") as f:
-            content = f.read()
-            MENU_DATA = json.loads(content)
-        logger.info("Файл menu_data.json успешно загружен.")
-except Exception as e:
-    logger.error(f"Ошибка при загрузке menu_data.json: {e}")
-    MENU_DATA = {}
+        kb = product_buttons(product_id=product_id, price_small=item.get("price_small"), price_large=item.get("price_large"))
+    return InlineQueryResultArticle(
+        id=product_id,
+        title=item["name"],
+        description=f"{price_text} · {item.get('description', '')}",
+        input_message_content=InputTextMessageContent(message_text=product_caption(item, has_sizes), parse_mode="HTML"),
+        reply_markup=kb
+    )
+
+
+menu_index = MenuSearchIndex((), build_inline_result)
+
+
+@on_menu_reload
+def rebuild_menu_index(snapshot):
+    global menu_index
+    menu_index = MenuSearchIndex(((str(item["id"]), item) for item in snapshot), build_inline_result)
+
+
+@on_menu_reload
+def refresh_menu_images(snapshot):
+    # Пока варианты собираются, show_category отправляет исходные файлы
+    spawn(prepare_images(menu_image_paths(snapshot.categories)), name="prepare_images")
 
 
 # === СОСТОЯНИЯ ===
@@ -108,7 +271,7 @@ class AdminFlow(StatesGroup):
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
-    await state.clear()
+    await end_checkout(message.from_user.id, state)
     user_active_messages.pop(message.from_user.id, None)
     is_admin = (message.from_user.id == ADMIN_USER_ID)
     await message.answer(
@@ -119,9 +282,9 @@ async def cmd_start(message: types.Message, state: FSMContext):
     )
 
 
-@dp.message(F.text.in_({"🍕 Меню пицц", "🥗 Салаты и закуски", "🥤 Напитки"}))
+@dp.message(F.text.in_({"🍕 Меню пицц", "🥗 Салаты и закуски", "🥤 Напитки"}), flags={"throttle": "heavy"})
 async def show_category(message: types.Message, state: FSMContext):
-    await state.clear()
+    await end_checkout(message.from_user.id, state)
     await clear_active_messages(message.from_user.id, bot)
 
     category_map = {
@@ -131,24 +294,18 @@ async def show_category(message: types.Message, state: FSMContext):
     }
     category = category_map.get(message.text)
     if not category:
-        await message.answer("❌ Неизвестная категория.", parse_mode="HTML")
-        return
+        return message.answer("❌ Неизвестная категория.", parse_mode="HTML")
 
-    items = MENU_DATA.get(category, [])
+    items = current_menu().categories.get(category, ())
     if not items:
-        await message.answer("📂 Категория пуста.", parse_mode="HTML")
-        return
+        return message.answer("📂 Категория пуста.", parse_mode="HTML")
 
-    category_short = {"Пиццы": "p", "Салаты и закуски": "s", "Напитки": "d"}[category]
     sent_ids = []
-    for idx, item in enumerate(items):
-        product_id = f"{category_short}{idx}"
+    for item in items:
+        product_id = item["id"]
         has_sizes = category == "Пиццы"
 
-        if has_sizes:
-            caption = f"<b>{item['name']}</b>\n{item['description']}\n\nМаленькая: <b>{item['price_small']}₽</b> | Большая: <b>{item['price_large']}₽</b>"
-        else:
-            caption = f"<b>{item['name']}</b>\n{item['description']}\n\nЦена: <b>{item['price_small']}₽</b>"
+        caption = product_caption(item, has_sizes)
 
         kb = product_buttons(
             product_id=product_id,
@@ -161,7 +318,7 @@ async def show_category(message: types.Message, state: FSMContext):
             if image_path.startswith(('http://', 'https://')):
                 photo_input = image_path
             else:
-                photo_input = image_path
+                photo_input = await load_photo(image_path)
             sent = await message.answer_photo(
                 photo=photo_input,
                 caption=caption,
@@ -169,7 +326,7 @@ async def show_category(message: types.Message, state: FSMContext):
                 parse_mode="HTML"
             )
         except Exception as e:
-            logger.warning(f"Не удалось отправить фото для {item['name']}: {e}. Попытка отправки без фото.")
+            logger.warning("Не удалось отправить фото для %s: %s. Попытка отправки без фото.", item['name'], e)
             sent = await message.answer(caption, reply_markup=kb, parse_mode="HTML")
         sent_ids.append(sent.message_id)
 
@@ -179,111 +336,89 @@ async def show_category(message: types.Message, state: FSMContext):
     }
 
 
-@dp.callback_query(F.data.startswith("add_"))
-async def add_to_cart(callback: types.CallbackQuery, state: FSMContext):
-    current_state = await state.get_state()
-    if current_state and current_state != OrderFlow.custom_pizza.state:
-        await state.clear()
-        await callback.answer("❌ Процесс оформления заказа был отменён.", show_alert=True)
-        await clear_active_messages(callback.from_user.id, bot)
-        is_admin = (callback.from_user.id == ADMIN_USER_ID)
-        await callback.message.answer("📂 Выберите раздел:", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
-        return
+@dp.inline_query()
+async def inline_menu_search(inline_query: types.InlineQuery):
+    # Результаты не зависят от пользователя, поэтому Telegram может кэшировать их у себя
+    await inline_query.answer(list(menu_index.search(inline_query.query)), cache_time=300, is_personal=False)
 
-    data = callback.data.replace("add_", "")
-    size = None
-    size_name = ""
-
-    if data.endswith("_small"):
-        product_key = data[:-6]
-        size = "small"
-        size_name = "Маленькая"
-    elif data.endswith("_large"):
-        product_key = data[:-6]
-        size = "large"
-        size_name = "Большая"
-    else:
-        product_key = data.replace("_nosize", "")
-        size = "nosize"
-        size_name = ""
 
-    category_map_short = {"p": "Пиццы", "s": "Салаты и закуски", "d": "Напитки"}
-    if not product_key or len(product_key) < 2:
-        await callback.answer("❌ Некорректный ID товара.", show_alert=True)
-        return
+_ADD_SIZES = {"small": "Маленькая", "large": "Большая", "nosize": ""}
+
 
-    category_short = product_key[0]
-    item_index_str = product_key[1:]
+def parse_add_callback(data: str):
+    # "add_12_large" -> (12, "large", "Большая"), "add_7_nosize" -> (7, "nosize", ""); None, если id некорректный
+    product_key, _, size = data[4:].rpartition("_")
+    if size not in _ADD_SIZES:
+        product_key, size = data[4:], "nosize"
     try:
-        item_index = int(item_index_str)
+        return int(product_key), size, _ADD_SIZES[size]
     except ValueError:
-        await callback.answer("❌ Ошибка индекса товара.", show_alert=True)
-        return
+        return None
 
-    target_category = category_map_short.get(category_short)
-    if not target_category:
-        await callback.answer("❌ Неизвестная категория.", show_alert=True)
-        return
 
-    items = MENU_DATA.get(target_category, [])
-    if item_index >= len(items):
-        await callback.answer("❌ Товар не найден (индекс вне диапазона).", show_alert=True)
+@dp.callback_query(F.data.startswith("add_"), flags={"throttle": "tap"})
+async def add_to_cart(callback: types.CallbackQuery, state: FSMContext):
+    current_state = await state.get_state()
+    if current_state and current_state != OrderFlow.custom_pizza.state:
+        await end_checkout(callback.from_user.id, state)
+        await callback.answer("❌ Процесс оформления заказа был отменён.", show_alert=True)
+        await clear_active_messages(callback.from_user.id, bot)
+        is_admin = (callback.from_user.id == ADMIN_USER_ID)
+        # Кнопка может быть в сообщении из inline-режима — тогда callback.message отсутствует
+        await bot.send_message(callback.from_user.id, "📂 Выберите раздел:", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
         return
 
-    found_item = items[item_index]
+    parsed = parse_add_callback(callback.data)
+    if parsed is None:
+        return callback.answer("❌ Некорректный ID товара.", show_alert=True)
+    product_id, size, size_name = parsed
+
+    found_item = current_menu().get(product_id)
+    if found_item is None:
+        return callback.answer("❌ Товар больше не продаётся.", show_alert=True)
+    target_category = found_item["category"]
 
     if found_item["name"] == "🍕 Собери сам":
         base_price = found_item["price_small"] if size == "small" else found_item["price_large"]
         user_custom_pizzas[callback.from_user.id] = {
+            "product_id": product_id,
             "size": size,
             "base_price": base_price,
-            "ingredients": {}
+            "mask": 0
         }
         await callback.message.edit_caption(
             caption=f"🍕 <b>Соберите свою пиццу ({size_name})</b>\n"
                     f"Основа: {base_price}₽\n\nВыберите ингредиенты:",
-            reply_markup=build_pizza_custom_keyboard({}, base_price, size),
+            reply_markup=build_pizza_custom_keyboard(0, base_price, size),
             parse_mode="HTML"
         )
         await state.set_state(OrderFlow.custom_pizza)
         return
 
-    if target_category == "Пиццы":
-        if size == "small":
-            price = found_item.get("price_small")
-        elif size == "large":
-            price = found_item.get("price_large")
-        else:
-            price = found_item.get("price_small")
-            size_name = "Маленькая"
-        if price is None:
+    line = menu_line_item(found_item, size)
+    if line is None:
+        if target_category == "Пиццы":
             await callback.answer("❌ Цена не указана для этого размера.", show_alert=True)
-            return
-        name = f"{found_item['name']} ({size_name})"
-    else:
-        price = found_item.get("price_small")
-        if price is None:
+        else:
             await callback.answer("❌ Цена не указана.", show_alert=True)
-            return
-        name = found_item["name"]
+        return
+    name, price = line
 
-    item_key = get_item_key(target_category, item_index, size)
-    add_to_cart_safe(callback.from_user.id, item_key, name, price, 1)
-    await callback.answer(f"✅ {name} добавлена в корзину!")
+    item_key = get_item_key(product_id, size)
+    add_to_cart_safe(callback.from_user.id, item_key, name, price, 1, product_id=product_id, size=size)
+    return callback.answer(f"✅ {name} добавлена в корзину!")
 
 
 # --- НОВЫЕ ОБРАБОТЧИКИ ДЛЯ "СОБЕРИ САМ" ---
 
-@dp.callback_query(F.data.startswith("custom_add_"))
+@dp.callback_query(F.data.startswith("custom_add_"), flags={"throttle": "tap"})
 async def custom_add_ingredient(callback: types.CallbackQuery, state: FSMContext):
     if await state.get_state() != OrderFlow.custom_pizza.state:
-        await callback.answer("❌ Сначала начните сборку пиццы.", show_alert=True)
-        return
+        return callback.answer("❌ Сначала начните сборку пиццы.", show_alert=True)
 
     ingredient_key = callback.data.replace("custom_add_", "")
     if ingredient_key not in INGREDIENTS:
-        await callback.answer("❌ Неизвестный ингредиент.", show_alert=True)
-        return
+        return callback.answer("❌ Неизвестный ингредиент.", show_alert=True)
 
     user_data = user_custom_pizzas.get(callback.from_user.id)
     if not user_data:
@@ -291,22 +426,19 @@ async def custom_add_ingredient(callback: types.CallbackQuery, state: FSMContext
         await state.clear()
         return
 
-    current_ingredients = user_data["ingredients"]
-    current_grams = current_ingredients.get(ingredient_key, 0)
-    new_grams = current_grams + 50 if current_grams == 0 else 0
-    current_ingredients[ingredient_key] = new_grams
+    user_data["mask"] ^= INGREDIENT_BITS[ingredient_key]
+    new_grams = INGREDIENT_PORTION if user_data["mask"] & INGREDIENT_BITS[ingredient_key] else 0
 
     # Перерисовываем клавиатуру с обновлёнными ингредиентами
-    new_keyboard = build_pizza_custom_keyboard(current_ingredients, user_data["base_price"], user_data["size"])
+    new_keyboard = build_pizza_custom_keyboard(user_data["mask"], user_data["base_price"], user_data["size"])
     await callback.message.edit_reply_markup(reply_markup=new_keyboard)
-    await callback.answer(f"{'Добавлен' if new_grams > 0 else 'Удалён'} ингредиент: {INGREDIENTS[ingredient_key][0]} ({new_grams}г)")
+    return callback.answer(f"{'Добавлен' if new_grams > 0 else 'Удалён'} ингредиент: {INGREDIENTS[ingredient_key][0]} ({new_grams}г)")
 
 
 @dp.callback_query(F.data == "custom_done")
 async def custom_done(callback: types.CallbackQuery, state: FSMContext):
     if await state.get_state() != OrderFlow.custom_pizza.state:
-        await callback.answer("❌ Сначала начните сборку пиццы.", show_alert=True)
-        return
+        return callback.answer("❌ Сначала начните сборку пиццы.", show_alert=True)
 
     user_data = user_custom_pizzas.get(callback.from_user.id)
     if not user_data:
@@ -316,38 +448,30 @@ async def custom_done(callback: types.CallbackQuery, state: FSMContext):
 
     size = user_data["size"]
     size_name = "Маленькая" if size == "small" else "Большая"
-    ingredients = user_data["ingredients"]
-    base_price = user_data["base_price"]
-
-    total_extra = 0
-    for key, grams in ingredients.items():
-        if key in INGREDIENTS:
-            price_per_50g = INGREDIENTS[key][1]
-            total_extra += (grams // 50) * price_per_50g
-
-    total_price = base_price + total_extra
+    mask = user_data["mask"]
+    total_price = user_data["base_price"] + mask_extra_price(mask)
     name = f"🍕 Собери сам ({size_name})"
 
-    item_key = get_item_key("custom", 0, size, custom=True, ingredients=ingredients)
-    add_to_cart_safe(callback.from_user.id, item_key, name, total_price, 1, details={"size": size, "ingredients": ingredients})
+    item_key = get_item_key(0, size, custom=True, mask=mask)
+    add_to_cart_safe(callback.from_user.id, item_key, name, total_price, 1, details={"size": size, "mask": mask},
+                     product_id=user_data.get("product_id"), size=size)
 
     await state.clear()
     await clear_active_messages(callback.from_user.id, bot)
-    del user_custom_pizzas[callback.from_user.id]
+    user_custom_pizzas.pop(callback.from_user.id, None)
 
     await callback.message.edit_caption(
         caption=f"✅ <b>{name}</b> добавлена в корзину!\nЦена: <b>{total_price}₽</b>",
         reply_markup=None,
         parse_mode="HTML"
     )
-    await callback.answer("✅ Пицца добавлена!")
+    return callback.answer("✅ Пицца добавлена!")
 
 
 @dp.callback_query(F.data == "custom_cancel")
 async def custom_cancel(callback: types.CallbackQuery, state: FSMContext):
     if await state.get_state() != OrderFlow.custom_pizza.state:
-        await callback.answer("❌ Нет активной сборки пиццы.", show_alert=True)
-        return
+        return callback.answer("❌ Нет активной сборки пиццы.", show_alert=True)
 
     user_custom_pizzas.pop(callback.from_user.id, None)
     await state.clear()
@@ -360,7 +484,7 @@ async def custom_cancel(callback: types.CallbackQuery, state: FSMContext):
         parse_mode="HTML"
     )
     await callback.message.answer("📂 Выберите раздел:", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
-    await callback.answer("❌ Сборка отменена.")
+    return callback.answer("❌ Сборка отменена.")
 
 
 # --- КОНЕЦ НОВЫХ ОБРАБОТЧИКОВ ---
@@ -374,20 +498,18 @@ async def clear_cart(callback: types.CallbackQuery, state: FSMContext):
     except TelegramBadRequest:
         pass
     is_admin = (callback.from_user.id == ADMIN_USER_ID)
-    await callback.message.answer("📂 Выберите раздел:", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
+    return callback.message.answer("📂 Выберите раздел:", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
 
 
-@dp.callback_query(F.data.startswith("cart_"))
+@dp.callback_query(F.data.startswith("cart_"), flags={"throttle": "tap"})
 async def cart_manage(callback: types.CallbackQuery):
     parts = callback.data.split("_", 2)
     if len(parts) < 3:
-        await callback.answer("❌ Некорректная команда.", show_alert=True)
-        return
+        return callback.answer("❌ Некорректная команда.", show_alert=True)
     action, item_key = parts[1], parts[2]
     cart = user_carts.get(callback.from_user.id, {})
     if item_key not in cart:
-        await callback.answer("❌ Товар не найден в корзине.", show_alert=True)
-        return
+        return callback.answer("❌ Товар не найден в корзине.", show_alert=True)
 
     if action == "inc":
         cart[item_key]["quantity"] += 1
@@ -412,22 +534,7 @@ async def show_cart_by_callback(callback: types.CallbackQuery):
             await callback.message.answer("🛒 Корзина пуста.", parse_mode="HTML")
         return
 
-    subtotal = sum(item["price_per_unit"] * item["quantity"] for item in cart.values())
-    delivery_cost = 0 if subtotal >= 800 else 150
-    total_with_delivery = subtotal + delivery_cost
-
-    text = "🛒 <b>Ваш заказ:</b>\n\n"
-    for item_key, item in cart.items():
-        name = item["name"]
-        if "Собери сам" in name and "details" in item:
-            details = item["details"]
-            ingredients_str = ", ".join([f"{INGREDIENTS[k][0]} {v}г" for k, v in details["ingredients"].items()])
-            name = f"{name} + {ingredients_str}"
-        text += f"• {name} — <b>{item['price_per_unit']}₽</b> × {item['quantity']} = <b>{item['price_per_unit'] * item['quantity']}₽</b>\n"
-    text += f"\n📦 Сумма товаров: <b>{subtotal}₽</b>\n"
-    text += f"🚚 Доставка: {'Бесплатно' if delivery_cost == 0 else f'{delivery_cost}₽'}\n"
-    text += f"\n<b>Итого к оплате: {total_with_delivery}₽</b>"
-
+    text = render_cart_text(cart)
     try:
         await callback.message.edit_text(text, reply_markup=cart_keyboard(), parse_mode="HTML")
     except TelegramBadRequest:
@@ -438,37 +545,19 @@ async def show_cart_by_callback(callback: types.CallbackQuery):
 async def show_cart(message: types.Message):
     cart = user_carts.get(message.from_user.id, {})
     if not cart:
-        await message.answer("🛒 Корзина пуста.", parse_mode="HTML")
-        return
+        return message.answer("🛒 Корзина пуста.", parse_mode="HTML")
 
-    subtotal = sum(item["price_per_unit"] * item["quantity"] for item in cart.values())
-    delivery_cost = 0 if subtotal >= 800 else 150
-    total_with_delivery = subtotal + delivery_cost
-
-    text = "🛒 <b>Ваш заказ:</b>\n\n"
-    for item_key, item in cart.items():
-        name = item["name"]
-        if "Собери сам" in name and "details" in item:
-            details = item["details"]
-            ingredients_str = ", ".join([f"{INGREDIENTS[k][0]} {v}г" for k, v in details["ingredients"].items()])
-            name = f"{name} + {ingredients_str}"
-        text += f"• {name} — <b>{item['price_per_unit']}₽</b> × {item['quantity']} = <b>{item['price_per_unit'] * item['quantity']}₽</b>\n"
-    text += f"\n📦 Сумма товаров: <b>{subtotal}₽</b>\n"
-    text += f"🚚 Доставка: {'Бесплатно' if delivery_cost == 0 else f'{delivery_cost}₽'}\n"
-    text += f"\n<b>Итого к оплате: {total_with_delivery}₽</b>"
-
-    await message.answer(text, reply_markup=cart_keyboard(), parse_mode="HTML")
+    return message.answer(render_cart_text(cart), reply_markup=cart_keyboard(), parse_mode="HTML")
 
 
 @dp.message(F.text == "📍 Мои заказы")
 async def show_user_orders(message: types.Message):
-    orders = await get_user_orders(message.from_user.id)
+    orders = await get_user_orders(message.from_user.id, columns=ORDER_SUMMARY_COLUMNS, limit=5)
     if not orders:
-        await message.answer("📋 У вас пока нет заказов.", parse_mode="HTML")
-        return
+        return message.answer("📋 У вас пока нет заказов.", parse_mode="HTML")
 
     text = "📋 <b>Ваши последние заказы:</b>\n\n"
-    for order in orders[:5]:  # Показываем последние 5
+    for order in orders:  # Показываем последние 5
         status_map = {
             "new": "🆕 Новый",
             "cooking": "🍳 Готовится",
@@ -476,9 +565,48 @@ async def show_user_orders(message: types.Message):
             "done": "✅ Завершён",
             "cancelled": "❌ Отменён"
         }
-        status_text = status_map.get(order['status'], order['status'])
-        text += f"• <b>Заказ #{order['id']}</b> — {status_text} ({order['total']}₽)\n"
-    await message.answer(text, parse_mode="HTML")
+        status_text = status_map.get(order.status, order.status)
+        text += f"• <b>Заказ #{order.id}</b> — {status_text} ({order.total}₽)\n"
+    return message.answer(text, reply_markup=user_orders_keyboard(orders), parse_mode="HTML")
+
+
+@dp.callback_query(F.data.startswith("repeat_"), flags={"throttle": "checkout"})
+async def repeat_order(callback: types.CallbackQuery, state: FSMContext):
+    try:
+        order_id = int(callback.data.replace("repeat_", ""))
+    except ValueError:
+        return callback.answer("❌ Некорректный номер заказа.", show_alert=True)
+
+    order = await get_order(order_id, columns=("id", "user_id", "items", "address", "phone"))
+    if order is None or order.user_id != callback.from_user.id:
+        # Кнопка из старого сообщения: заказ удалён по сроку хранения
+        return callback.answer(
+            f"❌ Заказ не найден: завершённые заказы хранятся {ORDER_RETENTION_DAYS} дн.", show_alert=True
+        )
+
+    cart, missing = rebuild_cart(order.items)
+    if not cart:
+        return callback.answer("❌ Позиций из этого заказа больше нет в меню.", show_alert=True)
+
+    # Корзина заменяется целиком, адрес и телефон — из прошлого заказа: остаётся одно нажатие "Оплата"
+    await state.clear()
+    user_carts[callback.from_user.id] = cart
+    user_carts.pin(callback.from_user.id)
+    if not order.address or not order.phone:
+        await callback.message.answer(render_cart_text(cart), parse_mode="HTML")
+        await callback.message.answer("Введите адрес доставки:", parse_mode="HTML")
+        await state.set_state(OrderFlow.waiting_for_address)
+        return callback.answer()
+    phone = format_phone(order.phone)
+    await state.update_data(address=order.address, phone=phone)
+    await state.set_state(OrderFlow.waiting_for_payment)
+
+    text = f"🔁 <b>Повтор заказа #{order.id}</b> по текущим ценам\n\n" + render_cart_text(cart)
+    if missing:
+        text += "\n\n⚠️ Больше не продаются: " + ", ".join(missing)
+    text += f"\n\n📍 Адрес: {order.address}\n📞 Телефон: <code>{phone}</code>\n\nВыберите способ оплаты:"
+    await callback.message.answer(text, reply_markup=repeat_order_keyboard(), parse_mode="HTML")
+    return callback.answer()
 
 
 @dp.message(F.text == "ℹ️ О нас / Доставка")
@@ -491,7 +619,7 @@ async def about_info(message: types.Message):
         "СБП: Тинькофф / Сбербанк.\n\n"
         "📞 Поддержка: +7 (952) 114-87-67"
     )
-    await message.answer(text, parse_mode="HTML")
+    return message.answer(text, parse_mode="HTML")
 
 
 @dp.message(F.text == "🔐 Админка")
@@ -542,7 +670,8 @@ async def handle_phone_contact(message: types.Message, state: FSMContext):
 async def handle_phone_text(message: types.Message, state: FSMContext):
     if await state.get_state() == OrderFlow.waiting_for_phone:
         phone_number = message.text
-        if phone_number.startswith(('+', '7', '8')) and len(phone_number) >= 10:
+        # Номер хранится цифрами (BIGINT) — не принимаем то, что normalize_phone не сможет сохранить
+        if phone_number.startswith(('+', '7', '8')) and len(phone_number) >= 10 and normalize_phone(phone_number):
             await state.update_data(phone=phone_number)
             await message.answer(f"✅ Телефон: <code>{phone_number}</code> получен.", parse_mode="HTML")
             data = await state.get_data()
@@ -568,42 +697,47 @@ async def handle_address(message: types.Message, state: FSMContext):
     await state.set_state(OrderFlow.waiting_for_phone)
 
 
-@dp.message(F.text == "✅ Оформить заказ")
+@dp.message(F.text == "✅ Оформить заказ", flags={"throttle": "checkout"})
 async def initiate_checkout(message: types.Message, state: FSMContext):
     cart = user_carts.get(message.from_user.id, {})
     if not cart:
-        await message.answer("❌ Корзина пуста. Добавьте товары перед оформлением заказа.", parse_mode="HTML")
-        return
+        return message.answer("❌ Корзина пуста. Добавьте товары перед оформлением заказа.", parse_mode="HTML")
+    user_carts.pin(message.from_user.id)
     await message.answer("Введите адрес доставки:", parse_mode="HTML")
     await state.set_state(OrderFlow.waiting_for_address)
 
 
-@dp.callback_query(F.data == "checkout")
+@dp.callback_query(F.data == "checkout", flags={"throttle": "checkout"})
 async def initiate_checkout_callback(callback: types.CallbackQuery, state: FSMContext):
     cart = user_carts.get(callback.from_user.id, {})
     if not cart:
-        await callback.answer("❌ Корзина пуста. Добавьте товары перед оформлением заказа.", show_alert=True)
-        return
+        return callback.answer("❌ Корзина пуста. Добавьте товары перед оформлением заказа.", show_alert=True)
+    user_carts.pin(callback.from_user.id)
     await callback.message.answer("Введите адрес доставки:", parse_mode="HTML")
     await state.set_state(OrderFlow.waiting_for_address)
 
 
-@dp.callback_query(OrderFlow.waiting_for_payment, F.data.startswith("pay_"))
+@dp.callback_query(OrderFlow.waiting_for_payment, F.data.startswith("pay_"), flags={"throttle": "checkout"})
 async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
-    payment_method_map = {"pay_online": "💳 Онлайн", "pay_cash": "💵 Наличными"}
-    payment = payment_method_map.get(callback.data, "Неизвестно")
+    payment_method_map = {"pay_online": PAYMENT_ONLINE, "pay_cash": PAYMENT_CASH}
+    payment = payment_method_map.get(callback.data)
+    if payment is None:
+        return callback.answer("❌ Неизвестный способ оплаты", show_alert=True)
+    if callback.id in checkout_callbacks:
+        return callback.answer("⏳ Заказ уже оформлен")
+    checkout_callbacks[callback.id] = True
     await state.update_data(payment_method=payment)
 
     data = await state.get_data()
     cart = user_carts.get(callback.from_user.id, {})
     if not cart:
         await callback.message.answer("❌ Корзина пуста. Повторите заказ.", parse_mode="HTML")
-        await state.clear()
+        await end_checkout(callback.from_user.id, state)
         return
 
     if "address" not in data or "phone" not in data:
         await callback.message.answer("❌ Не хватает данных. Начните снова.", parse_mode="HTML")
-        await state.clear()
+        await end_checkout(callback.from_user.id, state)
         return
 
     subtotal = sum(item["price_per_unit"] * item["quantity"] for item in cart.values())
@@ -615,17 +749,21 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
     for item in cart.values():
         item_dict = {
             "name": item["name"],
+            "product": item["name"],  # ключ для статистики продаж — без списка ингредиентов
             "price": item["price_per_unit"],
-            "quantity": item["quantity"]
+            "quantity": item["quantity"],
+            "product_id": item.get("product_id"),
+            "size": item.get("size")
         }
-        if "Собери сам" in item["name"] and "details" in item:
+        if "Собери сам" in item["name"] and item.get("details"):
             is_custom_order = True
             details = item["details"]
-            ingredients_str = ", ".join([f"{INGREDIENTS[k][0]} {v}г" for k, v in details["ingredients"].items()])
-            item_dict["name"] = f"{item['name']} ({details['size']}) + {ingredients_str}"
+            item_dict["name"] = f"{item['name']} ({details['size']}) + {mask_ingredients_text(details['mask'])}"
+            item_dict["mask"] = details["mask"]
         items_list.append(item_dict)
 
-    order_id = await save_order(
+    # При недоступной БД заказ уходит в журнал и получает временный номер — клиент и кухня работают как обычно
+    order_id, provisional = await place_order(
         user_id=callback.from_user.id,
         items=items_list,
         total=total_with_delivery,
@@ -633,14 +771,16 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
         payment_method=payment,
         phone=data["phone"]
     )
+    if provisional:
+        order_id = provisional
 
     if order_id is None:
         logger.error("❌ Не удалось сохранить заказ")
         await callback.message.answer("❌ Ошибка при сохранении заказа.", parse_mode="HTML")
-        await state.clear()
+        await end_checkout(callback.from_user.id, state)
         return
 
-    if payment == "💳 Онлайн":
+    if payment == PAYMENT_ONLINE:
         await callback.message.answer(
             f"✅ <b>Заказ #{order_id} создан!</b>\n\n"
             f"📦 Сумма товаров: <b>{subtotal}₽</b>\n"
@@ -659,13 +799,15 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
         )
         await state.set_state(OrderFlow.waiting_for_receipt)
         await state.update_data(order_id=order_id)
+        # Заказ уже сохранён — корзину, ждущую чека, защищать от вытеснения незачем
+        user_carts.unpin(callback.from_user.id)
 
     else:
         await callback.message.answer(
             f"✅ <b>Заказ принят!</b>\n\n"
             f"📍 Адрес: {data['address']}\n"
             f"📞 Телефон: {data['phone']}\n"
-            f"💳 Оплата: {payment}\n"
+            f"💳 Оплата: {payment_label(payment)}\n"
             f"📦 Сумма товаров: <b>{subtotal}₽</b>\n"
             f"🚚 Доставка: {'Бесплатно' if delivery_cost == 0 else f'{delivery_cost}₽'}\n"
             f"<b>Итого: {total_with_delivery}₽</b>\n\n"
@@ -674,9 +816,12 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
         )
         # Для наличных — сразу очищаем корзину и состояние
         user_carts.pop(callback.from_user.id, None)
-        await state.clear()
+        await end_checkout(callback.from_user.id, state)
 
-    if KITCHEN_CHAT_ID:
+    # Заказа из журнала ещё нет в БД, а доска строится по БД — такой заказ уходит на кухню отдельным сообщением
+    if kitchen_board and not provisional:
+        kitchen_board.refresh()
+    elif KITCHEN_CHAT_ID:
         try:
             order_text = ""
             if is_custom_order:
@@ -686,7 +831,7 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
             order_text += f"🆔 ID: {callback.from_user.id}\n"
             order_text += f"📍 Адрес: {data['address']}\n"
             order_text += f"📞 Телефон: {data['phone']}\n"
-            order_text += f"💳 Оплата: {payment}\n"
+            order_text += f"💳 Оплата: {payment_label(payment)}\n"
             order_text += f"📦 Сумма товаров: {subtotal}₽\n"
             order_text += f"🚚 Доставка: {'Бесплатно' if delivery_cost == 0 else f'{delivery_cost}₽'}\n"
             order_text += f"<b>Итого: {total_with_delivery}₽</b>\n\n"
@@ -694,9 +839,9 @@ async def payment_selected(callback: types.CallbackQuery, state: FSMContext):
                 order_text += f"• {item['name']} ×{item['quantity']} — {item['price'] * item['quantity']}₽\n"
             await bot.send_message(KITCHEN_CHAT_ID, order_text, parse_mode="HTML")
         except Exception as e:
-            logger.error(f"Ошибка отправки уведомления на кухню: {e}")
+            logger.error("Ошибка отправки уведомления на кухню: %s", e)
 
-    if payment != "💳 Онлайн":
+    if payment != PAYMENT_ONLINE:
         # Если оплата не онлайн — можно сразу вернуться в меню
         is_admin = (callback.from_user.id == ADMIN_USER_ID)
         await callback.message.answer("🙏 Спасибо за заказ! 🍕", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
@@ -736,13 +881,13 @@ async def receive_payment_info(message: types.Message, state: FSMContext):
 
         await message.answer("✅ Информация получена! Администратор проверит оплату и подтвердит заказ.", parse_mode="HTML")
     except Exception as e:
-        logger.error(f"❌ Не удалось отправить данные админу: {e}")
+        logger.error("❌ Не удалось отправить данные админу: %s", e)
         await message.answer("❌ Не удалось отправить данные. Пожалуйста, свяжитесь с поддержкой.", parse_mode="HTML")
 
     user_carts.pop(message.from_user.id, None)
-    await state.clear()
+    await end_checkout(message.from_user.id, state)
     is_admin = (message.from_user.id == ADMIN_USER_ID)
-    await message.answer("🙏 Спасибо за заказ! 🍕", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
+    return message.answer("🙏 Спасибо за заказ! 🍕", reply_markup=main_menu(is_admin=is_admin), parse_mode="HTML")
 
 
 @dp.message(Command("admin"))
@@ -755,50 +900,257 @@ async def admin_cmd(message: types.Message):
 
 @dp.callback_query(F.data == "admin_orders")
 async def admin_show_orders(callback: types.CallbackQuery):
-    all_orders = await get_all_orders(20)
-    active_orders = [order for order in all_orders if order["status"] not in ('done', 'cancelled')]
+    all_orders = await get_all_orders(20, columns=ORDER_SUMMARY_COLUMNS, reader_id=callback.from_user.id)
+    active_orders = [order for order in all_orders if order.status not in ('done', 'cancelled')]
 
     if not active_orders:
         await callback.message.answer("🛒 Корзина пуста.", parse_mode="HTML")
-        await callback.answer()
-        return
+        return callback.answer()
 
     keyboard = []
     for order in active_orders:
-        status_emoji = {"new": "🆕", "cooking": "🍳", "delivery": "🚚", "done": "✅", "cancelled": "❌"}.get(order['status'], "❓")
-        btn_text = f"{status_emoji} Заказ #{order['id']} ({order['total']}₽)"
-        keyboard.append([InlineKeyboardButton(text=btn_text, callback_data=f"admin_order_{order['id']}")])
+        status_emoji = {"new": "🆕", "cooking": "🍳", "delivery": "🚚", "done": "✅", "cancelled": "❌"}.get(order.status, "❓")
+        btn_text = f"{status_emoji} Заказ #{order.id} ({order.total}₽)"
+        keyboard.append([InlineKeyboardButton(text=btn_text, callback_data=f"admin_order_{order.id}")])
     
     keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_admin")])
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
 
     await callback.message.answer("📦 <b>Активные заказы:</b>", reply_markup=reply_markup, parse_mode="HTML")
-    await callback.answer()
+    return callback.answer()
 
 
-@dp.callback_query(F.data.startswith("admin_order_"))
-async def show_admin_order_details(callback: types.CallbackQuery):
+SEARCH_PAGE_SIZE = 10
+SEARCH_COLUMNS = ("id", "total", "status", "address")
+
+
+@dp.callback_query(F.data == "admin_search")
+async def admin_search_start(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_USER_ID:
+        return callback.answer("❌ Доступ запрещён.", show_alert=True)
+    await state.set_state(AdminFlow.waiting_for_order_id)
+    await callback.message.answer(
+        "🔎 Введите номер заказа (<code>#123</code>), телефон или его последние цифры, либо часть адреса:",
+        parse_mode="HTML"
+    )
+    return callback.answer()
+
+
+async def admin_search_page(query: str, reader_id: int, before_id: int = None):
+    # Берём на один заказ больше страницы — так видно, есть ли следующая, без COUNT(*)
+    orders = await search_orders(query, before_id, SEARCH_PAGE_SIZE + 1, columns=SEARCH_COLUMNS, reader_id=reader_id)
+    if orders is None:
+        return None, None
+    if not orders:
+        return f"🔎 По запросу «{html.escape(query)}» ничего не найдено.", order_search_keyboard([], False)
+    has_more = len(orders) > SEARCH_PAGE_SIZE
+    orders = orders[:SEARCH_PAGE_SIZE]
+    return f"🔎 Заказы по запросу «{html.escape(query)}»:", order_search_keyboard(orders, has_more)
+
+
+@dp.message(AdminFlow.waiting_for_order_id)
+async def admin_search_query(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_USER_ID:
+        await state.clear()
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    query = (message.text or "").strip()
     try:
-        order_id = int(callback.data.split("_")[-1])
+        text, markup = await admin_search_page(query, message.from_user.id)
+    except Exception as e:
+        logger.error("❌ Ошибка поиска заказов: %s", e)
+        await state.clear()
+        return message.answer("❌ Не удалось выполнить поиск.", parse_mode="HTML")
+    if text is None:
+        return message.answer(
+            "❌ Слишком короткий запрос: нужен номер заказа, не меньше 4 цифр телефона или 3 символов адреса.",
+            parse_mode="HTML"
+        )
+    # Запрос остаётся в данных состояния для кнопки "Дальше"; само состояние снимаем, чтобы не ловить обычный текст
+    await state.set_state(None)
+    await state.update_data(admin_search=query)
+    return message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+
+@dp.callback_query(F.data.startswith("admin_search_more_"))
+async def admin_search_more(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_USER_ID:
+        return callback.answer("❌ Доступ запрещён.", show_alert=True)
+    query = (await state.get_data()).get("admin_search")
+    try:
+        before_id = int(callback.data.rpartition("_")[2])
     except ValueError:
-        await callback.answer("❌ Неверный ID заказа.", show_alert=True)
+        return callback.answer("❌ Некорректная страница.", show_alert=True)
+    if not query:
+        return callback.answer("⌛ Поиск устарел — начните новый.", show_alert=True)
+    try:
+        text, markup = await admin_search_page(query, callback.from_user.id, before_id)
+    except Exception as e:
+        logger.error("❌ Ошибка поиска заказов: %s", e)
+        return callback.answer("❌ Не удалось выполнить поиск.", show_alert=True)
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    return callback.answer()
+
+
+def format_sales_stats(stats: dict) -> str:
+    daily = {row["day"]: row for row in stats["daily"]}
+    today = daily.get(stats["today"])
+    text = "📊 <b>Статистика продаж</b>\n\n"
+    if today:
+        text += f"Сегодня: <b>{today['orders_count']}</b> заказов на <b>{today['revenue']}₽</b>"
+        text += f" (отменено: {today['cancelled_count']})\n"
+    else:
+        text += "Сегодня заказов ещё не было.\n"
+
+    period_orders = sum(row["orders_count"] for row in stats["daily"])
+    period_revenue = sum(row["revenue"] for row in stats["daily"])
+    text += f"За {stats['days']} дн.: <b>{period_orders}</b> заказов на <b>{period_revenue}₽</b>\n\n"
+
+    if stats["daily"]:
+        text += "<b>По дням:</b>\n"
+        for row in stats["daily"]:
+            text += f"• {row['day'].strftime('%d.%m')} — {row['orders_count']} шт., {row['revenue']}₽\n"
+    if stats["top_products"]:
+        text += "\n<b>Топ товаров:</b>\n"
+        for i, row in enumerate(stats["top_products"], 1):
+            text += f"{i}. {row['product']} — {row['quantity']} шт., {row['revenue']}₽\n"
+    return text
+
+
+@dp.message(Command("stats"))
+async def admin_stats_cmd(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    stats = await get_sales_stats()
+    if stats is None:
+        return message.answer("❌ Не удалось получить статистику.", parse_mode="HTML")
+    return message.answer(format_sales_stats(stats), parse_mode="HTML")
+
+
+@dp.callback_query(F.data == "admin_stats")
+async def admin_stats(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_USER_ID:
+        return callback.answer("❌ Доступ запрещён.", show_alert=True)
+    stats = await get_sales_stats()
+    if stats is None:
+        return callback.answer("❌ Не удалось получить статистику.", show_alert=True)
+    back = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_admin")]])
+    await callback.message.edit_text(format_sales_stats(stats), reply_markup=back, parse_mode="HTML")
+    return callback.answer()
+
+
+def parse_export_period(args: str):
+    # "/export" — последние 7 дней, "/export 01.10.2026" — один день, "/export 01.10.2026 15.10.2026" — период
+    parts = (args or "").split()
+    if not parts:
+        date_to = datetime.now().date()
+        return date_to - timedelta(days=6), date_to
+    if len(parts) > 2:
+        raise ValueError("слишком много аргументов")
+    dates = [datetime.strptime(part, "%d.%m.%Y").date() for part in parts]
+    date_from, date_to = dates[0], dates[-1]
+    if date_from > date_to:
+        raise ValueError("начало периода позже конца")
+    return date_from, date_to
+
+
+@dp.message(Command("export"))
+async def admin_export_cmd(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    try:
+        date_from, date_to = parse_export_period(message.text.partition(" ")[2])
+    except ValueError:
+        await message.answer(
+            "❌ Формат: <code>/export</code>, <code>/export ДД.ММ.ГГГГ</code> "
+            "или <code>/export ДД.ММ.ГГГГ ДД.ММ.ГГГГ</code>",
+            parse_mode="HTML"
+        )
         return
 
-    from database import pool
-    if pool is None:
-        await callback.message.answer("❌ Ошибка: База данных недоступна.")
-        return
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT id, user_id, items, total, address, phone, payment_method, status, created_at FROM orders WHERE id = $1",
-            order_id
+    await message.answer("⏳ Готовлю выгрузку заказов...", parse_mode="HTML")
+    try:
+        spool, rows_count = await export_orders_csv(date_from, date_to)
+    except Exception as e:
+        logger.error("❌ Ошибка выгрузки заказов: %s", e)
+        return message.answer("❌ Не удалось выгрузить заказы.", parse_mode="HTML")
+
+    filename = f"orders_{date_from:%Y%m%d}_{date_to:%Y%m%d}.csv.gz"
+    try:
+        await message.answer_document(
+            SpooledInputFile(spool, filename),
+            caption=f"📤 Заказы {date_from:%d.%m.%Y} — {date_to:%d.%m.%Y}: {rows_count} шт.",
+            parse_mode="HTML"
+        )
+    finally:
+        spool.close()
+
+
+@dp.message(Command("reload_menu"))
+async def admin_reload_menu(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    data = read_menu_json()
+    if data is None:
+        return message.answer("❌ Не удалось прочитать menu_data.json.", parse_mode="HTML")
+    try:
+        result = await sync_products(data)
+    except Exception as e:
+        logger.error("❌ Ошибка синхронизации товаров: %s", e)
+        return message.answer("❌ Ошибка синхронизации товаров.", parse_mode="HTML")
+    # Остальные реплики перечитают меню по NOTIFY от триггера на products
+    snapshot = await reload_menu()
+    await message.answer(
+        f"✅ Меню обновлено (версия {snapshot.version}, товаров {len(snapshot.by_id)}).\n"
+        f"Добавлено: {result['inserted']}, изменено: {result['updated']}, удалено: {result['deleted']}",
+        parse_mode="HTML"
+    )
+
+
+@dp.message(Command("broadcast"))
+async def admin_broadcast(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    text = message.text.partition(" ")[2].strip()
+    if not text:
+        await message.answer(
+            "📣 Формат: <code>/broadcast текст сообщения</code>\n"
+            "Сообщение получат все, кто хотя бы раз делал заказ. Остановить: /broadcast_stop",
+            parse_mode="HTML"
         )
-    
-    if not row:
-        await callback.message.answer(f"❌ Заказ #{order_id} не найден.")
         return
+    if has_active_broadcast():
+        return message.answer("❌ Уже идёт рассылка. Остановите её командой /broadcast_stop.", parse_mode="HTML")
+    broadcast = await create_broadcast(text, message.chat.id)
+    if broadcast is None:
+        return message.answer("❌ Не удалось создать рассылку.", parse_mode="HTML")
+    start_broadcast(bot, broadcast)
+
+
+@dp.message(Command("broadcast_stop"))
+async def admin_broadcast_stop(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        return message.answer("❌ Доступ запрещён.", parse_mode="HTML")
+    # Рассылка заметит отмену на ближайшей контрольной точке (не позже чем через 10 секунд)
+    cancelled = await cancel_broadcasts()
+    if cancelled:
+        await message.answer(f"⛔ Остановлено рассылок: {cancelled}", parse_mode="HTML")
+    else:
+        await message.answer("ℹ️ Активных рассылок нет.", parse_mode="HTML")
+
+
+@dp.callback_query(F.data.startswith("admin_order_"))
+async def show_admin_order_details(callback: types.CallbackQuery):
+    try:
+        order_id = int(callback.data.split("_")[-1])
+    except ValueError:
+        return callback.answer("❌ Неверный ID заказа.", show_alert=True)
+
+    # Доступность основной базы и реплики проверяет get_order: при ошибке он вернёт None
+    order = await get_order(order_id)
+
+    if not order:
+        return callback.message.answer(f"❌ Заказ #{order_id} не найден или база недоступна.")
 
-    items = json.loads(row["items"]) if row["items"] else []
     status_map = {
         "new": "🆕 Новый",
         "cooking": "🍳 Готовится",
@@ -806,30 +1158,30 @@ async def show_admin_order_details(callback: types.CallbackQuery):
         "done": "✅ Завершён",
         "cancelled": "❌ Отменён"
     }
-    status_text = status_map.get(row["status"], row["status"])
-    created_at_str = row["created_at"].strftime('%d.%m.%Y %H:%M')
+    status_text = status_map.get(order.status, order.status)
+    created_at_str = order.created_at.strftime('%d.%m.%Y %H:%M')
 
     try:
-        user = await bot.get_chat(row["user_id"])
+        user = await bot.get_chat(order.user_id)
         user_name = user.full_name
-    except:
-        user_name = f"ID: {row['user_id']}"
+    except Exception:
+        user_name = f"ID: {order.user_id}"
 
     text = (
-        f"📋 <b>Заказ #{row['id']}</b>\n\n"
+        f"📋 <b>Заказ #{order.id}</b>\n\n"
         f"👤 Пользователь: {user_name}\n"
-        f"📞 Телефон: {row['phone']}\n"
-        f"📍 Адрес: {row['address']}\n"
-        f"💳 Оплата: {row['payment_method']}\n"
+        f"📞 Телефон: {format_phone(order.phone) or order.phone_raw or '—'}\n"
+        f"📍 Адрес: {order.address}\n"
+        f"💳 Оплата: {payment_label(order.payment_method)}\n"
         f"🔄 Статус: {status_text}\n"
         f"🕗 Время: {created_at_str}\n"
-        f"💰 Итого: {row['total']}₽\n\n"
+        f"💰 Итого: {order.total}₽\n\n"
         f"<b>Состав:</b>\n"
     )
-    for item in items:
+    for item in order.items:
         text += f"• {item.get('name', '—')} ×{item.get('quantity', 1)}\n"
 
-    await callback.message.edit_text(text, reply_markup=order_status_buttons(row['id'], row['status']), parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=order_status_buttons(order.id, order.status), parse_mode="HTML")
 
 
 @dp.callback_query(F.data.startswith("status_"))
@@ -839,11 +1191,12 @@ async def admin_update_order_status(callback: types.CallbackQuery):
         action = parts[1]
         order_id = int(parts[2])
     except (ValueError, IndexError):
-        await callback.answer("❌ Ошибка обработки команды.", show_alert=True)
-        return
+        return callback.answer("❌ Ошибка обработки команды.", show_alert=True)
 
     new_status = "cancelled" if action == "cancel" else action
-    user_id = await update_order_status(order_id, new_status)
+    user_id = await update_order_status(order_id, new_status, changed_by=callback.from_user.id)
+    if kitchen_board and user_id:
+        kitchen_board.refresh()
 
     if user_id:
         status_messages = {
@@ -856,46 +1209,168 @@ async def admin_update_order_status(callback: types.CallbackQuery):
         try:
             await bot.send_message(user_id, f"🔄 Статус заказа обновлён: {msg}", parse_mode="HTML")
         except Exception as e:
-            logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+            logger.warning("Не удалось отправить уведомление пользователю %s: %s", user_id, e)
 
     status_labels = {"cooking": "готовится", "delivery": "выехал", "done": "завершён", "cancel": "отменён"}
     await callback.answer(f"✅ Статус обновлён на '{status_labels.get(action, action)}'")
     await callback.message.edit_reply_markup(reply_markup=order_status_buttons(order_id, new_status))
 
 
+@dp.errors()
+async def handler_error(event: types.ErrorEvent):
+    # Ошибка считается обработанной: иначе вебхук ответит 500 и Telegram будет присылать тот же апдейт снова
+    logger.error("❌ Ошибка обработки апдейта %s: %s", event.update.update_id, event.exception, exc_info=event.exception)
+    return True
+
+
 # === ON STARTUP / SHUTDOWN ===
 
+@on_order_replayed
+async def notify_order_replayed(record: dict, order_id: int):
+    provisional = provisional_id(record["journal_id"])
+    try:
+        await bot.send_message(
+            record["user_id"], f"✅ Заказ {provisional} зарегистрирован под номером <b>#{order_id}</b>.", parse_mode="HTML"
+        )
+    except Exception as e:
+        logger.warning("⚠️ Не удалось сообщить номер заказа #%s пользователю %s: %s", order_id, record["user_id"], e)
+    if kitchen_board:
+        kitchen_board.refresh()
+    elif KITCHEN_CHAT_ID:
+        await bot.send_message(KITCHEN_CHAT_ID, f"📒 Заказ {provisional} записан в систему как #{order_id}", parse_mode="HTML")
+
+
+async def start_services():
+    logger.info("DATABASE_URL задан: %s", 'Да' if os.getenv('DATABASE_URL') else 'Нет')
+    with boot_timer.phase("init_db"):
+        await init_db()
+    # Дальше всё зависит только от пула — запускаем параллельно
+    await asyncio.gather(
+        boot_timer.timed("menu", reload_menu()),
+        boot_timer.timed("menu_listener", start_menu_listener()),
+        boot_timer.timed("broadcasts", resume_broadcasts(bot)),
+    )
+    start_scheduler()
+    spawn(session_wheel.run(), name="session_wheel")
+    start_journal_replayer()
+    if kitchen_board:
+        kitchen_board.start()
+
+
+async def stop_services():
+    await stop_broadcasts()
+    await cancel_background_tasks()
+
+
+async def ensure_webhook(webhook_url: str):
+    # На холодном старте вебхук обычно уже стоит: getWebhookInfo — одно чтение, а лишний setWebhook
+    # заставляет Telegram переподключаться
+    info = await bot.get_webhook_info()
+    if info.url == webhook_url and info.max_connections == WEBHOOK_MAX_CONNECTIONS:
+        logger.info("✅ Вебхук уже установлен: %s", webhook_url)
+        return
+    await bot.set_webhook(webhook_url, max_connections=WEBHOOK_MAX_CONNECTIONS)
+    logger.info("✅ Вебхук установлен: %s", webhook_url)
+
+
 async def on_startup(bot_app: web.Application):
-    logger.info("🚀 Запуск бота...")
+    boot_timer.mark("app_setup")
+    logger.info("🚀 Запуск бота (вебхук)...")
     render_url = os.getenv('RENDER_EXTERNAL_URL')
-    logger.info(f"RENDER_EXTERNAL_URL = {render_url}")
-    logger.info(f"DATABASE_URL задан: {'Да' if os.getenv('DATABASE_URL') else 'Нет'}")
-    await init_db()
-    asyncio.create_task(cleanup_old_orders())
+    logger.info("RENDER_EXTERNAL_URL = %s", render_url)
     if render_url:
         webhook_url = f"{render_url.rstrip('/')}/webhook/{BOT_TOKEN}"
-        await bot.set_webhook(webhook_url)
-        logger.info(f"✅ Вебхук установлен: {webhook_url}")
+        # Проверка вебхука не зависит от БД — идёт параллельно с init_db. Апдейты начнут приниматься
+        # только после on_startup, так что раньше времени обработчики их не увидят
+        await asyncio.gather(start_services(), boot_timer.timed("webhook", ensure_webhook(webhook_url)))
     else:
+        await start_services()
         logger.warning("⚠️ RENDER_EXTERNAL_URL не задан — вебхук не установлен!")
         logger.warning("⚠️ На Render переменная RENDER_EXTERNAL_URL устанавливается автоматически. Проверьте конфигурацию сервиса.")
+        logger.warning("⚠️ Без публичного адреса запускайте бота с BOT_MODE=polling.")
+    boot_timer.report()
+
+
+async def on_drain(bot_app: web.Application):
+    # Первым из on_shutdown: сервер уже не принимает соединения, сессия бота ещё открыта —
+    # обработчики спокойно дописывают заказы и отправляют уведомления
+    logger.info("🛑 Завершение работы бота: дожидаемся текущих апдейтов...")
+    try:
+        await stop_menu_listener()
+        if await drain_updates(SHUTDOWN_DRAIN_TIMEOUT):
+            logger.info("✅ Все принятые апдейты обработаны.")
+        await stop_services()
+    except Exception as e:
+        logger.error("Ошибка при остановке обработки: %s", e)
 
 
 async def on_shutdown(bot_app: web.Application):
-    logger.info("🛑 Завершение работы бота...")
+    # on_cleanup: сессию бота к этому моменту закрыл SimpleRequestHandler
     try:
-        await bot.session.close()
+        await close_pool(timeout=5)
     except Exception as e:
-        logger.error(f"Ошибка при завершении: {e}")
+        logger.error("Ошибка при завершении: %s", e)
     logger.info("✅ Бот остановлен.")
 
 
+async def run_polling():
+    from polling import UpdatePoller
+
+    logger.info("🚀 Запуск бота (long polling)...")
+    await start_services()
+    boot_timer.report()
+    poller = UpdatePoller(bot, dp)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, poller.stop)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await poller.run()
+    finally:
+        logger.info("🛑 Завершение работы бота: дожидаемся текущих апдейтов...")
+        try:
+            await stop_menu_listener()
+            if await poller.drain(SHUTDOWN_DRAIN_TIMEOUT):
+                logger.info("✅ Все полученные апдейты обработаны.")
+            await stop_services()
+            await bot.session.close()
+            await close_pool(timeout=5)
+        except Exception as e:
+            logger.error("Ошибка при завершении: %s", e)
+        logger.info("✅ Бот остановлен.")
+
+
 # === MAIN ===
 
+# Тексты кнопок клавиатур сохраняются в записи апдейтов как есть, остальной текст пользователей обезличивается
+RECORDED_TEXTS = {
+    button.text
+    for markup in (main_menu(is_admin=True), phone_keyboard())
+    for row in markup.keyboard
+    for button in row
+} | {"✅ Оформить заказ"}
+
+
 def main():
-    app = web.Application()
+    boot_timer.mark("imports")
+    install_event_loop()
+    if BOT_MODE == "polling":
+        asyncio.run(run_polling())
+        return
+
     webhook_path = f"/webhook/{BOT_TOKEN}"
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=webhook_path)
+    middlewares = [reject_while_draining]
+    recorder = traffic_recorder(webhook_path, keep_texts=RECORDED_TEXTS)
+    if recorder:
+        middlewares.append(recorder)
+    app = web.Application(middlewares=middlewares)
+    # Обработчики on_shutdown выполняются по порядку: дренаж — до закрытия сессии бота в SimpleRequestHandler
+    app.on_shutdown.append(on_drain)
+    # Обработчик может вернуть вызов метода (return callback.answer(...)) — он уйдёт Telegram в теле ответа
+    # на вебхук, без отдельного HTTPS-запроса к Bot API. Для этого апдейт обрабатывается до ответа, а не в фоне
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=False).register(app, path=webhook_path)
     setup_application(app, dp, bot=bot)
     app.on_startup.append(on_startup)
     app.on_cleanup.append(on_shutdown)
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from types import MappingProxyType
+
+from database import fetch_products, listen_menu_changes
+from lifecycle import spawn
+
+logger = logging.getLogger(__name__)
+
+
+class MenuSnapshot:
+    # Неизменяемый снимок меню. Обработчики берут ссылку на текущий снимок и работают только с ней,
+    # поэтому перезагрузка меню посреди обработки апдейта ничего не ломает.
+    __slots__ = ("version", "categories", "by_id", "checksum")
+
+    def __init__(self, version: int, rows):
+        categories = {}
+        by_id = {}
+        for row in rows:
+            item = MappingProxyType({
+                "id": row["id"],
+                "category": row["category"],
+                "name": row["name"],
+                "description": row["description"] or "",
+                "price_small": row["price_small"],
+                "price_large": row["price_large"],
+                "image_url": row["image_url"] or "",
+            })
+            categories.setdefault(item["category"], []).append(item)
+            by_id[item["id"]] = item
+        self.version = version
+        self.categories = MappingProxyType({category: tuple(items) for category, items in categories.items()})
+        self.by_id = MappingProxyType(by_id)
+        self.checksum = hash(tuple(tuple(item.items()) for item in by_id.values()))
+
+    def get(self, product_id: int):
+        return self.by_id.get(product_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+
+_snapshot = MenuSnapshot(0, ())
+_reload_listeners = []
+_reload_lock = asyncio.Lock()
+_reload_pending = False
+_listener_conn = None
+_listener_stopping = False
+LISTENER_RETRY_MIN = 1.0  # секунд до первой попытки переподключить LISTEN
+LISTENER_RETRY_MAX = 60.0
+
+
+def current_menu() -> MenuSnapshot:
+    return _snapshot
+
+
+def on_menu_reload(callback):
+    # callback(snapshot) вызывается до подмены снимка — производные структуры меняются вместе с ним
+    _reload_listeners.append(callback)
+    return callback
+
+
+async def reload_menu() -> MenuSnapshot:
+    global _snapshot
+    async with _reload_lock:
+        rows = await fetch_products()
+        if rows is None:
+            logger.warning("⚠️ Меню не перезагружено, остаётся версия %s.", _snapshot.version)
+            return _snapshot
+        snapshot = MenuSnapshot(_snapshot.version + 1, rows)
+        if snapshot.checksum == _snapshot.checksum and _snapshot.version:
+            return _snapshot
+        for callback in _reload_listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error("❌ Ошибка обработчика перезагрузки меню: %s", e)
+        _snapshot = snapshot
+        logger.info("📋 Меню загружено: версия %s, товаров %s", snapshot.version, len(snapshot.by_id))
+        return snapshot
+
+
+async def _reload_from_notify():
+    global _reload_pending
+    await asyncio.sleep(0.5)  # пачка изменений (COPY + UPDATE + DELETE) — одна перезагрузка
+    _reload_pending = False
+    await reload_menu()
+
+
+def _on_menu_changed(connection, pid, channel, payload):
+    global _reload_pending
+    if _reload_pending:
+        return
+    _reload_pending = True
+    spawn(_reload_from_notify(), name="menu_reload")
+
+
+async def _connect_listener():
+    global _listener_conn
+    conn = await listen_menu_changes(_on_menu_changed)
+    conn.add_termination_listener(_on_listener_terminated)
+    _listener_conn = conn
+    logger.info("✅ Подписка на изменения меню (LISTEN menu_changed) активна.")
+
+
+def _on_listener_terminated(connection):
+    global _listener_conn
+    if _listener_stopping or connection is not _listener_conn:
+        return
+    _listener_conn = None
+    logger.warning("⚠️ Соединение LISTEN menu_changed потеряно, переподключаемся.")
+    spawn(_reconnect_listener(), name="menu_listener")
+
+
+async def _reconnect_listener():
+    # Пока соединения не было, уведомления терялись — после переподключения меню перечитывается целиком
+    delay = LISTENER_RETRY_MIN
+    while not _listener_stopping:
+        await asyncio.sleep(delay)
+        if _listener_stopping:
+            return
+        try:
+            await _connect_listener()
+        except Exception as e:
+            delay = min(delay * 2, LISTENER_RETRY_MAX)
+            logger.warning("⚠️ Переподключение LISTEN не удалось (%s), повтор через %.0f с", e, delay)
+            continue
+        if _listener_stopping:
+            await stop_menu_listener()
+            return
+        await reload_menu()
+        return
+
+
+async def start_menu_listener():
+    global _listener_stopping
+    _listener_stopping = False
+    try:
+        await _connect_listener()
+    except Exception as e:
+        logger.error("❌ Не удалось подписаться на изменения меню: %s", e)
+        spawn(_reconnect_listener(), name="menu_listener")
+
+
+async def stop_menu_listener():
+    global _listener_conn, _listener_stopping
+    _listener_stopping = True
+    conn, _listener_conn = _listener_conn, None
+    if conn is not None:
+        conn.remove_termination_listener(_on_listener_terminated)
+        await conn.close()
@@ -0,0 +1,118 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 50  # больше Telegram в одном ответе на inline-запрос не принимает
+MAX_CACHED_QUERIES = 2000
+MIN_TRIGRAM_SIMILARITY = 0.4
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> list:
+    # casefold корректно приводит кириллицу, "ё" считаем за "е": "Четыре сыра" == "четыре сыра" == "ЧЕТЫРЕ СЫРА"
+    return _WORD_RE.findall((text or "").casefold().replace("ё", "е"))
+
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MenuSearchIndex:
+    # Индекс по названиям и описаниям товаров. Строится один раз; результаты для всех префиксов слов
+    # меню считаются заранее, остальные запросы кэшируются по мере поступления.
+    def __init__(self, products, result_factory):
+        # products: итерируемое (product_id, item); result_factory(product_id, item) -> InlineQueryResult
+        self._results = {}
+        self._order = []
+        self._name_tokens = {}
+        self._desc_tokens = {}
+        self._name_prefix = {}
+        self._desc_prefix = {}
+        self._trigrams = {}
+        self._token_trigrams = {}
+
+        for product_id, item in products:
+            self._results[product_id] = result_factory(product_id, item)
+            self._order.append(product_id)
+            name_tokens = set(normalize(item.get("name", "")))
+            desc_tokens = set(normalize(item.get("description", ""))) - name_tokens
+            self._name_tokens[product_id] = name_tokens
+            self._desc_tokens[product_id] = desc_tokens
+            for token in name_tokens:
+                self._add_prefixes(self._name_prefix, token, product_id)
+            for token in desc_tokens:
+                self._add_prefixes(self._desc_prefix, token, product_id)
+            for token in name_tokens | desc_tokens:
+                if token not in self._token_trigrams:
+                    self._token_trigrams[token] = trigrams(token)
+                for gram in self._token_trigrams[token]:
+                    self._trigrams.setdefault(gram, set()).add(product_id)
+
+        self._all = tuple(self._results[pid] for pid in self._order[:MAX_RESULTS])
+        self._cache = {}
+        for prefix in set(self._name_prefix) | set(self._desc_prefix):
+            self._cache[prefix] = self._rank([prefix])
+        self._precomputed = len(self._cache)
+        logger.info("🔎 Индекс поиска по меню: %s товаров, %s префиксов", len(self._order), self._precomputed)
+
+    @staticmethod
+    def _add_prefixes(index: dict, token: str, product_id: str):
+        for i in range(1, len(token) + 1):
+            index.setdefault(token[:i], set()).add(product_id)
+
+    def _score_token(self, query_token: str) -> dict:
+        scores = {}
+        for product_id in self._name_prefix.get(query_token, ()):
+            exact = query_token in self._name_tokens[product_id]
+            scores[product_id] = 15 if exact else 10
+        for product_id in self._desc_prefix.get(query_token, ()):
+            scores.setdefault(product_id, 4)
+        if len(query_token) < 3:
+            return scores
+
+        # Нечёткое совпадение по триграммам — для опечаток ("маргарта", "пеперони")
+        query_grams = trigrams(query_token)
+        candidates = set()
+        for gram in query_grams:
+            candidates |= self._trigrams.get(gram, set())
+        for product_id in candidates - scores.keys():
+            best = 0.0
+            for weight, tokens in ((6, self._name_tokens[product_id]), (2, self._desc_tokens[product_id])):
+                for token in tokens:
+                    grams = self._token_trigrams[token]
+                    similarity = len(query_grams & grams) / len(query_grams | grams)
+                    if similarity >= MIN_TRIGRAM_SIMILARITY:
+                        best = max(best, weight * similarity)
+            if best:
+                scores[product_id] = best
+        return scores
+
+    def _rank(self, query_tokens: list) -> tuple:
+        total = None
+        for query_token in query_tokens:
+            scores = self._score_token(query_token)
+            if total is None:
+                total = scores
+            else:
+                # Все слова запроса должны совпасть
+                total = {pid: total[pid] + score for pid, score in scores.items() if pid in total}
+            if not total:
+                return ()
+        position = {pid: i for i, pid in enumerate(self._order)}
+        ranked = sorted(total, key=lambda pid: (-total[pid], position[pid]))
+        return tuple(self._results[pid] for pid in ranked[:MAX_RESULTS])
+
+    def search(self, query: str) -> tuple:
+        tokens = normalize(query)
+        if not tokens:
+            return self._all
+        key = " ".join(tokens)
+        results = self._cache.get(key)
+        if results is None:
+            results = self._rank(tokens)
+            if len(self._cache) < self._precomputed + MAX_CACHED_QUERIES:
+                self._cache[key] = results
+        return results
@@ -0,0 +1,276 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from config import ORDER_JOURNAL_PATH, ORDER_DB_TIMEOUT
+from database import save_order, CONNECTION_ERRORS
+from fast_runtime import json_dumps, json_loads
+from lifecycle import spawn
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3  # ошибок БД подряд, после которых заказы сразу идут в журнал
+RESET_TIMEOUT = 15.0  # секунд до пробного обращения к БД
+REPLAY_INTERVAL = 5.0  # секунд между попытками дописать журнал
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # closed → (FAILURE_THRESHOLD ошибок подряд) → open: вызовы сразу отклоняются, клиент не ждёт таймаута БД →
+    # (RESET_TIMEOUT) → half-open: один пробный вызов; успех закрывает, ошибка снова открывает.
+    # Считаются только ошибки failure_types (и таймаут): прочие значат, что сервис ответил, но отверг сам вызов
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT,
+                 call_timeout: float = ORDER_DB_TIMEOUT, failure_types: tuple = (Exception,)):
+        self.name = name
+        self.failure_types = failure_types + (asyncio.TimeoutError,)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.call_timeout = call_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+            return False
+        self._trial = True
+        return True
+
+    async def call(self, coro):
+        if not self.allow():
+            coro.close()
+            raise CircuitOpenError(self.name)
+        try:
+            result = await asyncio.wait_for(coro, self.call_timeout)
+        except asyncio.CancelledError:
+            self._trial = False
+            raise
+        except self.failure_types:
+            self._on_failure()
+            raise
+        except Exception:
+            self._on_success()
+            raise
+        self._on_success()
+        return result
+
+    def _on_failure(self):
+        self._failures += 1
+        self._trial = False
+        if self._opened_at is None and self._failures < self.failure_threshold:
+            return
+        if self._opened_at is None:
+            logger.warning("⚠️ %s: %s ошибок подряд — переходим в аварийный режим", self.name, self._failures)
+        self._opened_at = time.monotonic()
+
+    def _on_success(self):
+        if self._opened_at is not None:
+            logger.info("✅ %s: база снова отвечает — аварийный режим снят", self.name)
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+
+class OrderJournal:
+    # Журнал упреждающей записи: одна строка JSON на заказ, fsync до ответа клиенту.
+    # Для повтора файл атомарно переименовывается в .replaying — новые заказы тем временем пишутся в свежий файл.
+    # Записи, которые база отвергает по содержимому, откладываются в .dead для ручного разбора
+    def __init__(self, path: str):
+        self.path = path
+        self.replaying_path = path + ".replaying"
+        self.dead_path = path + ".dead"
+        self._lock = asyncio.Lock()
+
+    def has_pending(self) -> bool:
+        return os.path.exists(self.path) or os.path.exists(self.replaying_path)
+
+    async def append(self, record: dict):
+        line = json_dumps(record) + "\n"
+        async with self._lock:
+            await asyncio.to_thread(self._write, self.path, line)
+
+    async def bury(self, record: dict, error: str):
+        await asyncio.to_thread(self._write, self.dead_path, json_dumps({**record, "error": error}) + "\n")
+
+    def _write(self, path: str, line: str):
+        created = not os.path.exists(path)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        if created:
+            self._fsync_dir()
+
+    def _fsync_dir(self):
+        # Новое имя файла тоже должно пережить сбой питания
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    async def take(self) -> list:
+        # Записи к повтору: сначала недописанный с прошлого раза .replaying, затем текущий журнал
+        async with self._lock:
+            if not os.path.exists(self.replaying_path) and os.path.exists(self.path):
+                os.replace(self.path, self.replaying_path)
+                await asyncio.to_thread(self._fsync_dir)
+        if not os.path.exists(self.replaying_path):
+            return None
+        return await asyncio.to_thread(self._read, self.replaying_path)
+
+    @staticmethod
+    def _read(path: str) -> list:
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    records.append(json_loads(line))
+                except ValueError:
+                    # Оборванная последняя строка — запись не завершилась, клиенту номер не выдавался
+                    logger.error("❌ Повреждённая строка %s в журнале заказов %s пропущена", number, path)
+        return records
+
+    async def keep(self, records: list):
+        # Повтор прервался: оставляем только недописанные записи, чтобы не уведомлять клиентов повторно
+        tmp_path = self.replaying_path + ".tmp"
+        await asyncio.to_thread(self._rewrite, tmp_path, "".join(json_dumps(record) + "\n" for record in records))
+
+    def _rewrite(self, tmp_path: str, content: str):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.replaying_path)
+        self._fsync_dir()
+
+    async def done(self):
+        os.remove(self.replaying_path)
+        await asyncio.to_thread(self._fsync_dir)
+
+
+db_breaker = CircuitBreaker("Заказы в БД", failure_types=CONNECTION_ERRORS)
+journal = OrderJournal(ORDER_JOURNAL_PATH)
+_replay_listeners = []
+_replay_wakeup = asyncio.Event()
+
+
+def provisional_id(journal_id: str) -> str:
+    # Временный номер для клиента и кухни, пока заказ не записан в БД
+    return "В-" + journal_id[:6].upper()
+
+
+def on_order_replayed(callback):
+    # callback(record, order_id) — заказ из журнала получил постоянный номер
+    _replay_listeners.append(callback)
+    return callback
+
+
+async def _save(record: dict) -> int:
+    return await save_order(
+        record["user_id"], record["items"], record["total"], record["address"], record["payment_method"],
+        record["phone"], journal_id=record["journal_id"], created_at=datetime.fromisoformat(record["created_at"])
+    )
+
+
+async def place_order(user_id: int, items: list, total: int, address: str, payment_method: int, phone: str):
+    # Возвращает (номер заказа в БД, None) или, если БД недоступна, (None, временный номер из журнала).
+    # (None, None) — заказ не сохранён нигде
+    record = {
+        "journal_id": uuid.uuid4().hex,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "user_id": user_id,
+        "items": items,
+        "total": total,
+        "address": address,
+        "payment_method": payment_method,
+        "phone": phone,
+    }
+    try:
+        return await db_breaker.call(_save(record)), None
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        # В том числе таймаут: если вставка всё же прошла, повтор из журнала найдёт её по journal_id
+        logger.error("❌ Ошибка сохранения заказа в БД: %s %s", type(e).__name__, e)
+
+    try:
+        await journal.append(record)
+    except Exception as e:
+        logger.critical("❌ Заказ не сохранён ни в БД, ни в журнал: %s", e)
+        return None, None
+    _replay_wakeup.set()
+    provisional = provisional_id(record["journal_id"])
+    logger.warning("📒 Заказ %s пользователя %s записан в журнал", provisional, user_id)
+    return None, provisional
+
+
+async def replay_journal() -> int:
+    # Дописывает журнал в orders по порядку. При ошибке связи с БД останавливается, непройденные записи остаются
+    # до следующей попытки; запись, которую база отвергла по содержимому, уходит в .dead, повтор идёт дальше
+    records = await journal.take()
+    if records is None:
+        return 0
+    processed = replayed = 0
+    for record in records:
+        try:
+            order_id = await db_breaker.call(_save(record))
+        except (CircuitOpenError, *CONNECTION_ERRORS):
+            if processed:
+                await journal.keep(records[processed:])
+            raise
+        except asyncio.CancelledError:
+            # Остановка бота: сохраняем остаток журнала, уже записанные заказы повторно не уйдут
+            if processed:
+                await journal.keep(records[processed:])
+            raise
+        except Exception as e:
+            await journal.bury(record, f"{type(e).__name__}: {e}")
+            processed += 1
+            logger.error("❌ Заказ %s из журнала отвергнут базой и отложен в %s: %s %s",
+                         provisional_id(record.get("journal_id", "")), journal.dead_path, type(e).__name__, e)
+            continue
+        processed += 1
+        replayed += 1
+        for callback in _replay_listeners:
+            try:
+                await callback(record, order_id)
+            except Exception as e:
+                logger.error("❌ Ошибка обработчика записанного заказа %s: %s", order_id, e)
+    await journal.done()
+    if replayed:
+        logger.info("📒 Из журнала записано заказов: %s", replayed)
+    return replayed
+
+
+async def _replay_loop():
+    while True:
+        # Пока предохранитель открыт, повтор сразу получает CircuitOpenError; первая запись после RESET_TIMEOUT — пробный вызов
+        if journal.has_pending():
+            try:
+                await replay_journal()
+            except CircuitOpenError:
+                pass
+            except Exception as e:
+                logger.warning("⚠️ Журнал заказов пока не записан в БД: %s", e)
+        try:
+            await asyncio.wait_for(_replay_wakeup.wait(), REPLAY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _replay_wakeup.clear()
+
+
+def start_journal_replayer():
+    spawn(_replay_loop(), name="order_journal")
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+BATCH_LIMIT = 100  # максимум, который отдаёт getUpdates
+POLL_TIMEOUT = 50  # секунд long polling; Telegram держит запрос, пока не появятся апдейты
+MAX_BACKOFF = 30.0
+
+
+def _update_user_id(update: Update):
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else None
+
+
+class UpdatePoller:
+    # getUpdates пачками с параллельной обработкой: апдейты разных пользователей идут одновременно,
+    # апдейты одного пользователя — строго по порядку (иначе корзина и шаги оформления заказа перемешаются)
+    def __init__(self, bot: Bot, dp: Dispatcher, concurrency: int = 64):
+        self.bot = bot
+        self.dp = dp
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queues = {}
+        self._workers = set()
+        self._stopping = asyncio.Event()
+        self._offset = None
+        self._pending_ids = set()  # получены, но ещё не обработаны (в очереди или в работе)
+
+    def stop(self):
+        self._stopping.set()
+
+    def _submit(self, update: Update):
+        self._pending_ids.add(update.update_id)
+        user_id = _update_user_id(update)
+        if user_id is None:
+            self._spawn(self._process(update))
+            return
+        pending = self._queues.get(user_id)
+        if pending is not None:
+            pending.append(update)
+            return
+        self._queues[user_id] = deque((update,))
+        self._spawn(self._user_worker(user_id))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    async def _user_worker(self, user_id: int):
+        pending = self._queues[user_id]
+        try:
+            while pending:
+                await self._process(pending.popleft())
+        finally:
+            del self._queues[user_id]
+
+    async def _process(self, update: Update):
+        async with self._slots:
+            try:
+                result = await self.dp.feed_update(self.bot, update)
+                # Ответ, который в режиме вебхука ушёл бы в теле HTTP-ответа, здесь отправляем сами
+                if isinstance(result, TelegramMethod):
+                    await self.dp.silent_call_request(self.bot, result)
+            except Exception as e:
+                logger.error("❌ Ошибка обработки апдейта %s: %s", update.update_id, e)
+            finally:
+                self._pending_ids.discard(update.update_id)
+
+    async def run(self):
+        # Вебхук и getUpdates взаимоисключающие: удаляем вебхук, не сбрасывая накопившиеся апдейты
+        await self.bot.delete_webhook(drop_pending_updates=False)
+        allowed_updates = self.dp.resolve_used_update_types()
+        logger.info("📡 Long polling запущен (апдейты: %s)", ", ".join(allowed_updates))
+
+        offset = None
+        backoff = 1.0
+        while not self._stopping.is_set():
+            fetch = asyncio.ensure_future(self.bot.get_updates(
+                offset=offset, limit=BATCH_LIMIT, timeout=POLL_TIMEOUT,
+                allowed_updates=allowed_updates, request_timeout=POLL_TIMEOUT + 10
+            ))
+            stopping = asyncio.ensure_future(self._stopping.wait())
+            await asyncio.wait((fetch, stopping), return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not fetch.done():
+                # Остановка: незавершённый запрос отменяем — offset не подтверждён, апдейты получит следующий запуск
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                # Сеть, 5xx Telegram, TelegramConflictError (параллельно опрашивает другой экземпляр)
+                logger.warning("⚠️ getUpdates: %s — повтор через %.0f с", e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            backoff = 1.0
+            for update in updates:
+                offset = update.update_id + 1
+                self._submit(update)
+
+        self._offset = offset
+        logger.info("📡 Long polling остановлен, в обработке пользователей: %s", len(self._workers))
+
+    async def _wait_idle(self):
+        while self._workers:
+            await asyncio.wait(set(self._workers))
+
+    async def drain(self, timeout: float) -> bool:
+        # Дожидаемся уже полученных апдейтов, затем подтверждаем offset, чтобы после перезапуска
+        # Telegram не прислал их повторно
+        idle = True
+        offset = self._offset
+        try:
+            await asyncio.wait_for(self._wait_idle(), timeout)
+        except asyncio.TimeoutError:
+            idle = False
+            logger.warning("⚠️ За %s с не обработаны апдейты %s пользователей", timeout, len(self._queues))
+        if self._pending_ids:
+            # Подтверждаем только то, что раньше самого старого необработанного: он и всё после него
+            # придут снова при следующем запуске (уже обработанные из них — повторно, но не потеряются)
+            offset = min(self._pending_ids)
+            logger.warning("⚠️ Необработанные апдейты (%s) будут доставлены повторно, начиная с %s",
+                           len(self._pending_ids), offset)
+        if offset is not None:
+            try:
+                await self.bot.get_updates(offset=offset, limit=1, timeout=0)
+            except Exception as e:
+                logger.warning("⚠️ Не удалось подтвердить полученные апдейты: %s", e)
+        return idle
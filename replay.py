@@ -0,0 +1,141 @@
+# Воспроизведение записанных апдейтов (RECORD_UPDATES, см. traffic.py) через dp.feed_update.
+# Bot API заменён заглушкой, база — настоящая: укажите DATABASE_URL тестовой базы, не рабочей!
+#
+#   python replay.py updates.jsonl.2 updates.jsonl.1 updates.jsonl --speed 1
+#   python replay.py updates.jsonl --speed 0 --api-latency 0.08
+#
+# --speed 1 — в исходном темпе, 10 — в десять раз быстрее, 0 — без пауз между апдейтами.
+import os
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from collections import Counter
+from http import HTTPStatus
+from itertools import chain
+from typing import get_args
+
+os.environ.setdefault("BOT_TOKEN", "123456:replay")
+os.environ.setdefault("ADMIN_USER_ID", "1")
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message, Update
+
+import main
+from database import init_db, close_pool
+from fast_runtime import json_dumps, install_event_loop
+from menu import reload_menu
+from traffic import read_recording
+
+logger = logging.getLogger("replay")
+
+
+class StubSession(BaseSession):
+    # Заглушка Bot API: отвечает успехом с задержкой api_latency и считает вызовы по методам
+    def __init__(self, api_latency: float = 0.0):
+        super().__init__()
+        self.api_latency = api_latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    def _payload(self, method):
+        returning = method.__returning__
+        if returning is not Message and Message not in get_args(returning):
+            return True
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None)
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id if isinstance(chat_id, int) else 0, "type": "private"},
+            "text": getattr(method, "text", None),
+        }
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        content = json_dumps({"ok": True, "result": self._payload(method)})
+        try:
+            return self.check_response(bot, method, HTTPStatus.OK, content).result
+        except Exception:
+            # Методы с редкими типами результата (списки, файлы) — результат обработчикам не нужен
+            return None
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def _percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def replay(paths: list, speed: float, api_latency: float) -> int:
+    entries = list(chain.from_iterable(read_recording(path) for path in paths))
+    if not entries:
+        print("Нет апдейтов для воспроизведения")
+        return 1
+
+    await init_db()
+    await reload_menu()
+    stub = StubSession(api_latency)
+    main.bot.session = stub
+
+    latencies = []
+    errors = Counter()
+
+    async def feed(raw: dict):
+        started = time.perf_counter()
+        try:
+            update = Update.model_validate(raw, context={"bot": main.bot})
+            result = await main.dp.feed_update(main.bot, update)
+            if isinstance(result, TelegramMethod):
+                # В проде этот вызов уходит в теле ответа на вебхук — считаем его отдельно
+                stub.calls["webhook_reply:" + type(result).__name__] += 1
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - started)
+
+    loop = asyncio.get_running_loop()
+    first_ts = entries[0][0]
+    started = loop.time()
+    tasks = []
+    # Апдейты запускаются параллельно в момент их исходного поступления — как при фоновой обработке вебхука
+    for ts, raw in entries:
+        if speed > 0:
+            delay = (ts - first_ts) / speed - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(raw)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - started
+    await close_pool()
+
+    print(f"Апдейтов: {len(entries)} за {elapsed:.1f} с ({len(entries) / elapsed:.1f} в секунду)")
+    print(
+        "Обработка, мс: p50 {:.1f} · p95 {:.1f} · p99 {:.1f} · max {:.1f}".format(
+            *(_percentile(latencies, share) * 1000 for share in (0.5, 0.95, 0.99, 1.0))
+        )
+    )
+    print("Вызовы Bot API: " + ", ".join(f"{name} {count}" for name, count in stub.calls.most_common()))
+    if errors:
+        print("Ошибки: " + ", ".join(f"{name} {count}" for name, count in errors.most_common()))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов против заглушки Bot API")
+    parser.add_argument("paths", nargs="+", help="файлы записи в хронологическом порядке (сначала старые .N)")
+    parser.add_argument("--speed", type=float, default=1.0, help="множитель скорости, 0 — без пауз")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка ответа заглушки Bot API, с")
+    args = parser.parse_args()
+    install_event_loop()
+    sys.exit(asyncio.run(replay(args.paths, args.speed, args.api_latency)))
@@ -0,0 +1,84 @@
+import time
+import random
+import asyncio
+import logging
+
+from database import job_lock, get_job_elapsed, record_job_start, record_job_result
+from lifecycle import spawn
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 60.0  # секунд до повторной попытки, если БД недоступна
+
+
+class Job:
+    __slots__ = ("name", "interval", "jitter", "func")
+
+    def __init__(self, name: str, interval: float, jitter: float, func):
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.func = func
+
+
+_jobs = {}
+
+
+def register_job(name: str, interval: float, jitter: float = 0.1):
+    # Декоратор: @register_job("cleanup_old_orders", interval=3600).
+    # jitter — доля интервала, на которую случайно сдвигается запуск, чтобы реплики не стучались в БД одновременно
+    def decorator(func):
+        if name in _jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        _jobs[name] = Job(name, interval, jitter, func)
+        return func
+    return decorator
+
+
+async def _next_delay(job: Job) -> float:
+    # Отсчёт от последнего запуска в БД: перезапуск процесса не сбрасывает таймер
+    elapsed = await get_job_elapsed(job.name)
+    delay = 0.0 if elapsed is None else max(0.0, job.interval - elapsed)
+    return delay + random.uniform(0, job.interval * job.jitter)
+
+
+async def run_job_once(job: Job) -> str:
+    async with job_lock(job.name) as acquired:
+        if not acquired:
+            return "locked"
+        # Пока ждали, задачу могла выполнить другая реплика
+        elapsed = await get_job_elapsed(job.name)
+        if elapsed is not None and elapsed < job.interval:
+            return "skipped"
+
+        await record_job_start(job.name)
+        started = time.monotonic()
+        status, error = "ok", None
+        try:
+            result = await job.func()
+        except Exception as e:
+            status, error = "error", repr(e)
+            logger.error("❌ Задача %s завершилась ошибкой: %s", job.name, e)
+        duration_ms = int((time.monotonic() - started) * 1000)
+        await record_job_result(job.name, duration_ms, status, error)
+        if status == "ok":
+            logger.info("⏱ Задача %s выполнена за %s мс (результат: %s)", job.name, duration_ms, result)
+        return status
+
+
+async def _job_loop(job: Job):
+    while True:
+        try:
+            await asyncio.sleep(await _next_delay(job))
+            await run_job_once(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ Планировщик: задача %s не запущена: %s", job.name, e)
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def start_scheduler():
+    for job in _jobs.values():
+        spawn(_job_loop(job), name=f"job:{job.name}")
+    logger.info("⏱ Планировщик запущен: %s", ", ".join(_jobs) or "нет задач")
@@ -0,0 +1,206 @@
+import sys
+import time
+import asyncio
+import logging
+from itertools import islice
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+STATS_SAMPLE = 32  # записей на оценку памяти хранилища
+STATS_LOG_INTERVAL = 600.0  # секунд между записями статистики в лог на уровне INFO
+
+
+def _approx_size(obj, seen=None) -> int:
+    # Грубая оценка занимаемой памяти: sys.getsizeof с обходом вложенных контейнеров
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += _approx_size(k, seen) + _approx_size(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += _approx_size(v, seen)
+    return size
+
+
+class TimerWheel:
+    # Одно колесо таймеров на все хранилища: каждый тик просматривается только один слот,
+    # а не все ключи всех словарей.
+    def __init__(self, tick: float = 30.0, size: int = 256):
+        self.tick = tick
+        self.size = size
+        self._slots = [set() for _ in range(size)]
+        self._cursor = self._tick_no(time.monotonic())
+        self._stores = []
+        self._stats_logged_at = 0.0
+
+    def _tick_no(self, deadline: float) -> int:
+        return int(deadline // self.tick)
+
+    def register(self, store):
+        self._stores.append(store)
+
+    def schedule(self, store, key, deadline: float) -> int:
+        # Срок дальше одного оборота колеса — запись просто проверится на каждом обороте заново
+        tick_no = max(self._tick_no(deadline), self._cursor)
+        slot = tick_no % self.size
+        self._slots[slot].add((store, key))
+        return slot
+
+    def cancel(self, store, key, slot: int):
+        self._slots[slot].discard((store, key))
+
+    def advance(self, now: float) -> int:
+        evicted = 0
+        target = self._tick_no(now)
+        while self._cursor <= target:
+            slot = self._cursor % self.size
+            entries = self._slots[slot]
+            self._slots[slot] = set()
+            self._cursor += 1
+            for store, key in entries:
+                if store._expire(key, now):
+                    evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        return {store.name: store.stats() for store in self._stores}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                now = time.monotonic()
+                evicted = self.advance(now)
+                if not evicted:
+                    continue
+                # Статистика — только по выборке записей и не чаще раза в STATS_LOG_INTERVAL (или в DEBUG)
+                if logger.isEnabledFor(logging.DEBUG) or now - self._stats_logged_at >= STATS_LOG_INTERVAL:
+                    self._stats_logged_at = now
+                    logger.info("🧹 Вытеснено неактивных сессий: %s. Состояние: %s", evicted, self.stats())
+                else:
+                    logger.info("🧹 Вытеснено неактивных сессий: %s", evicted)
+            except Exception as e:
+                logger.error("❌ Ошибка при очистке сессий: %s", e)
+
+
+class TTLStore(MutableMapping):
+    # Словарь пользовательских сессий с TTL, ограничением размера и LRU-вытеснением.
+    # Закреплённые (pin) ключи не вытесняются, пока идёт оформление заказа.
+    __hash__ = object.__hash__  # экземпляр лежит в слотах колеса таймеров
+
+    def __init__(self, wheel: TimerWheel, name: str, ttl: float, max_entries: int):
+        self.wheel = wheel
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._deadlines = {}
+        self._slots = {}
+        self._pinned = {}
+        wheel.register(self)
+
+    def _touch(self, key, now: float = None):
+        now = time.monotonic() if now is None else now
+        deadline = now + self.ttl
+        old_slot = self._slots.get(key)
+        if old_slot is not None:
+            self.wheel.cancel(self, key, old_slot)
+        self._deadlines[key] = deadline
+        self._slots[key] = self.wheel.schedule(self, key, deadline)
+        self._data.move_to_end(key)
+
+    def _drop(self, key):
+        self._data.pop(key, None)
+        self._deadlines.pop(key, None)
+        self._pinned.pop(key, None)
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self.wheel.cancel(self, key, slot)
+
+    def _is_pinned(self, key, now: float) -> bool:
+        until = self._pinned.get(key)
+        if until is None:
+            return False
+        if until <= now:
+            del self._pinned[key]
+            return False
+        return True
+
+    def _expire(self, key, now: float) -> bool:
+        # Вызывается колесом таймеров; возвращает True, если ключ удалён
+        if self._slots.get(key) is None:
+            return False
+        deadline = self._deadlines[key]
+        if self._is_pinned(key, now):
+            deadline = max(deadline, self._pinned[key])
+        if deadline > now:
+            self._deadlines[key] = deadline
+            self._slots[key] = self.wheel.schedule(self, key, deadline)
+            return False
+        self._drop(key)
+        return True
+
+    def _evict_overflow(self, now: float):
+        if len(self._data) <= self.max_entries:
+            return
+        # Самые давние по обращению — в начале OrderedDict
+        for key in list(self._data):
+            if len(self._data) <= self.max_entries:
+                break
+            if self._is_pinned(key, now):
+                continue
+            self._drop(key)
+            logger.debug("🧹 %s: вытеснена сессия %s (превышен лимит %s)", self.name, key, self.max_entries)
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        self._touch(key)
+        return value
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        self._data[key] = value
+        self._touch(key, now)
+        self._evict_overflow(now)
+
+    def __delitem__(self, key):
+        if key not in self._data:
+            raise KeyError(key)
+        self._drop(key)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def pin(self, key, hold: float = 3600):
+        # Защищает запись от вытеснения на время оформления заказа (но не дольше hold секунд)
+        if key in self._data:
+            self._pinned[key] = time.monotonic() + hold
+            self._touch(key)
+
+    def unpin(self, key):
+        self._pinned.pop(key, None)
+
+    def stats(self) -> dict:
+        # Память оценивается по первым STATS_SAMPLE записям и экстраполируется: полный обход
+        # десятков тысяч корзин блокировал бы цикл событий
+        entries = len(self._data)
+        sample = list(islice(self._data.items(), STATS_SAMPLE))
+        sample_bytes = sum(_approx_size(key) + _approx_size(value) for key, value in sample)
+        return {
+            "entries": entries,
+            "pinned": len(self._pinned),
+            "approx_bytes": sample_bytes * entries // len(sample) if sample else 0,
+        }
@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("ADMIN_USER_ID", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
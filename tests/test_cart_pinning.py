@@ -0,0 +1,80 @@
+import asyncio
+
+from aiogram.types import Update
+
+import main
+from session_store import TimerWheel, TTLStore
+
+USER_ID = 454545
+CHAT = {"id": USER_ID, "type": "private"}
+FROM = {"id": USER_ID, "is_bot": False, "first_name": "Test"}
+
+
+def _callback(update_id, data):
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data, "from": FROM,
+            "message": {"message_id": 1, "date": 0, "chat": CHAT, "text": "Корзина"},
+        },
+    }, context={"bot": main.bot})
+
+
+def _message(update_id, text):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": CHAT, "from": FROM, "text": text},
+    }, context={"bot": main.bot})
+
+
+def _setup(monkeypatch):
+    async def fake_request(bot, method, timeout=None):
+        return True
+
+    async def fake_place_order(**kwargs):
+        return 601, None
+
+    monkeypatch.setattr(main.bot.session, "make_request", fake_request)
+    monkeypatch.setattr(main, "place_order", fake_place_order)
+    main.user_carts[USER_ID] = {"7_l": {"name": "Маргарита (Большая)", "price_per_unit": 700, "quantity": 1}}
+
+
+def test_abandoned_checkout_unpins_cart(monkeypatch):
+    _setup(monkeypatch)
+
+    async def run():
+        await main.dp.feed_update(main.bot, _callback(11, "checkout"))
+        pinned = USER_ID in main.user_carts._pinned
+        await main.dp.feed_update(main.bot, _message(12, "/start"))
+        return pinned
+
+    assert asyncio.run(run())
+    assert USER_ID not in main.user_carts._pinned
+    assert USER_ID in main.user_carts
+
+
+def test_completed_checkout_unpins_cart(monkeypatch):
+    _setup(monkeypatch)
+
+    async def run():
+        await main.dp.feed_update(main.bot, _callback(21, "checkout"))
+        await main.dp.feed_update(main.bot, _message(22, "ул. Ленина, 1"))
+        await main.dp.feed_update(main.bot, _message(23, "+79991234567"))
+        await main.dp.feed_update(main.bot, _callback(24, "pay_online"))
+        return await main.dp.fsm.get_context(main.bot, USER_ID, USER_ID).get_state()
+
+    assert asyncio.run(run()) == main.OrderFlow.waiting_for_receipt.state
+    assert USER_ID not in main.user_carts._pinned
+    assert USER_ID in main.user_carts  # онлайн-оплата: корзина ждёт чека, но уже не закреплена
+
+
+def test_unpinned_key_is_evicted_again():
+    store = TTLStore(TimerWheel(), "test", ttl=3600, max_entries=2)
+    store["a"] = 1
+    store.pin("a")
+    store["b"] = 2
+    store["c"] = 3
+    assert "a" in store and "b" not in store
+    store.unpin("a")
+    store["d"] = 4
+    assert "a" not in store
@@ -0,0 +1,30 @@
+import re
+from datetime import datetime, timezone
+
+from database import Order
+from fast_runtime import json_dumps
+from kitchen_board import MESSAGE_LIMIT, render_pages
+
+# Всё, что может встретиться в тексте доски: теги разметки и целые HTML-сущности
+_MARKUP = re.compile(r"</?b>|&(?:amp|lt|gt|quot|#x27);")
+
+
+def _order(order_id, address, items):
+    return Order({
+        "id": order_id, "items": json_dumps(items), "total": 999, "address": address, "phone": 79991234567,
+        "payment_method": 2, "status": "new", "created_at": datetime(2026, 1, 1, 12, tzinfo=timezone.utc),
+    })
+
+
+def test_oversized_order_is_shortened_without_breaking_markup():
+    items = [{"name": f"Пицца «A&B» <{i}>", "quantity": 1} for i in range(400)]
+    orders = [_order(1, "ул. Ленина & Ко <корп. 2> " * 50, items), _order(2, "ул. Мира, 5", items[:2])]
+
+    pages = render_pages(orders)
+
+    for page in pages:
+        assert len(page) <= MESSAGE_LIMIT
+        assert "<" not in _MARKUP.sub("", page) and "&" not in _MARKUP.sub("", page)
+        assert page.count("<b>") == page.count("</b>")
+    assert "… ещё" in pages[0]
+    assert "<b>#2</b>" in pages[-1]
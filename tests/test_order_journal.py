@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import asyncpg
+
+import order_journal
+from order_journal import CircuitBreaker, OrderJournal
+
+
+def _record(journal_id, total=500):
+    return {
+        "journal_id": journal_id, "created_at": "2026-01-01T12:00:00+00:00", "user_id": 1, "items": [],
+        "total": total, "address": "ул. Ленина, 1", "payment_method": 2, "phone": "+79991234567",
+    }
+
+
+def _setup(monkeypatch, tmp_path, records, save):
+    journal = OrderJournal(str(tmp_path / "order_journal.jsonl"))
+    breaker = CircuitBreaker("test", failure_threshold=1, failure_types=order_journal.CONNECTION_ERRORS)
+    monkeypatch.setattr(order_journal, "journal", journal)
+    monkeypatch.setattr(order_journal, "db_breaker", breaker)
+    monkeypatch.setattr(order_journal, "_replay_listeners", [])
+    monkeypatch.setattr(order_journal, "_save", save)
+    for record in records:
+        asyncio.run(journal.append(record))
+    return journal, breaker
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_rejected_record_goes_to_dead_file_and_replay_continues(monkeypatch, tmp_path):
+    saved = []
+
+    async def save(record):
+        if record["total"] < 0:
+            raise asyncpg.CheckViolationError("orders_total_check")
+        saved.append(record["journal_id"])
+        return len(saved)
+
+    journal, breaker = _setup(monkeypatch, tmp_path, [_record("a"), _record("b", total=-1), _record("c")], save)
+
+    assert asyncio.run(order_journal.replay_journal()) == 2
+    assert saved == ["a", "c"]
+    assert not journal.has_pending()
+    dead = _lines(journal.dead_path)
+    assert [record["journal_id"] for record in dead] == ["b"]
+    assert dead[0]["error"].startswith("CheckViolationError")
+    # Отвергнутая запись — не признак недоступной БД: живые заказы по-прежнему пишутся в базу
+    assert not breaker.is_open
+
+
+def test_connection_error_keeps_remaining_records(monkeypatch, tmp_path):
+    saved = []
+
+    async def save(record):
+        if record["journal_id"] == "b":
+            raise ConnectionRefusedError("db down")
+        saved.append(record["journal_id"])
+        return len(saved)
+
+    journal, breaker = _setup(monkeypatch, tmp_path, [_record("a"), _record("b"), _record("c")], save)
+
+    try:
+        asyncio.run(order_journal.replay_journal())
+    except ConnectionRefusedError:
+        pass
+    else:
+        raise AssertionError("ошибка связи должна остановить повтор")
+    assert saved == ["a"]
+    assert breaker.is_open
+    assert [record["journal_id"] for record in _lines(journal.replaying_path)] == ["b", "c"]
+
+
+def test_cancelled_replay_keeps_remaining_records(monkeypatch, tmp_path):
+    saved = []
+
+    async def save(record):
+        if record["journal_id"] == "b":
+            raise asyncio.CancelledError()
+        saved.append(record["journal_id"])
+        return len(saved)
+
+    journal, _ = _setup(monkeypatch, tmp_path, [_record("a"), _record("b"), _record("c")], save)
+
+    try:
+        asyncio.run(order_journal.replay_journal())
+    except asyncio.CancelledError:
+        pass
+    assert saved == ["a"]
+    assert [record["journal_id"] for record in _lines(journal.replaying_path)] == ["b", "c"]
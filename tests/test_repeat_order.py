@@ -0,0 +1,107 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import Update
+
+import main
+import menu
+import database
+from database import Order
+
+USER_ID = 424242
+NOW = datetime.now(timezone.utc)
+MARGHERITA = {
+    "id": 7, "category": "Пиццы", "name": "Маргарита", "description": "",
+    "price_small": 500, "price_large": 700, "image_url": "",
+}
+
+
+class FakeCleanupConn:
+    # Выполняет DELETE из delete_old_completed_orders над списком строк: (статус отменён и старше $1) или (завершён и старше $2)
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, sql, cancelled_before, done_before):
+        deleted = [
+            row for row in self.rows
+            if (row["status"] == "cancelled" and row["created_at"] < cancelled_before)
+            or (row["status"] == "done" and row["created_at"] < done_before)
+        ]
+        self.rows[:] = [row for row in self.rows if row not in deleted]
+        return [{"id": row["id"]} for row in deleted]
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def acquire(self):
+        conn = self.conn
+
+        class Acquire:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+def _order_row(order_id, status, age):
+    return {
+        "id": order_id, "user_id": USER_ID, "status": status, "created_at": NOW - age,
+        "items": [{"name": "Маргарита (Большая)", "product": "Маргарита (Большая)", "price": 650, "quantity": 2,
+                   "product_id": MARGHERITA["id"], "size": "large"}],
+        "address": "ул. Ленина, 1", "phone": 79991234567,
+    }
+
+
+def _repeat_update(order_id):
+    return Update.model_validate({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1", "chat_instance": "1", "data": f"repeat_{order_id}",
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": USER_ID, "type": "private"}, "text": "Заказы"},
+        },
+    }, context={"bot": main.bot})
+
+
+def test_repeat_order_older_than_cleanup_window(monkeypatch):
+    # Завершённый заказ двухдневной давности: раньше уборка удаляла такие через час, и повторить его было нельзя
+    rows = [_order_row(101, "done", timedelta(days=2)), _order_row(102, "cancelled", timedelta(hours=2))]
+    monkeypatch.setattr(database, "pool", FakePool(FakeCleanupConn(rows)))
+    deleted = asyncio.run(main.cleanup_old_orders())
+    assert deleted == 1
+    assert [row["id"] for row in rows] == [101]
+
+    async def fake_get_order(order_id, columns=database.ORDER_COLUMNS):
+        row = next((row for row in rows if row["id"] == order_id), None)
+        return Order({**row, "items": main.json_dumps(row["items"])}) if row else None
+
+    sent = []
+
+    async def fake_request(bot, method, timeout=None):
+        sent.append(method)
+        return True
+
+    monkeypatch.setattr(main, "get_order", fake_get_order)
+    monkeypatch.setattr(main.bot.session, "make_request", fake_request)
+    monkeypatch.setattr(menu, "_snapshot", menu.MenuSnapshot(1, [MARGHERITA]))
+    main.user_carts.pop(USER_ID, None)
+
+    async def run():
+        result = await main.dp.feed_update(main.bot, _repeat_update(101))
+        state = await main.dp.fsm.get_context(main.bot, USER_ID, USER_ID).get_state()
+        return result, state
+
+    result, state = asyncio.run(run())
+    assert isinstance(result, AnswerCallbackQuery) and not result.show_alert
+    assert state == main.OrderFlow.waiting_for_payment.state
+    cart = main.user_carts[USER_ID]
+    assert [(item["name"], item["price_per_unit"], item["quantity"]) for item in cart.values()] == [
+        ("Маргарита (Большая)", 700, 2)
+    ]
+    assert any("Повтор заказа #101" in getattr(method, "text", "") for method in sent)
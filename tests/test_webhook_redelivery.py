@@ -0,0 +1,53 @@
+import asyncio
+
+from aiogram.methods import SendMessage
+from aiogram.types import Update
+
+import main
+
+USER_ID = 434343
+
+
+def _pay_update():
+    return Update.model_validate({
+        "update_id": 7,
+        "callback_query": {
+            "id": "777", "chat_instance": "1", "data": "pay_cash",
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Test"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": USER_ID, "type": "private"}, "text": "Оплата"},
+        },
+    }, context={"bot": main.bot})
+
+
+def test_redelivered_checkout_does_not_place_second_order(monkeypatch):
+    # Первая доставка падает после записи заказа; вебхук всё равно отвечает, а повтор того же апдейта не создаёт заказ
+    placed = []
+
+    async def fake_place_order(**kwargs):
+        placed.append(kwargs)
+        return 501, None
+
+    failures = [1]
+
+    async def fake_request(bot, method, timeout=None):
+        if isinstance(method, SendMessage) and failures:
+            failures.pop()
+            raise RuntimeError("Telegram недоступен")
+        return True
+
+    monkeypatch.setattr(main, "place_order", fake_place_order)
+    monkeypatch.setattr(main.bot.session, "make_request", fake_request)
+    main.user_carts[USER_ID] = {"7_l": {"name": "Маргарита (Большая)", "price_per_unit": 700, "quantity": 1}}
+
+    async def run():
+        state = main.dp.fsm.get_context(main.bot, USER_ID, USER_ID)
+        await state.set_state(main.OrderFlow.waiting_for_payment)
+        await state.update_data(address="ул. Ленина, 1", phone="+79991234567")
+        first = await main.dp.feed_webhook_update(main.bot, _pay_update())
+        second = await main.dp.feed_webhook_update(main.bot, _pay_update())
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is None
+    assert second is not None and second.text == "⏳ Заказ уже оформлен"
+    assert len(placed) == 1
@@ -0,0 +1,67 @@
+import time
+import logging
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery
+
+from session_store import TimerWheel, TTLStore
+
+logger = logging.getLogger(__name__)
+
+# Класс обработчика задаётся флагом: @dp.callback_query(..., flags={"throttle": "tap"}).
+# (скорость пополнения в секунду, ёмкость корзины) — ёмкость допускает короткую серию нажатий
+THROTTLE_RATES = {
+    "tap": (5.0, 15),  # +/- в корзине, ингредиенты "Собери сам": дёшево, нажимают быстро
+    "default": (2.0, 8),
+    "heavy": (0.5, 3),  # категория меню — пачка фото на каждое нажатие
+    "checkout": (0.2, 3),  # оформление и повтор заказа
+}
+THROTTLE_MAX_ENTRIES = 50000
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Token bucket на пару (пользователь, класс обработчика). Корзины лежат в TTLStore: после полного
+    # пополнения корзина неотличима от новой, поэтому вытеснение по TTL и LRU ничего не теряет
+    def __init__(self, wheel: TimerWheel, rates: dict = THROTTLE_RATES, max_entries: int = THROTTLE_MAX_ENTRIES):
+        self.rates = rates
+        ttl = max(burst / rate for rate, burst in rates.values())
+        self._buckets = TTLStore(wheel, "throttle", ttl=ttl, max_entries=max_entries)
+        self.throttled = 0
+
+    def _take(self, key, rate: float, burst: int, now: float) -> bool:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [burst - 1, now]
+            return True
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        kind = get_flag(data, "throttle", default="default")
+        rate, burst = self.rates.get(kind) or self.rates["default"]
+        if self._take((user.id, kind), rate, burst, time.monotonic()):
+            return await handler(event, data)
+
+        self.throttled += 1
+        logger.debug("🐢 Апдейт пользователя %s отброшен (лимит %s)", user.id, kind)
+        if isinstance(event, CallbackQuery):
+            # Иначе у кнопки крутятся часики; ответ уходит в теле ответа на вебхук
+            return event.answer("⏳ Слишком часто — подождите секунду")
+        return None
+
+
+def setup_throttling(dp, wheel: TimerWheel) -> ThrottlingMiddleware:
+    # Внутренний middleware: к этому моменту обработчик уже выбран и его флаги известны
+    middleware = ThrottlingMiddleware(wheel)
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
+    return middleware
@@ -0,0 +1,148 @@
+import os
+import re
+import hmac
+import time
+import queue
+import atexit
+import hashlib
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from aiohttp import web
+
+from config import RECORD_UPDATES, RECORD_MAX_BYTES, RECORD_BACKUPS, RECORD_SALT
+from fast_runtime import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+_ID_PARENTS = ("from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat")
+_NAME_FIELDS = ("first_name", "last_name", "username", "title", "bio")
+# Тексты бота в callback_query.message могут содержать адрес и телефон заказа — не сохраняем их
+_BOT_TEXT_FIELDS = ("text", "caption", "entities", "caption_entities")
+
+
+def pseudonymize_id(value: int) -> int:
+    digest = hmac.new(RECORD_SALT, str(abs(value)).encode(), hashlib.sha256).digest()
+    pseudo = int.from_bytes(digest[:6], "big") or 1
+    # Знак сохраняется: отрицательные id — группы (например, чат кухни)
+    return -pseudo if value < 0 else pseudo
+
+
+def _pseudo_digits(value: str, count: int) -> str:
+    digest = hmac.new(RECORD_SALT, value.encode(), hashlib.sha256).hexdigest()
+    return str(int(digest, 16))[:count]
+
+
+# Номер, введённый текстом: "+7 952 114-87-67", "89521148767"
+_PHONE_TEXT = re.compile(r"\+?[\d\s()-]{10,20}")
+
+
+def pseudonymize_phone(value: str) -> str:
+    # Валидный российский номер, одинаковый для одного и того же исходного номера в любом написании
+    digits = "".join(ch for ch in value if ch.isdigit())
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    return "+7900" + _pseudo_digits(digits, 7)
+
+
+class Anonymizer:
+    # Заменяет персональные данные в апдейте, сохраняя то, от чего зависит поведение бота:
+    # команды, кнопки клавиатуры, callback_data, inline-запросы и длину свободного текста
+    def __init__(self, keep_texts=()):
+        self.keep_texts = frozenset(keep_texts)
+
+    def scrub_text(self, text: str) -> str:
+        if text in self.keep_texts:
+            return text
+        if text.startswith("/"):
+            # Аргументы команд (/broadcast текст) отбрасываем, саму команду оставляем
+            return text.split(maxsplit=1)[0]
+        if _PHONE_TEXT.fullmatch(text) and 10 <= sum(ch.isdigit() for ch in text) <= 15:
+            # Телефон подменяется правдоподобным номером: иначе при воспроизведении handle_phone_text
+            # отклонит его, и записанная сессия не дойдёт до оплаты и save_order
+            return pseudonymize_phone(text)
+        # Свободный текст — это адрес или сообщение пользователя
+        return "x" * len(text)
+
+    def scrub(self, obj, parent: str = None):
+        if isinstance(obj, list):
+            return [self.scrub(value, parent) for value in obj]
+        if not isinstance(obj, dict):
+            return obj
+        result = {}
+        for key, value in obj.items():
+            if key == "id" and parent in _ID_PARENTS and isinstance(value, int):
+                value = pseudonymize_id(value)
+            elif key == "user_id" and isinstance(value, int):
+                value = pseudonymize_id(value)
+            elif key in _NAME_FIELDS and isinstance(value, str):
+                value = f"{key}_{_pseudo_digits(value, 6)}"
+            elif key == "phone_number" and isinstance(value, str):
+                value = pseudonymize_phone(value)
+            elif key in ("latitude", "longitude"):
+                value = 0.0
+            elif key == "message" and parent == "callback_query" and isinstance(value, dict):
+                value = self.scrub({k: v for k, v in value.items() if k not in _BOT_TEXT_FIELDS}, key)
+            elif key in ("text", "caption") and isinstance(value, str):
+                value = self.scrub_text(value)
+            elif key in ("entities", "caption_entities"):
+                value = []
+            else:
+                value = self.scrub(value, key)
+            result[key] = value
+        return result
+
+
+def _open_writer(path: str) -> logging.Logger:
+    # Запись в файл и ротация — в фоновом потоке, как у основного лога: обработка запроса не ждёт диск
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    file_handler = RotatingFileHandler(path, maxBytes=RECORD_MAX_BYTES, backupCount=RECORD_BACKUPS, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+    record_queue = queue.SimpleQueue()
+    listener = QueueListener(record_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    writer = logging.getLogger("traffic.recorder")
+    writer.handlers[:] = [QueueHandler(record_queue)]
+    writer.setLevel(logging.INFO)
+    writer.propagate = False
+    return writer
+
+
+def traffic_recorder(webhook_path: str, keep_texts=()):
+    # aiohttp-middleware перед SimpleRequestHandler. None, если запись не включена
+    if not RECORD_UPDATES:
+        return None
+    writer = _open_writer(RECORD_UPDATES)
+    anonymizer = Anonymizer(keep_texts)
+    logger.info("📼 Запись апдейтов включена: %s", RECORD_UPDATES)
+
+    @web.middleware
+    async def record_updates(request: web.Request, handler):
+        if request.method == "POST" and request.path == webhook_path:
+            arrived = time.time()
+            try:
+                # Тело кэшируется aiohttp — SimpleRequestHandler прочитает его повторно без копирования из сокета
+                update = json_loads(await request.read())
+                writer.info(json_dumps({"ts": arrived, "update": anonymizer.scrub(update)}))
+            except Exception as e:
+                logger.warning("⚠️ Не удалось записать апдейт: %s", e)
+        return await handler(request)
+
+    return record_updates
+
+
+def read_recording(path: str):
+    # Строки записи по порядку поступления: (ts, update). Повреждённая последняя строка пропускается
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json_loads(line)
+            except ValueError:
+                logger.warning("⚠️ Пропущена повреждённая строка записи")
+                continue
+            yield entry["ts"], entry["update"]